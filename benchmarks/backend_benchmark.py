@@ -0,0 +1,106 @@
+"""
+Compare the native-protocol client with the HTTP + Arrow client on the ods
+day read and on the insert into dwm_standard_daily_billing_calculated.
+
+Every variant runs in its own process with a copy of config.yaml whose
+clickhouse.backend (and etl.reader for the native reads) is overridden:
+native/rows (execute_iter), native/blocks (NumPy blocks) and http/arrow.
+MB/s is the server-side network byte count, as in transfer_benchmark.
+
+    python -m benchmarks.backend_benchmark --invoice-month 202601 --usage-day 2026-01-15 \
+        --insert-rows 200000 --http-port 8443
+"""
+import argparse
+import os
+import tempfile
+import uuid
+from datetime import date
+
+from benchmarks.common import (mb_per_s, network_bytes, recorded_query_ids, run_isolated,
+                               synthetic_calculated_frame, timed, write_config)
+from benchmarks.transfer_benchmark import SOURCE_TABLE, _fmt
+
+VARIANTS = [
+    ('native', 'rows'),
+    ('native', 'blocks'),
+    ('http', 'arrow'),
+]
+
+
+def _run_backend(config_path, invoice_month, usage_day, table, insert_rows, batch_size):
+    from billing_calculation_service import BillingCalculationService
+
+    service = BillingCalculationService(config_path)
+    result = {}
+
+    first_query = len(service.stats)
+    iterator = service.get_standard_daily_billing_iterator(invoice_month, usage_day)
+    read_rows, read_seconds = timed(lambda: sum(len(batch) for batch in iterator))
+    read_queries = recorded_query_ids(service, first_query)
+    result.update(read_rows=read_rows, read_rows_per_s=read_rows / read_seconds if read_seconds else 0.0,
+                  read_seconds=read_seconds)
+
+    df = synthetic_calculated_frame(insert_rows, invoice_month=invoice_month, usage_day=usage_day)
+    query = f'INSERT INTO {table} VALUES'
+    first_query = len(service.stats)
+    insert_seconds = 0.0
+    for start in range(0, insert_rows, batch_size):
+        _, seconds = timed(service.client.insert_dataframe, query, df.iloc[start:start + batch_size])
+        insert_seconds += seconds
+    insert_queries = recorded_query_ids(service, first_query)
+    result.update(insert_rows_per_s=insert_rows / insert_seconds if insert_seconds else 0.0,
+                  insert_seconds=insert_seconds)
+
+    # 服务端 query_log 记录的网络字节数(压缩后、TLS 前)
+    sent, _ = network_bytes(service, read_queries)
+    _, received = network_bytes(service, insert_queries)
+    result.update(read_mb_per_s=mb_per_s(sent, read_seconds), insert_mb_per_s=mb_per_s(received, insert_seconds))
+
+    service.close()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the native client against the HTTP + Arrow client')
+    parser.add_argument('--config', default='config.yaml')
+    parser.add_argument('--invoice-month', required=True)
+    parser.add_argument('--usage-day', required=True, type=date.fromisoformat)
+    parser.add_argument('--http-port', type=int, default=None, help='defaults to clickhouse.http_port / 8443')
+    parser.add_argument('--insert-rows', type=int, default=200000)
+    parser.add_argument('--batch-size', type=int, default=10000)
+    args = parser.parse_args()
+
+    from billing_calculation_service import BillingCalculationService
+
+    table = f"billing.bench_backend_{uuid.uuid4().hex[:8]}"
+    service = BillingCalculationService(args.config)
+    service.execute_sql(f"CREATE TABLE {table} AS {SOURCE_TABLE}")
+
+    rows = []
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            for backend, reader in VARIANTS:
+                overrides = {'backend': backend}
+                if args.http_port:
+                    overrides['http_port'] = args.http_port
+                config_path = write_config(args.config, overrides, os.path.join(tmp, f"config_{backend}_{reader}.yaml"),
+                                           etl_overrides={'reader': reader} if backend == 'native' else None)
+                result = run_isolated(_run_backend, config_path, args.invoice_month, args.usage_day,
+                                      table, args.insert_rows, args.batch_size)
+                rows.append((backend, reader, result))
+    finally:
+        service.execute_sql(f"DROP TABLE IF EXISTS {table}")
+        service.close()
+
+    print(f"{'backend':<9}{'reader':<8}{'read rows/s':>14}{'read MB/s':>11}"
+          f"{'insert rows/s':>15}{'insert MB/s':>13}{'peak RSS MB':>13}")
+    for backend, reader, r in rows:
+        if 'error' in r:
+            print(f"{backend:<9}{reader:<8}  error: {r['error']}")
+            continue
+        print(f"{backend:<9}{reader:<8}{r['read_rows_per_s']:>14.0f}{_fmt(r['read_mb_per_s'], '>11.2f')}"
+              f"{r['insert_rows_per_s']:>15.0f}{_fmt(r['insert_mb_per_s'], '>13.2f')}{r['peak_rss_mb']:>13.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""
+Memory of one batch between the reader and the writer: contract tagging,
+calculate_with_credits and the InsertPlan coercion, without a cluster.
+
+copy     calculates on a copy of the batch and deep-copies the insert frame
+         (the former lifecycle)
+inplace  fills the result columns into the batch and hands the plan's
+         frame, sharing the batch's arrays, to the writer
+
+Each mode runs in its own process and reports the peak memory allocated
+per batch (tracemalloc, numpy buffers included) and the process peak RSS.
+
+    python -m benchmarks.batch_memory_benchmark --rows 200000 --batch-size 10000
+"""
+import argparse
+import tracemalloc
+
+from benchmarks.common import run_isolated, timed
+
+
+def _run_batches(rows, batch_size, copy, money_mode):
+    from calculate.service import CalculateService
+    from client.local_backend import CALCULATED_TABLE_SCHEMA
+    from client.table_schema import InsertPlan
+    from benchmarks.make_local_dataset import synthetic_dim_contract, synthetic_ods_day
+
+    ods = synthetic_ods_day(rows, '202601', '2026-01-01')
+    matcher = CalculateService.contract_matcher(synthetic_dim_contract(ods, '2026-01'))
+    plan = InsertPlan(CALCULATED_TABLE_SCHEMA)
+
+    tracemalloc.start()
+    peaks = []
+    elapsed = 0.0
+    for start in range(0, rows, batch_size):
+        # 与读取器一致: 每个批次是独立分配的 DataFrame
+        batch = ods.iloc[start:start + batch_size].reset_index(drop=True)
+        tracemalloc.reset_peak()
+        base, _ = tracemalloc.get_traced_memory()
+
+        def process():
+            calculated = CalculateService.calculate_with_credits(batch, matcher, money_mode=money_mode, copy=copy)
+            frame = plan.apply(calculated)
+            return frame.copy() if copy else frame
+
+        frame, seconds = timed(process)
+        elapsed += seconds
+        peaks.append(tracemalloc.get_traced_memory()[1] - base)
+        del frame, batch
+    tracemalloc.stop()
+    return {'mode': 'copy' if copy else 'inplace', 'rows': rows, 'seconds': elapsed,
+            'batch_peak_mb': max(peaks) / (1024 * 1024),
+            'batch_mean_mb': sum(peaks) / len(peaks) / (1024 * 1024)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark per-batch memory of the calculation pipeline')
+    parser.add_argument('--rows', type=int, default=200000)
+    parser.add_argument('--batch-size', type=int, default=10000)
+    parser.add_argument('--money-mode', default='float', help='float | fixed')
+    args = parser.parse_args()
+
+    results = [run_isolated(_run_batches, args.rows, args.batch_size, copy, args.money_mode)
+               for copy in (True, False)]
+
+    print(f"{'mode':<10}{'rows':>10}{'seconds':>10}{'batch peak MB':>16}{'batch mean MB':>16}{'peak RSS MB':>14}")
+    for r in results:
+        if 'error' in r:
+            print(f"error: {r['error']}")
+            continue
+        print(f"{r['mode']:<10}{r['rows']:>10}{r['seconds']:>10.2f}{r['batch_peak_mb']:>16.1f}"
+              f"{r['batch_mean_mb']:>16.1f}{r['peak_rss_mb']:>14.1f}")
+
+
+if __name__ == '__main__':
+    main()
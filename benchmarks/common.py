@@ -0,0 +1,167 @@
+import multiprocessing
+import resource
+import sys
+import time
+from datetime import date, datetime
+
+import numpy as np
+import pandas as pd
+
+# Column order of billing.dwm_standard_daily_billing_calculated
+CALCULATED_COLUMNS = [
+    'usage_day', 'invoice_month', 'billing_account_id',
+    'customer_id', 'contract_id',
+    'service_id', 'service_description',
+    'sku_id', 'sku_description',
+    'project_id', 'project_name',
+    'usage_pricing_unit', 'usage_amount_in_pricing_units',
+    'currency', 'currency_conversion_rate',
+    'cost_type',
+    'cost', 'cost_at_list',
+    'c_cud', 'c_cud_db', 'c_discount', 'c_free_tier',
+    'c_promotion', 'c_rm', 'c_sub_benefit', 'c_sud',
+    'internal_credits_cost', 'internal_credits_consumption',
+    'internal_cost', 'internal_consumption',
+    'external_consumption', 'discount_amount',
+    'mode', 'price', 'discount',
+    'credit_fields', 'etl_time'
+]
+
+STRING_COLUMNS = ['invoice_month', 'billing_account_id', 'service_id', 'service_description',
+                  'sku_id', 'sku_description', 'project_id', 'project_name',
+                  'usage_pricing_unit', 'currency', 'cost_type', 'credit_fields']
+NULLABLE_STRING_COLUMNS = ['customer_id', 'contract_id']
+
+
+def peak_rss_mb():
+    """Peak resident set size of the current process in MB."""
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is bytes on macOS, KB on Linux
+    return rss / (1024 * 1024) if sys.platform == 'darwin' else rss / 1024
+
+
+def recorded_query_ids(service, start=0):
+    """Query ids recorded by service's QueryStatsRecorder, from the start-th record on."""
+    return service.stats.to_dataframe()['query_id'].iloc[start:].dropna().tolist()
+
+
+def network_bytes(service, query_ids):
+    """
+    (bytes the server sent, bytes it received) for query_ids, from the
+    NetworkSendBytes / NetworkReceiveBytes profile events in system.query_log:
+    the protocol payload on the server's sockets, after compression and
+    before TLS. (None, None) when the queries are not in query_log.
+    """
+    if not query_ids:
+        return None, None
+    service.execute_sql("SYSTEM FLUSH LOGS")
+    rows = service.client.execute(
+        """
+            SELECT count(), sum(ProfileEvents['NetworkSendBytes']), sum(ProfileEvents['NetworkReceiveBytes'])
+            FROM system.query_log
+            WHERE event_date >= yesterday()
+              AND type = 'QueryFinish'
+              AND query_id IN %(query_ids)s
+        """,
+        params={'query_ids': tuple(query_ids)},
+        tag='network_bytes'
+    )
+    if not rows or not rows[0][0]:
+        return None, None
+    return int(rows[0][1]), int(rows[0][2])
+
+
+def mb_per_s(n_bytes, seconds):
+    if n_bytes is None or not seconds:
+        return None
+    return n_bytes / (1024 * 1024) / seconds
+
+
+def write_config(config_path, overrides, target_path, etl_overrides=None):
+    """Copy config_path to target_path with the clickhouse (and etl) sections updated by overrides."""
+    import yaml
+
+    with open(config_path, 'r') as f:
+        config = yaml.safe_load(f) or {}
+    config.setdefault('clickhouse', {}).update(overrides)
+    if etl_overrides:
+        config.setdefault('etl', {}).update(etl_overrides)
+    with open(target_path, 'w') as f:
+        yaml.safe_dump(config, f)
+    return target_path
+
+
+def _isolated_target(queue, fn, args):
+    try:
+        result = fn(*args)
+        result['peak_rss_mb'] = peak_rss_mb()
+        queue.put(result)
+    except Exception as e:
+        queue.put({'error': repr(e)})
+
+
+def run_isolated(fn, *args):
+    """
+    Run fn(*args) in a fresh process so peak RSS is not polluted by earlier runs.
+    fn must return a dict; peak_rss_mb is added to it.
+    """
+    ctx = multiprocessing.get_context('spawn')
+    queue = ctx.Queue()
+    proc = ctx.Process(target=_isolated_target, args=(queue, fn, args))
+    proc.start()
+    result = queue.get()
+    proc.join()
+    return result
+
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def synthetic_calculated_frame(rows, invoice_month='202601', usage_day=date(2026, 1, 1), seed=0):
+    """
+    A DataFrame shaped like the output of _insert_calculated_data
+    (final column order and dtypes), with realistic cardinalities.
+    """
+    rng = np.random.default_rng(seed)
+    accounts = np.array([f"01{i:04X}-{i * 7919 % 0xFFFFFF:06X}-{i * 104729 % 0xFFFFFF:06X}" for i in range(2000)], dtype=object)
+    services = np.array([f"service-{i}" for i in range(300)], dtype=object)
+    skus = np.array([f"{i:04X}-{i * 31 % 0xFFFF:04X}-{i * 17 % 0xFFFF:04X}" for i in range(5000)], dtype=object)
+    projects = np.array([f"project-{i}" for i in range(8000)], dtype=object)
+
+    sku_idx = rng.integers(0, len(skus), rows)
+    service_idx = sku_idx % len(services)
+
+    df = pd.DataFrame({
+        'usage_day': np.full(rows, usage_day, dtype=object),
+        'invoice_month': np.full(rows, invoice_month, dtype=object),
+        'billing_account_id': accounts[rng.integers(0, len(accounts), rows)],
+        'customer_id': np.where(rng.random(rows) < 0.3, None, 'customer-1').astype(object),
+        'contract_id': np.where(rng.random(rows) < 0.3, None, 'contract-1').astype(object),
+        'service_id': services[service_idx],
+        'service_description': services[service_idx],
+        'sku_id': skus[sku_idx],
+        'sku_description': skus[sku_idx],
+        'project_id': projects[rng.integers(0, len(projects), rows)],
+        'project_name': projects[rng.integers(0, len(projects), rows)],
+        'usage_pricing_unit': np.full(rows, 'hour', dtype=object),
+        'usage_amount_in_pricing_units': rng.random(rows) * 100,
+        'currency': np.full(rows, 'USD', dtype=object),
+        'currency_conversion_rate': np.ones(rows),
+        'cost_type': np.full(rows, 'regular', dtype=object),
+    })
+    for col in ['cost', 'cost_at_list', 'c_cud', 'c_cud_db', 'c_discount', 'c_free_tier',
+                'c_promotion', 'c_rm', 'c_sub_benefit', 'c_sud',
+                'internal_credits_cost', 'internal_credits_consumption',
+                'internal_cost', 'internal_consumption',
+                'external_consumption', 'discount_amount']:
+        df[col] = rng.random(rows) * 10
+    df['mode'] = rng.integers(0, 5, rows).astype('int8')
+    df['price'] = rng.random(rows)
+    df['discount'] = rng.random(rows)
+    df['credit_fields'] = np.full(rows, 'c_cud/c_sud', dtype=object)
+    df['etl_time'] = datetime.now()
+    return df[CALCULATED_COLUMNS]
+
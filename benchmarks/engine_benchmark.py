@@ -0,0 +1,64 @@
+"""
+Compare the CalculateService engines on the same synthetic batches:
+rows/s of calculate_with_credits (contract tagging included) and whether
+the result columns match the pandas engine bit for bit.
+
+    python -m benchmarks.engine_benchmark --rows 500000 --batch-size 10000
+"""
+import argparse
+
+import numpy as np
+
+from benchmarks.common import timed
+
+RESULT_COLUMNS = ['internal_cost', 'internal_consumption', 'external_consumption', 'discount_amount']
+
+ENGINES = {
+    'pandas': dict(engine='pandas'),
+    'numpy': dict(engine='numpy'),
+    'fixed': dict(money_mode='fixed'),
+}
+
+
+def _run_engine(ods, matcher, batch_size, options):
+    from calculate.service import CalculateService
+
+    results = []
+    elapsed = 0.0
+    for start in range(0, len(ods), batch_size):
+        batch = ods.iloc[start:start + batch_size].reset_index(drop=True)
+        calculated, seconds = timed(CalculateService.calculate_with_credits, batch, matcher, copy=False,
+                                    **options)
+        elapsed += seconds
+        results.append(calculated[RESULT_COLUMNS].to_numpy())
+    return np.concatenate(results), elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark CalculateService engines')
+    parser.add_argument('--rows', type=int, default=500000)
+    parser.add_argument('--batch-size', type=int, default=10000)
+    parser.add_argument('--engines', default='pandas,numpy,fixed')
+    args = parser.parse_args()
+
+    from calculate.service import CalculateService
+    from benchmarks.make_local_dataset import synthetic_dim_contract, synthetic_ods_day
+
+    ods = synthetic_ods_day(args.rows, '202601', '2026-01-01')
+    matcher = CalculateService.contract_matcher(synthetic_dim_contract(ods, '2026-01'))
+
+    reference = None
+    print(f"{'engine':<10}{'rows':>10}{'seconds':>10}{'rows/s':>14}{'max abs diff':>16}{'identical':>11}")
+    for name in args.engines.split(','):
+        values, seconds = _run_engine(ods, matcher, args.batch_size, ENGINES[name])
+        if reference is None:
+            reference = values
+        same_nan = np.array_equal(np.isnan(values), np.isnan(reference))
+        diff = np.nanmax(np.abs(values - reference)) if len(values) else 0.0
+        identical = same_nan and np.array_equal(values[~np.isnan(values)], reference[~np.isnan(reference)])
+        print(f"{name:<10}{len(ods):>10}{seconds:>10.2f}{len(ods) / seconds if seconds else 0:>14.0f}"
+              f"{diff:>16.3g}{str(identical):>11}")
+
+
+if __name__ == '__main__':
+    main()
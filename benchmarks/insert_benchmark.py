@@ -0,0 +1,62 @@
+"""
+Compare the columnar (NumPy) insert path with the list-of-tuples path.
+
+Each mode runs in its own process against a scratch copy of
+dwm_standard_daily_billing_calculated, reporting rows/s and peak RSS.
+
+    python -m benchmarks.insert_benchmark --rows 200000 --batch-size 10000
+"""
+import argparse
+import uuid
+
+from benchmarks.common import run_isolated, synthetic_calculated_frame, timed
+
+SOURCE_TABLE = 'billing.dwm_standard_daily_billing_calculated'
+
+
+def _run_insert(config_path, table, rows, batch_size, columnar):
+    from billing_calculation_service import BillingCalculationService
+
+    service = BillingCalculationService(config_path)
+    df = synthetic_calculated_frame(rows)
+    query = f'INSERT INTO {table} VALUES'
+
+    elapsed = 0.0
+    for start in range(0, rows, batch_size):
+        batch = df.iloc[start:start + batch_size]
+        _, seconds = timed(service.client.insert_dataframe, query, batch, columnar=columnar)
+        elapsed += seconds
+    service.client.close()
+    return {'mode': 'columnar' if columnar else 'tuples', 'rows': rows,
+            'seconds': elapsed, 'rows_per_s': rows / elapsed if elapsed else 0.0}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark insert_dataframe paths')
+    parser.add_argument('--config', default='config.yaml')
+    parser.add_argument('--rows', type=int, default=200000)
+    parser.add_argument('--batch-size', type=int, default=10000)
+    args = parser.parse_args()
+
+    from billing_calculation_service import BillingCalculationService
+
+    table = f"billing.bench_insert_{uuid.uuid4().hex[:8]}"
+    service = BillingCalculationService(args.config)
+    service.execute_sql(f"CREATE TABLE {table} AS {SOURCE_TABLE}")
+    try:
+        results = [run_isolated(_run_insert, args.config, table, args.rows, args.batch_size, columnar)
+                   for columnar in (False, True)]
+    finally:
+        service.execute_sql(f"DROP TABLE IF EXISTS {table}")
+        service.client.close()
+
+    print(f"{'mode':<10}{'rows':>10}{'seconds':>10}{'rows/s':>14}{'peak RSS MB':>14}")
+    for r in results:
+        if 'error' in r:
+            print(f"error: {r['error']}")
+            continue
+        print(f"{r['mode']:<10}{r['rows']:>10}{r['seconds']:>10.2f}{r['rows_per_s']:>14.0f}{r['peak_rss_mb']:>14.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+"""
+Generate a synthetic ods_standard_daily_billing month and a matching
+dim_contract month as Parquet files for the local backend
+(clickhouse.backend: local).
+
+Cardinalities follow synthetic_calculated_frame; dim_contract holds one
+contract per account plus project / service / SKU level overrides so every
+matching rule of CalculateService.add_rule_tag is exercised.
+
+    python -m benchmarks.make_local_dataset --invoice-month 202601 --days 31 --rows-per-day 200000 \
+        --out data/local
+"""
+import argparse
+import calendar
+import os
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.common import synthetic_calculated_frame
+
+ODS_COLUMNS = [
+    'invoice_month', 'billing_account_id', 'usage_day', 'project_id', 'service_id', 'service_description',
+    'sku_id', 'cost_type', 'usage_amount_in_pricing_units', 'cost', 'cost_at_list',
+    'c_cud', 'c_cud_db', 'c_discount', 'c_free_tier', 'c_promotion', 'c_rm', 'c_sub_benefit', 'c_sud',
+    'internal_credits_cost', 'internal_credits_consumption',
+]
+
+CREDIT_FIELDS = ['c_cud', 'c_cud/c_sud', 'c_discount/c_promotion', 'c_free_tier']
+
+
+def synthetic_ods_day(rows, invoice_month, usage_day, seed=0):
+    df = synthetic_calculated_frame(rows, invoice_month=invoice_month, usage_day=usage_day, seed=seed)
+    df['internal_credits_cost'] = df[['c_cud', 'c_cud_db', 'c_discount', 'c_free_tier', 'c_promotion', 'c_rm',
+                                      'c_sub_benefit', 'c_sud']].sum(axis=1) * -1
+    df['internal_credits_consumption'] = df['internal_credits_cost'] + df['c_rm']
+    return df[ODS_COLUMNS]
+
+
+def synthetic_dim_contract(ods_df, dim_month, seed=0):
+    rng = np.random.default_rng(seed)
+    accounts = ods_df['billing_account_id'].drop_duplicates().to_numpy()
+    base = pd.DataFrame({
+        'billing_account_id': accounts,
+        'project_id': None,
+        'service_description': None,
+        'sku_id': None,
+    })
+    sample = ods_df.sample(n=min(len(ods_df), len(accounts) * 2), random_state=seed)
+    overrides = []
+    for keys in (['project_id'], ['service_description'], ['sku_id'], ['project_id', 'sku_id'],
+                 ['service_description', 'sku_id'], ['project_id', 'service_description'],
+                 ['project_id', 'service_description', 'sku_id']):
+        part = sample[['billing_account_id'] + keys].drop_duplicates().head(len(accounts) // 4)
+        overrides.append(part)
+    dim = pd.concat([base] + overrides, ignore_index=True)
+    dim = dim.astype({'project_id': object, 'service_description': object, 'sku_id': object})
+    dim = dim.where(dim.notna(), None)
+
+    n = len(dim)
+    dim.insert(0, 'month', dim_month)
+    dim['mode'] = rng.integers(1, 5, n).astype('int8')
+    dim['discount'] = rng.uniform(0.8, 1.0, n).round(4)
+    dim['price'] = rng.uniform(0.5, 1.5, n).round(4)
+    dim['credit_fields'] = np.array(CREDIT_FIELDS, dtype=object)[rng.integers(0, len(CREDIT_FIELDS), n)]
+    dim['customer_id'] = [f"customer-{i % 500}" for i in range(n)]
+    dim['contract_id'] = [f"contract-{i}" for i in range(n)]
+    return dim
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate local ods / dim_contract Parquet files')
+    parser.add_argument('--invoice-month', default='202601')
+    parser.add_argument('--days', type=int, default=None, help='defaults to the whole month')
+    parser.add_argument('--rows-per-day', type=int, default=100000)
+    parser.add_argument('--out', default='data/local')
+    args = parser.parse_args()
+
+    year, month = int(args.invoice_month[:4]), int(args.invoice_month[4:])
+    days = args.days or calendar.monthrange(year, month)[1]
+    first_day = date(year, month, 1)
+
+    os.makedirs(args.out, exist_ok=True)
+    ods_df = pd.concat(
+        [synthetic_ods_day(args.rows_per_day, args.invoice_month, first_day + timedelta(days=i), seed=i)
+         for i in range(days)],
+        ignore_index=True
+    )
+    dim_df = synthetic_dim_contract(ods_df, f"{year:04d}-{month:02d}")
+
+    ods_path = os.path.join(args.out, f"ods_standard_daily_billing_{args.invoice_month}.parquet")
+    dim_path = os.path.join(args.out, f"dim_contract_{args.invoice_month}.parquet")
+    ods_df.to_parquet(ods_path, index=False)
+    dim_df.to_parquet(dim_path, index=False)
+    print(f"{ods_path}: {len(ods_df)} rows")
+    print(f"{dim_path}: {len(dim_df)} rows")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""
+Run month_task_day end to end on the local backend (no ClickHouse cluster
+needed) and report rows/s, peak RSS and the query statistics per caller,
+optionally under cProfile.
+
+    python -m benchmarks.make_local_dataset --invoice-month 202601 --days 3 --rows-per-day 100000
+    python -m benchmarks.profile_local_run --invoice-month 202601 \
+        --ods data/local/ods_standard_daily_billing_202601.parquet \
+        --dim-contract data/local/dim_contract_202601.parquet --profile logs/month_task_day.prof
+"""
+import argparse
+import cProfile
+import os
+import pstats
+import tempfile
+
+from benchmarks.common import peak_rss_mb, timed, write_config
+
+TARGET_TABLE = 'dwm_standard_daily_billing_calculated_tmp'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Profile month_task_day on the local backend')
+    parser.add_argument('--config', default='config.yaml')
+    parser.add_argument('--invoice-month', required=True)
+    parser.add_argument('--ods', required=True, help='ods_standard_daily_billing Parquet/CSV file')
+    parser.add_argument('--dim-contract', required=True, help='dim_contract Parquet/CSV file')
+    parser.add_argument('--reader', default=None, help='rows | blocks, defaults to etl.reader')
+    parser.add_argument('--profile', default=None, help='write cProfile stats to this file')
+    parser.add_argument('--top', type=int, default=30, help='functions to print from the profile')
+    args = parser.parse_args()
+
+    from billing_calculation_service import BillingCalculationService
+    from main import month_task_day
+
+    with tempfile.TemporaryDirectory() as tmp:
+        config_path = write_config(args.config, {
+            'backend': 'local',
+            'local': {'ods': args.ods, 'dim_contract': args.dim_contract, 'capture_inserts': False},
+        }, os.path.join(tmp, 'config_local.yaml'))
+        service = BillingCalculationService(config_path)
+    if args.reader:
+        service.reader = args.reader
+
+    profiler = cProfile.Profile() if args.profile else None
+    if profiler:
+        profiler.enable()
+    _, seconds = timed(month_task_day, args.invoice_month, usage_day_start=None, usage_day_end=None,
+                       target_table=TARGET_TABLE, calc_service=service)
+    if profiler:
+        profiler.disable()
+
+    stats_df = service.stats.to_dataframe()
+    inserted = service.client.execute(f"SELECT count() FROM billing.{TARGET_TABLE}")[0][0]
+    service.close()
+
+    print(f"rows inserted: {inserted}  seconds: {seconds:.2f}  rows/s: {inserted / seconds if seconds else 0:.0f}"
+          f"  peak RSS MB: {peak_rss_mb():.1f}")
+    if not stats_df.empty:
+        print(stats_df.groupby('tag').agg(queries=('query_id', 'count'), client_seconds=('client_seconds', 'sum'),
+                                          rows=('result_rows', 'sum')).to_string())
+    if profiler:
+        directory = os.path.dirname(args.profile)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        profiler.dump_stats(args.profile)
+        pstats.Stats(args.profile).sort_stats('cumulative').print_stats(args.top)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+"""
+Measure transfer throughput of the ods day read and of the insert into
+dwm_standard_daily_billing_calculated under different wire settings
+(native protocol compression, block size, socket buffers).
+
+Each setting runs in its own process with a copy of config.yaml whose
+clickhouse section is overridden. MB/s is the network traffic of the
+benchmark's queries as counted by the server (NetworkSendBytes /
+NetworkReceiveBytes in system.query_log): the protocol payload after
+compression, without TLS overhead. It needs query_log and the right to run
+SYSTEM FLUSH LOGS, and is n/a otherwise.
+
+    python -m benchmarks.transfer_benchmark --invoice-month 202601 --usage-day 2026-01-15 \
+        --compression none,lz4,zstd --block-sizes 65536,100000 --socket-buffer 4194304
+"""
+import argparse
+import itertools
+import os
+import tempfile
+import uuid
+from datetime import date
+
+from benchmarks.common import (mb_per_s, network_bytes, recorded_query_ids, run_isolated,
+                               synthetic_calculated_frame, timed, write_config)
+
+SOURCE_TABLE = 'billing.dwm_standard_daily_billing_calculated'
+
+
+def _run_transfer(config_path, invoice_month, usage_day, table, insert_rows, batch_size):
+    from billing_calculation_service import BillingCalculationService
+
+    service = BillingCalculationService(config_path)
+    result = {}
+
+    first_query = len(service.stats)
+    iterator = service.get_standard_daily_billing_iterator(invoice_month, usage_day)
+    read_rows, read_seconds = timed(lambda: sum(len(batch) for batch in iterator))
+    read_queries = recorded_query_ids(service, first_query)
+    result.update(read_rows=read_rows, read_rows_per_s=read_rows / read_seconds if read_seconds else 0.0,
+                  read_seconds=read_seconds)
+
+    df = synthetic_calculated_frame(insert_rows, invoice_month=invoice_month, usage_day=usage_day)
+    query = f'INSERT INTO {table} VALUES'
+    first_query = len(service.stats)
+    insert_seconds = 0.0
+    for start in range(0, insert_rows, batch_size):
+        _, seconds = timed(service.client.insert_dataframe, query, df.iloc[start:start + batch_size])
+        insert_seconds += seconds
+    insert_queries = recorded_query_ids(service, first_query)
+    result.update(insert_rows=insert_rows, insert_rows_per_s=insert_rows / insert_seconds if insert_seconds else 0.0,
+                  insert_seconds=insert_seconds)
+
+    # 服务端 query_log 记录的网络字节数(压缩后、TLS 前)
+    sent, _ = network_bytes(service, read_queries)
+    _, received = network_bytes(service, insert_queries)
+    result.update(read_mb_per_s=mb_per_s(sent, read_seconds), insert_mb_per_s=mb_per_s(received, insert_seconds))
+
+    service.close()
+    return result
+
+
+def _fmt(value, spec):
+    return format(value, spec) if value is not None else 'n/a'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark wire compression / block size / socket buffer settings')
+    parser.add_argument('--config', default='config.yaml')
+    parser.add_argument('--invoice-month', required=True)
+    parser.add_argument('--usage-day', required=True, type=date.fromisoformat)
+    parser.add_argument('--compression', default='none,lz4,zstd', help='comma separated: none, lz4, lz4hc, zstd')
+    parser.add_argument('--block-sizes', default='100000', help='comma separated max_block_size values')
+    parser.add_argument('--socket-buffer', type=int, default=None, help='SO_RCVBUF/SO_SNDBUF in bytes')
+    parser.add_argument('--insert-rows', type=int, default=200000)
+    parser.add_argument('--batch-size', type=int, default=10000)
+    args = parser.parse_args()
+
+    from billing_calculation_service import BillingCalculationService
+
+    table = f"billing.bench_transfer_{uuid.uuid4().hex[:8]}"
+    service = BillingCalculationService(args.config)
+    service.execute_sql(f"CREATE TABLE {table} AS {SOURCE_TABLE}")
+
+    rows = []
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            for compression, block_size in itertools.product(args.compression.split(','),
+                                                             [int(b) for b in args.block_sizes.split(',')]):
+                overrides = {
+                    'compression': False if compression == 'none' else compression,
+                    'max_block_size': block_size,
+                }
+                if args.socket_buffer:
+                    overrides.update(socket_rcvbuf=args.socket_buffer, socket_sndbuf=args.socket_buffer)
+                config_path = write_config(args.config, overrides,
+                                           os.path.join(tmp, f"config_{compression}_{block_size}.yaml"))
+                result = run_isolated(_run_transfer, config_path, args.invoice_month, args.usage_day,
+                                      table, args.insert_rows, args.batch_size)
+                rows.append((compression, block_size, result))
+    finally:
+        service.execute_sql(f"DROP TABLE IF EXISTS {table}")
+        service.close()
+
+    print(f"{'compression':<12}{'block':>9}{'read rows/s':>14}{'read MB/s':>11}"
+          f"{'insert rows/s':>15}{'insert MB/s':>13}{'peak RSS MB':>13}")
+    for compression, block_size, r in rows:
+        if 'error' in r:
+            print(f"{compression:<12}{block_size:>9}  error: {r['error']}")
+            continue
+        print(f"{compression:<12}{block_size:>9}{r['read_rows_per_s']:>14.0f}{_fmt(r['read_mb_per_s'], '>11.2f')}"
+              f"{r['insert_rows_per_s']:>15.0f}{_fmt(r['insert_mb_per_s'], '>13.2f')}{r['peak_rss_mb']:>13.1f}")
+
+
+if __name__ == '__main__':
+    main()
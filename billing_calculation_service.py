@@ -1,9 +1,24 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import closing
 from datetime import datetime, timedelta
+import time
+import uuid
 import pandas as pd
 import yaml
 import os
-from client.clickhouse_client import ClickhouseClient
+from client.clickhouse_client import ClickhouseClient, ClickhousePool
+from client.http_client import HttpClickhouseClient
+from client.local_backend import LocalBackend
+from client.progress_ledger import ProgressLedger
+from client.query_cache import QueryCache
+from client.query_stats import QueryStatsRecorder
+from client.table_schema import TableSchemaCache
+from calculate.categories import CategoryDictionary
+from calculate.overrides import DEFAULT_OVERRIDES_PATH, OverridesStore
+from calculate.rule_dictionaries import RuleDictionaries, key_types
+from calculate.rule_matcher import ContractRuleMatcher
 from calculate.service import CalculateService
+from calculate.sql_template import get_calculation_sql, slice_condition
 # import main # Removed to fix circular dependency
 from utils.logger import setup_logger
 import csv
@@ -14,7 +29,101 @@ pd.set_option('future.no_silent_downcasting', True)
 class BillingCalculationService:
     def __init__(self, config_path='config.yaml'):
         self.config_path = config_path
+        config = self._load_config(config_path)
+        # 去重 token 带上本次运行的 id, 避免重跑(先 DELETE 再写入)时被去重窗口里的旧 token 吞掉
+        self.run_id = uuid.uuid4().hex[:12]
+        # 每条查询的统计(query_id、读写量、服务端/客户端耗时), close() 时写入 etl.query_stats_dir
+        self.stats = QueryStatsRecorder(run_id=self.run_id)
+        # clickhouse.backend: native(默认, native 协议) / http(HTTP 接口 + Arrow 格式)
+        # / local(进程内 SQLite, 读本地 ods/dim 文件, 离线压测用)
+        clickhouse_config = config.get('clickhouse', {})
+        self.backend = clickhouse_config.get('backend', 'native')
+        self.local_backend = None
+        if self.backend == 'local':
+            self.local_backend = LocalBackend.from_config(clickhouse_config.get('local', {}))
         self.client = self._init_client(config_path)
+        # 读取方式: rows(execute_iter 逐行) / blocks(按 native block 读取 numpy 列)
+        etl_config = config.get('etl', {})
+        self.reader = etl_config.get('reader', 'rows')
+        # categorical: 低基数字符串列按月共享字典编码(pandas Categorical), 从读取一直保持到写入
+        self.categorical = etl_config.get('categorical', False)
+        self._category_dicts = {}
+        # money_mode: float(默认) / fixed(金额按 int64 微单位定点计算, 结果可精确复现)
+        self.money_mode = etl_config.get('money_mode', 'float')
+        if self.money_mode not in ('float', 'fixed'):
+            raise ValueError(f"Unsupported etl.money_mode: {self.money_mode}")
+        # engine: pandas(默认, 按模式逐步计算) / numpy(单次遍历的数组计算, 结果一致)
+        # / sql(整个计算下推到 ClickHouse, INSERT ... SELECT, 数据不经过本进程)
+        self.engine = etl_config.get('engine', 'pandas')
+        if self.engine not in ('pandas', 'numpy', 'sql'):
+            raise ValueError(f"Unsupported etl.engine: {self.engine}")
+        # 逐批计算(按账户的任务等)使用的 CalculateService 引擎
+        self.batch_engine = 'numpy' if self.engine == 'numpy' else 'pandas'
+        # rule_lookup(sql 引擎): join(8 个 dim_contract 子查询 + LEFT JOIN) / dictionary(按规则建 ClickHouse 字典, dictGetOrNull)
+        self.rule_lookup = etl_config.get('rule_lookup', 'join')
+        if self.rule_lookup not in ('join', 'dictionary'):
+            raise ValueError(f"Unsupported etl.rule_lookup: {self.rule_lookup}")
+        # 字典源通过服务端的 named collection(只读用户)连接, 不把 ETL 的账号密码写进 DDL
+        self.rule_dictionaries = RuleDictionaries(source=etl_config.get('rule_dictionary_source'))
+        # sql 引擎按切片并发执行: slice_by none(一条语句) / day(每天一条) / account(billing_account_id 哈希分桶)
+        pushdown_config = etl_config.get('pushdown', {})
+        self.pushdown_slice_by = pushdown_config.get('slice_by', 'day')
+        if self.pushdown_slice_by not in ('none', 'day', 'account'):
+            raise ValueError(f"Unsupported etl.pushdown.slice_by: {self.pushdown_slice_by}")
+        self.pushdown_account_buckets = pushdown_config.get('account_buckets', 16)
+        # 并发数受连接池大小(clickhouse.pool_size)限制
+        self.pushdown_concurrency = pushdown_config.get('concurrency', 4)
+        self.pushdown_timeout = pushdown_config.get('timeout', 1800)
+        self.pushdown_retries = pushdown_config.get('retries', 2)
+        self.pushdown_retry_backoff = pushdown_config.get('retry_backoff', 10.0)
+        # month_task_day / month_task_billingid 的工作进程数, 1 为顺序执行
+        self.workers = etl_config.get('workers', 1)
+        # month_task_billingid 每个工作单元(账户 x 天区间)的目标 ods 行数
+        self.work_unit_rows = etl_config.get('work_unit_rows', 500000)
+        # 价格覆盖表(额外折扣 / 大账户): 文件变化后下一次运行自动重新编译, 不需要重新部署
+        self.overrides = OverridesStore(etl_config.get('pricing_overrides', DEFAULT_OVERRIDES_PATH))
+        # 流式读取和同时进行的插入各自从连接池租用连接, 连接复用, 不再每天新建
+        pool_size = clickhouse_config.get('pool_size', 4)
+        self.pool = ClickhousePool(max_size=pool_size, factory=self._client_factory(), stats=self.stats,
+                                   **self._client_kwargs(config))
+        # 插入失败自动重试(指数退避), 每个批次带去重 token, 重试的批次不会重复写入
+        self.insert_retries = etl_config.get('insert_retries', 3)
+        self.insert_retry_backoff = etl_config.get('insert_retry_backoff', 2.0)
+        self.query_stats_dir = etl_config.get('query_stats_dir', 'logs/query_stats')
+        # 月度任务进度账本(SQLite): 记录每天/每批次的写入, 中断后续跑跳过已完成的天, 清理未完成的天
+        ledger_path = etl_config.get('progress_ledger', 'logs/progress_ledger.sqlite')
+        self.ledger = ProgressLedger(ledger_path) if ledger_path else None
+        # 写入目标表的结构(DESCRIBE)按表缓存, 每个批次按结构做一次向量化类型转换
+        self.table_schemas = TableSchemaCache()
+        # 本地查询结果缓存(Parquet), dim_contract 和 ods 单天数据重跑时优先读本地
+        cache_config = config.get('cache', {})
+        self.cache = None
+        if cache_config.get('enabled', False):
+            self.cache = QueryCache(
+                cache_dir=cache_config.get('dir', '.cache/query'),
+                max_bytes=int(cache_config.get('max_size_mb', 2048)) * 1024 * 1024
+            )
+        # 月度合同规则索引(get_contract_index), 内存里按月份缓存, 开启缓存时同时落盘
+        self.contract_index_dir = cache_config.get('contract_index_dir', '.cache/contract_index')
+        self._contract_indexes = {}
+
+    def close(self):
+        """Save the query statistics and close the pooled connections and the service client."""
+        self.save_query_stats()
+        self.pool.close()
+        self.client.close()
+
+    def save_query_stats(self):
+        """Write the queries recorded so far to query_stats_dir, one CSV per run."""
+        if not len(self.stats):
+            return None
+        path = os.path.join(self.query_stats_dir, f"query_stats_{datetime.now():%Y%m%d}_{self.run_id}.csv")
+        try:
+            self.stats.save(path, clear=True)
+            logger.info(f"Query stats saved to {path}")
+        except Exception as e:
+            logger.error(f"Failed to write query stats: {e}")
+        return path
 
     def log_failure_to_csv(self, usage_day, error_msg, log_source="billing_sync.log"):
         """
@@ -34,32 +143,48 @@ class BillingCalculationService:
             logger.error(f"Failed to write to CSV log: {e}")
 
 
-    def _init_client(self, config_path):
+    @staticmethod
+    def _load_config(config_path):
         if not os.path.exists(config_path):
             raise FileNotFoundError(f"Config file not found: {config_path}")
-        
+
         with open(config_path, 'r') as f:
-            config = yaml.safe_load(f) or {}
-            
+            return yaml.safe_load(f) or {}
+
+    # 传输调优参数, 配置了才透传给 ClickhouseClient
+    TRANSPORT_OPTIONS = ('compression', 'compress_block_size', 'max_block_size', 'insert_block_size',
+                         'socket_rcvbuf', 'socket_sndbuf', 'tcp_keepalive', 'ciphers', 'ca_certs', 'server_hostname',
+                         'http_port')
+
+    @staticmethod
+    def _client_kwargs(config):
         file_config = config.get('clickhouse', {})
-        host = file_config.get('host', 'localhost')
-        port = file_config.get('port', 9000)
-        user = file_config.get('user', 'default')
-        password = file_config.get('password', '')
-        database = file_config.get('database', 'default')
-        secure = file_config.get('secure', True)
-        verify = file_config.get('verify', False)
-        
-        
-        return ClickhouseClient(
-            host=host,
-            port=port,
-            user=user,
-            password=password,
-            database=database,
-            secure=secure,
-            verify=verify
+        kwargs = dict(
+            host=file_config.get('host', 'localhost'),
+            port=file_config.get('port', 9000),
+            user=file_config.get('user', 'default'),
+            password=file_config.get('password', ''),
+            database=file_config.get('database', 'default'),
+            secure=file_config.get('secure', True),
+            verify=file_config.get('verify', False)
         )
+        for key in BillingCalculationService.TRANSPORT_OPTIONS:
+            if key in file_config:
+                kwargs[key] = file_config[key]
+        return kwargs
+
+    def _client_factory(self):
+        if self.backend == 'local':
+            return self.local_backend.client
+        if self.backend == 'http':
+            return HttpClickhouseClient
+        if self.backend == 'native':
+            return ClickhouseClient
+        raise ValueError(f"Unknown clickhouse backend: {self.backend}")
+
+    def _init_client(self, config_path):
+        config = self._load_config(config_path)
+        return self._client_factory()(stats=self.stats, **self._client_kwargs(config))
 
     def process_monthly_billing(self, invoice_month):
         """
@@ -100,7 +225,7 @@ class BillingCalculationService:
             WHERE invoice_month = %(invoice_month)s
         """
         params = {'invoice_month': invoice_month}
-        result = self.client.execute(query, params=params)
+        result = self.client.execute(query, params=params, tag='_get_min_max_usage_day')
         if result and result[0]:
             return result[0][0], result[0][1]
         return None, None
@@ -130,7 +255,9 @@ class BillingCalculationService:
             dim_df = self.get_dim_contract(contract_month, billing_account_id)
 
             # 3.4 Calculate
-            calculated_df = CalculateService.calculate_with_credits(df, dim_df)
+            calculated_df = CalculateService.calculate_with_credits(df, dim_df, money_mode=self.money_mode, copy=False,
+                                                                    overrides=self.overrides.current(),
+                                                                    engine=self.batch_engine)
 
             # 3.5 Insert into target table
             if not calculated_df.empty:
@@ -152,15 +279,38 @@ class BillingCalculationService:
             'usage_day_start': usage_day_start,
             'usage_day_end': usage_day_end
         }
-        return self.client.query_dataframe(query=query, params=params)
+        return self.client.query_dataframe(query=query, params=params, tag='get_billing_account_ids')
     
+    def get_account_day_counts(self, invoice_month, usage_day_start, usage_day_end):
+        """
+        ods_standard_daily_billing rows per billing_account_id and usage_day
+        (row_count), for the month_task_billingid work planner.
+        """
+        query = """
+            SELECT billing_account_id, usage_day, count() AS row_count
+            FROM billing.ods_standard_daily_billing
+            WHERE invoice_month = %(invoice_month)s
+            and usage_day >= %(usage_day_start)s
+            and usage_day < %(usage_day_end)s
+            GROUP BY billing_account_id, usage_day
+        """
+        params = {
+            'invoice_month': invoice_month,
+            'usage_day_start': usage_day_start,
+            'usage_day_end': usage_day_end
+        }
+        return self.client.query_dataframe(query=query, params=params, tag='get_account_day_counts')
+
     def execute_sql(self, sql):
-        return self.client.execute(sql)
+        return self.client.execute(sql, tag='execute_sql')
 
     def get_standard_daily_billing(self, invoice_month, billing_account_id, usage_day_start, usage_day_end):
         """
         Query ods_standard_daily_billing table by invoice_month and usage_day range.
+        billing_account_id: one account or a sequence of accounts.
         """
+        if isinstance(billing_account_id, str):
+            billing_account_id = (billing_account_id,)
         query = """
             select
                     invoice_month, billing_account_id, usage_day, project_id, service_id,service_description, sku_id, cost_type  
@@ -179,7 +329,7 @@ class BillingCalculationService:
                     ,sum(internal_credits_consumption) as internal_credits_consumption
                    from   billing.ods_standard_daily_billing 
                    WHERE invoice_month = %(invoice_month)s 
-	              AND billing_account_id = %(billing_account_id)s 
+	              AND billing_account_id IN %(billing_account_ids)s 
 	              and usage_day >= %(usage_day_start)s 
 	              and usage_day < %(usage_day_end)s
                    group by 
@@ -187,16 +337,29 @@ class BillingCalculationService:
         """
         params = {
             'invoice_month': invoice_month,
-            'billing_account_id': billing_account_id,
+            'billing_account_ids': tuple(billing_account_id),
             'usage_day_start': usage_day_start,
             'usage_day_end': usage_day_end
         }
-        return self.client.query_dataframe(query=query, params=params)
+        return self.client.query_dataframe(query=query, params=params, tag='get_standard_daily_billing')
+
+    def _iterate(self, client, query, params, batch_size=10000, reader=None, tag=None):
+        """
+        Yield query results in DataFrame batches with the configured reader.
+        tag: caller name recorded in the query stats.
+        """
+        reader = reader or self.reader
+        if reader == 'blocks':
+            return client.iterate_blocks(query=query, params=params, batch_size=batch_size, tag=tag or 'iterate_blocks')
+        if reader == 'rows':
+            return client.iterate(query=query, params=params, batch_size=batch_size, tag=tag or 'iterate')
+        raise ValueError(f"Unknown reader: {reader}")
 
-    def get_standard_daily_billing_iterator(self, invoice_month, usage_day):
+    def get_standard_daily_billing_iterator(self, invoice_month, usage_day, reader=None):
         """
         Query ods_standard_daily_billing table by invoice_month and usage_day range.
         Returns an iterator yielding DataFrames in batches.
+        reader: 'rows' or 'blocks', defaults to etl.reader in config.yaml.
         """
         query = """
             select
@@ -225,10 +388,76 @@ class BillingCalculationService:
             'usage_day': usage_day
         }
         
-        # Use a separate client for iteration to avoid "Simultaneous queries" error
+        # Use a separate leased client for iteration to avoid "Simultaneous queries" error
         # when other queries (like inserts) are executed within the iteration loop.
-        iter_client = self._init_client(self.config_path)
-        return iter_client.iterate(query=query, params=params, batch_size=10000)
+        if self.cache is not None:
+            where = "invoice_month = %(invoice_month)s AND usage_day = %(usage_day)s"
+            iterator = self._cached_iterate(query, params, 'ods_standard_daily_billing', where, batch_size=10000,
+                                            reader=reader, tag='get_standard_daily_billing_iterator')
+        else:
+            iterator = self._leased_iterate(query, params, batch_size=10000, reader=reader,
+                                            tag='get_standard_daily_billing_iterator')
+        if self.categorical:
+            return self._categorized(iterator, self.category_dictionary(invoice_month))
+        return iterator
+
+    def category_dictionary(self, invoice_month):
+        """Shared CategoryDictionary of an invoice month (etl.categorical)."""
+        dictionary = self._category_dicts.get(invoice_month)
+        if dictionary is None:
+            dictionary = self._category_dicts.setdefault(invoice_month, CategoryDictionary())
+        return dictionary
+
+    @staticmethod
+    def _categorized(iterator, dictionary):
+        with closing(iterator):
+            for batch_df in iterator:
+                yield dictionary.encode(batch_df)
+
+    def _table_version(self, client, table, where, params):
+        """
+        Cheap version probe of a table slice for the query cache:
+        row count of the slice + last modification time of the active parts of
+        the partitions holding it, so writes to other partitions keep the entry.
+        """
+        query = f"""
+            SELECT
+                (SELECT count() FROM billing.{table} WHERE {where}) AS rows,
+                (SELECT max(modification_time) FROM system.parts
+                 WHERE database = 'billing' AND table = '{table}' AND active
+                   AND partition_id IN (SELECT DISTINCT _partition_id FROM billing.{table} WHERE {where})
+                ) AS last_modified
+        """
+        rows, last_modified = client.execute(query, params=params, tag='cache_probe')[0]
+        return f"{rows}|{last_modified}"
+
+    def _cached_iterate(self, query, params, table, where, batch_size=10000, reader=None, tag=None):
+        """
+        Iterate a query through the local cache: serve the cached result while the
+        table version is unchanged, otherwise stream from ClickHouse and cache it.
+        """
+        key = self.cache.make_key(query, params)
+        with self.pool.lease() as probe_client:
+            version = self._table_version(probe_client, table, where, params)
+
+        cached = self.cache.iter_batches(key, version, batch_size=batch_size)
+        if cached is not None:
+            logger.info(f"Query cache hit: {table} {params}")
+            yield from cached
+            return
+
+        with self.pool.lease() as iter_client, self.cache.writer(key, version, query=query, params=params) as writer:
+            for batch_df in self._iterate(iter_client, query, params, batch_size=batch_size, reader=reader, tag=tag):
+                writer.write(batch_df)
+                yield batch_df
+
+    def _leased_iterate(self, query, params, batch_size=10000, reader=None, tag=None):
+        """
+        Iterate on a client leased from the pool; the lease is held until the
+        iterator is exhausted or closed.
+        """
+        with self.pool.lease() as iter_client:
+            yield from self._iterate(iter_client, query, params, batch_size=batch_size, reader=reader, tag=tag)
 
 
     def get_standard_daily_billing_test(self, invoice_month, billing_account_id, usage_day_start, usage_day_end):
@@ -286,12 +515,13 @@ class BillingCalculationService:
                 'invoice_month': invoice_month,
                 'billing_account_id': billing_account_id
             }
-            return self.client.query_dataframe(query=query, params=params)
+            return self.client.query_dataframe(query=query, params=params, tag='get_standard_daily_billing_test')
 
-    def get_dim_contract(self, month, billing_account_id=None):
+    def get_dim_contract(self, month, billing_account_id=None, reader=None):
         """
         Query dim_contract table by month and billing_account_id.
         如果billing_account_id为None，则查询该月份所有合同
+        reader: 'rows' or 'blocks', defaults to etl.reader in config.yaml.
         """
         if billing_account_id is not None:
             query = """
@@ -304,6 +534,7 @@ class BillingCalculationService:
                 'month': month,
                 'billing_account_id': billing_account_id
             }
+            where = "month = %(month)s AND billing_account_id = %(billing_account_id)s"
         else:
             query = """
                 SELECT * 
@@ -313,160 +544,329 @@ class BillingCalculationService:
             params = {
                 'month': month
             }
-                
+            where = "month = %(month)s"
+
+        if self.cache is not None:
+            key = self.cache.make_key(query, params)
+            version = self._table_version(self.client, 'dim_contract', where, params)
+            cached = self.cache.get(key, version)
+            if cached is not None:
+                logger.info(f"dim数据汇总: 命中本地缓存, month={month}, rows: {len(cached)}")
+                return cached
+
         dfs = []
         total_rows = 0
-        for batch_df in self.client.iterate(query=query, params=params, batch_size=10000):
+        for batch_df in self._iterate(self.client, query, params, batch_size=10000, reader=reader, tag='get_dim_contract'):
             dfs.append(batch_df)
             total_rows += len(batch_df)
             logger.info(f"dim数据汇总:Batch {len(dfs)} fetched, rows in batch: {len(batch_df)}, total rows: {total_rows}")
             
         if not dfs:
             return pd.DataFrame()
-            
-        return pd.concat(dfs, ignore_index=True)
 
+        dim_df = pd.concat(dfs, ignore_index=True)
+        if self.cache is not None:
+            self.cache.put(key, version, dim_df, query=query, params=params)
+        return dim_df
 
-    def _insert_calculated_data(self, df,target_table='dwm_standard_daily_billing_calculated'):
+
+    def get_contract_index(self, month):
         """
-        Insert calculated data into target_table.
+        ContractRuleMatcher of a dim_contract month, built once and reused.
+
+        The index is stamped with the dim_contract version probe of the month
+        and kept in memory; with cache.enabled it is also saved under
+        cache.contract_index_dir, so later runs and other processes load it
+        instead of querying dim_contract and rebuilding. Any change to
+        dim_contract changes the version and triggers a rebuild.
         """
-        # Ensure DataFrame columns match the target table structure
-        target_columns = [
-            'usage_day', 'invoice_month', 'billing_account_id', 
-            'customer_id', 'contract_id', 
-            'service_id', 'service_description', 
-            'sku_id', 'sku_description', 
-            'project_id', 'project_name', 
-            'usage_pricing_unit', 'usage_amount_in_pricing_units', 
-            'currency', 'currency_conversion_rate', 
-            'cost_type', 
-            'cost', 'cost_at_list', 
-            'c_cud', 'c_cud_db', 'c_discount', 'c_free_tier', 
-            'c_promotion', 'c_rm', 'c_sub_benefit', 'c_sud', 
-            'internal_credits_cost', 'internal_credits_consumption', 
-            'internal_cost', 'internal_consumption', 
-            'external_consumption', 'discount_amount', 
-            'mode', 'price', 'discount', 
-            'credit_fields', 'etl_time'
-        ]
-        
-        # Add missing columns with default values if necessary
-        for col in target_columns:
-            if col not in df.columns:
-                if col == 'etl_time':
-                    df[col] = datetime.now()
-                elif col in ['customer_id', 'contract_id']:
-                     # These are Nullable(String), so keep as NaN or None if missing
-                     pass
-                else:
-                    # Set sensible defaults for other missing columns to avoid errors
-                    # String types -> ''
-                    # Numeric -> 0
-                    if col in ['service_id', 'service_description', 'sku_id', 'sku_description', 
-                               'project_id', 'project_name', 'usage_pricing_unit', 'currency', 
-                               'cost_type', 'credit_fields', 'invoice_month']:
-                        df[col] = ''
-                    else:
-                        df[col] = 0.0
+        params = {'month': month}
+        version = self._table_version(self.client, 'dim_contract', "month = %(month)s", params)
+        cached = self._contract_indexes.get(month)
+        if cached is not None and cached[0] == version:
+            return cached[1]
 
-        # Ensure etl_time is set
-        if 'etl_time' not in df.columns:
-            df['etl_time'] = datetime.now()
-            
-        # Select and order columns to match target table
-        # Filter out extra columns that might be in df but not in target table
-        # (e.g. intermediate calculation columns)
-        df_to_insert = df[target_columns].copy()
-        
-        # Fill NaNs for non-nullable string columns to avoid issues
-        string_cols = ['billing_account_id', 'service_id', 'service_description', 
-                       'sku_id', 'sku_description', 'project_id', 'project_name', 
-                       'usage_pricing_unit', 'currency', 'cost_type', 'credit_fields', 'invoice_month']
-        for col in string_cols:
-             if col in df_to_insert.columns:
-                 df_to_insert[col] = df_to_insert[col].fillna('')
-
-        # Fill NaNs for numeric columns (except nullable customer_id/contract_id)
-        numeric_cols = [c for c in target_columns if c not in string_cols and c not in ['customer_id', 'contract_id', 'etl_time', 'usage_day']]
-        for col in numeric_cols:
-             if col in df_to_insert.columns:
-                 df_to_insert[col] = df_to_insert[col].fillna(0).infer_objects(copy=False)
-                 
-        # Explicit type conversion for ClickHouse compatibility
-        
-        # invoice_month: Ensure it is String
-        if 'invoice_month' in df_to_insert.columns:
-            df_to_insert['invoice_month'] = df_to_insert['invoice_month'].astype(str)
-            # Check if any values look like floats (e.g., '202602.0') and fix them
-            df_to_insert['invoice_month'] = df_to_insert['invoice_month'].apply(
-                lambda x: x.split('.')[0] if '.' in x else x
-            )
+        path = None
+        matcher = None
+        if self.cache is not None:
+            path = os.path.join(self.contract_index_dir, f"contract_index_{month}.pkl")
+            matcher = ContractRuleMatcher.load(path, version)
+            if matcher is not None:
+                logger.info(f"合同规则索引: 读取本地文件 {path}, month={month}")
 
-        # Ensure integers for ID columns
-        int_cols = ['mode']
-        for col in int_cols:
-            if col in df_to_insert.columns:
-                # Fill NaNs with 0 for mode (Int8 default 0)
-                df_to_insert[col] = df_to_insert[col].fillna(0).astype(int)
-
-        # Ensure Nullable(String) columns are handled
-        nullable_str_cols = ['customer_id', 'contract_id']
-        for col in nullable_str_cols:
-            if col in df_to_insert.columns:
-                 # Convert non-null values to string
-                 mask = df_to_insert[col].notna()
-                 df_to_insert.loc[mask, col] = df_to_insert.loc[mask, col].astype(str)
-        
-        # Ensure usage_day is date
-        if 'usage_day' in df_to_insert.columns:
-            # If it's datetime, convert to date
-            if pd.api.types.is_datetime64_any_dtype(df_to_insert['usage_day']):
-                 df_to_insert['usage_day'] = df_to_insert['usage_day'].dt.date
+        if matcher is None:
+            matcher = ContractRuleMatcher(self.get_dim_contract(month))
+            logger.info(f"合同规则索引: 已构建, month={month}, dim rows: {matcher.size}")
+            if path is not None:
+                try:
+                    matcher.save(path, version)
+                except OSError as e:
+                    logger.warning(f"Failed to save contract index {path}: {e}")
+
+        self._contract_indexes[month] = (version, matcher)
+        return matcher
+
+    def _dedup_token(self, invoice_month, usage_day, batch_index, *scope):
+        """
+        Deterministic insert_deduplication_token of one batch within this run.
+        """
+        parts = [invoice_month, usage_day, *scope, batch_index, self.run_id]
+        return ':'.join(str(p) for p in parts)
+
+    def _insert_calculated_data(self, df,target_table='dwm_standard_daily_billing_calculated', client=None, dedup_token=None):
+        """
+        Insert calculated data into target_table.
+        Columns are selected, ordered and typed from the table's cached schema;
+        columns missing from df get the type defaults.
+        client: connection to insert with, defaults to self.client.
+        dedup_token: insert_deduplication_token of the batch, see _dedup_token.
+        """
+        client = client or self.client
+        # 按目标表 DESCRIBE 的结构一次性转换成 ClickHouse 列类型(结构只查一次, 缓存在 table_schemas)
+        df_to_insert = self.table_schemas.plan(client, target_table).apply(df)
 
         try:
-            self.client.insert_dataframe(
+            client.insert_dataframe(
                 f'INSERT INTO billing.{target_table} VALUES',
-                df_to_insert
+                df_to_insert,
+                dedup_token=dedup_token,
+                retries=self.insert_retries,
+                backoff=self.insert_retry_backoff
             )
         except Exception as e:
             print(f"Error inserting data: {e}")
             # Fallback or re-raise if needed
             raise
         
-    def pipeline_billingaccount_day(self, invoice_month,df_contract, billing_account_id, usage_day_start, usage_day_end, dim_month):
+    def pipeline_billingaccount_day(self, invoice_month,df_contract, billing_account_id, usage_day_start, usage_day_end, dim_month,
+                                    target_table='dwm_standard_daily_billing_calculated'):
+        """
+        Calculate and insert billing_account_id (one account or a sequence,
+        e.g. a WorkUnit's accounts) over [usage_day_start, usage_day_end);
+        returns the rows inserted.
+        """
         df=self.get_standard_daily_billing(invoice_month=invoice_month, billing_account_id=billing_account_id, usage_day_start=usage_day_start, usage_day_end=usage_day_end) 
-        calculated =CalculateService.calculate_with_credits(df, df_contract)
+        calculated =CalculateService.calculate_with_credits(df, df_contract, money_mode=self.money_mode, copy=False,
+                                                            overrides=self.overrides.current(), engine=self.batch_engine)
+        # 多个账户时日志和去重令牌使用 "第一个账户+其余数量"
+        if not isinstance(billing_account_id, str):
+            billing_account_id = billing_account_id[0] + (f"+{len(billing_account_id) - 1}" if len(billing_account_id) > 1 else "")
         if not calculated.empty:
-            self._insert_calculated_data(calculated)
+            dedup_token = self._dedup_token(invoice_month, usage_day_start, 0, billing_account_id, usage_day_end)
+            self._insert_calculated_data(calculated, target_table=target_table, dedup_token=dedup_token)
             logger.info(f"Successfully inserted {len(calculated)} rows for billing account {billing_account_id} in usage day {usage_day_start} to {usage_day_end}")
         else:
             logger.info(f"No calculated data to insert for billing account {billing_account_id} in usage day {usage_day_start} to {usage_day_end}, skipping.")
+        return len(calculated)
 
-    def pipeline_day(self, invoice_month,df_contract, usage_day_start,target_table='dwm_standard_daily_billing_calculated'):
+    def pipeline_day(self, invoice_month,df_contract, usage_day_start,target_table='dwm_standard_daily_billing_calculated', reader=None, raise_errors=False, ledger_run=None):
+        """
+        Calculate and insert one usage day; returns the rows inserted.
+        A failure is logged and alarmed (returning None), or re-raised with
+        raise_errors for callers that collect failures themselves.
+        ledger_run: progress ledger run (ProgressLedger.begin_run) the day
+        belongs to; without it the day is not recorded in the ledger.
+        """
         try:
             total_inserted = 0
-            iterator = self.get_standard_daily_billing_iterator(invoice_month, usage_day_start)
-            for batch_df in iterator:
-            # batch_df 是包含最多 10000 行数据的 DataFrame
-                if batch_df.empty:
-                    logger.info(f"No data for usage day {usage_day_start}, skipping.")
-                    continue
-                calculated =CalculateService.calculate_with_credits(batch_df, df_contract)
-                if not calculated.empty:
-                    self._insert_calculated_data(calculated,target_table=target_table)
-                    count = len(calculated)
-                    total_inserted += count
-                    logger.info(f"Successfully inserted {count} rows for usage day {usage_day_start}. Total inserted so far: {total_inserted}")
-                else:
-                    logger.info(f"No calculated data to insert for usage day {usage_day_start}, skipping.")
+            # 上次运行中断在这一天: 目标表里只有部分批次, 先删掉再从头计算
+            ledger = self.ledger if ledger_run is not None else None
+            if ledger is not None and ledger.start_day(invoice_month, target_table, usage_day_start, ledger_run):
+                logger.warning(f"Usage day {usage_day_start} of {invoice_month} was left partial in {target_table}, "
+                               f"deleting its rows before recalculating")
+                self.delete_days(invoice_month, usage_day_start, usage_day_start, target_table)
+            # 合同规则索引整天只建一次, 所有批次复用
+            contract_matcher = CalculateService.contract_matcher(df_contract)
+            # 覆盖表整天使用同一版本
+            overrides = self.overrides.current()
+            iterator = self.get_standard_daily_billing_iterator(invoice_month, usage_day_start, reader=reader)
+            with self.pool.lease() as write_client, closing(iterator):
+                for batch_index, batch_df in enumerate(iterator):
+                # batch_df 是包含最多 10000 行数据的 DataFrame
+                    if batch_df.empty:
+                        logger.info(f"No data for usage day {usage_day_start}, skipping.")
+                        continue
+                    # 批次只属于本循环: 结果列直接填进 batch_df, 不再复制
+                    calculated =CalculateService.calculate_with_credits(batch_df, contract_matcher,
+                                                                       money_mode=self.money_mode, copy=False,
+                                                                       overrides=overrides, engine=self.batch_engine)
+                    if not calculated.empty:
+                        dedup_token = self._dedup_token(invoice_month, usage_day_start, batch_index)
+                        self._insert_calculated_data(calculated,target_table=target_table, client=write_client, dedup_token=dedup_token)
+                        count = len(calculated)
+                        total_inserted += count
+                        if ledger is not None:
+                            ledger.record_batch(invoice_month, target_table, usage_day_start, batch_index, count,
+                                                ledger_run)
+                        logger.info(f"Successfully inserted {count} rows for usage day {usage_day_start}. Total inserted so far: {total_inserted}")
+                    else:
+                        logger.info(f"No calculated data to insert for usage day {usage_day_start}, skipping.")
+            if ledger is not None:
+                ledger.finish_day(invoice_month, target_table, usage_day_start, total_inserted, ledger_run)
             logger.info(f"Completed pipeline for usage day {usage_day_start}. Total rows inserted: {total_inserted}")
+            return total_inserted
         except Exception as e:
+            if raise_errors:
+                raise
              # 记录失败信息
             logger.error(f"Processing failed: 当前处理天： {usage_day_start} , error: {e}", exc_info=True)
             self.send_feishu_alarm(f"Processing failed: 当前处理天： {usage_day_start} , error: {e}")
             return
 
+    def delete_days(self, invoice_month, usage_day_start, usage_day_end, target_table='dwm_standard_daily_billing_calculated'):
+        """Delete usage days [usage_day_start, usage_day_end] of invoice_month from target_table, waiting for the mutation."""
+        with self.pool.lease() as client:
+            client.execute(f"ALTER TABLE billing.{target_table} DELETE WHERE invoice_month = %(invoice_month)s "
+                           f"AND usage_day >= %(usage_day_start)s AND usage_day <= %(usage_day_end)s "
+                           f"SETTINGS mutations_sync = 2",
+                           params={'invoice_month': invoice_month, 'usage_day_start': usage_day_start,
+                                   'usage_day_end': usage_day_end}, tag='delete_days')
+
+    def pipeline_pushdown(self, invoice_month, usage_day_start, usage_day_end,
+                          target_table='dwm_standard_daily_billing_calculated', billing_account_ids=None):
+        """
+        Calculate usage days [usage_day_start, usage_day_end) of invoice_month
+        inside ClickHouse (engine 'sql'): the ods aggregation, contract matching
+        and pricing all run on the server and no rows cross the network.
+
+        The range is split into independent slices (etl.pushdown.slice_by: one
+        usage day, or one hash bucket of billing_account_id, per INSERT ...
+        SELECT) run concurrency at a time, each with its own
+        max_execution_time and retries. A failed attempt deletes what it wrote,
+        so a slice is either complete or absent; slices still failing after
+        their retries are reported together once the others are done.
+        billing_account_ids: only calculate these accounts when given.
+        """
+        if self.backend == 'local':
+            raise ValueError("etl.engine 'sql' needs a ClickHouse backend, not the local backend")
+        account_filter = billing_account_ids is not None
+        if account_filter and not len(billing_account_ids):
+            return
+        dim_month = f"{invoice_month[:4]}-{invoice_month[4:]}"
+        dictionaries, dictionary_key_types = (self.ensure_rule_dictionaries(dim_month)
+                                              if self.rule_lookup == 'dictionary' else (None, None))
+        account_bucket = self.pushdown_slice_by == 'account'
+        sql = get_calculation_sql(target_table=target_table, account_filter=account_filter,
+                                  overrides=self.overrides.current(), dictionaries=dictionaries,
+                                  dictionary_key_types=dictionary_key_types, account_bucket=account_bucket,
+                                  settings={'max_execution_time': self.pushdown_timeout})
+        cleanup_sql = (f"ALTER TABLE billing.{target_table} DELETE WHERE "
+                       f"{slice_condition(account_filter, account_bucket)} SETTINGS mutations_sync = 2")
+        check_sql = f"SELECT count() FROM billing.{target_table} WHERE {slice_condition(account_filter, account_bucket)}"
+        params = {
+            'invoice_month': invoice_month,
+            'dim_month': dim_month,
+            'usage_day_start': usage_day_start,
+            'usage_day_end': usage_day_end,
+        }
+        if account_filter:
+            params['billing_account_ids'] = tuple(billing_account_ids)
+        slices = self._pushdown_slices(params)
+
+        start_time = time.time()
+        failed = []
+        written = 0
+        workers = max(1, min(self.pushdown_concurrency, len(slices)))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='pushdown') as executor:
+            futures = {executor.submit(self._run_pushdown_slice, sql, cleanup_sql, check_sql, label, slice_params): label
+                       for label, slice_params in slices}
+            for done, future in enumerate(as_completed(futures), start=1):
+                label = futures[future]
+                try:
+                    rows, seconds = future.result()
+                    written += rows or 0
+                    logger.info(f"Pushdown slice {label} done in {seconds:.1f}s ({rows} rows); "
+                                f"{done}/{len(slices)} slices, {written} rows, {time.time() - start_time:.0f}s elapsed")
+                except Exception as e:
+                    failed.append(label)
+                    logger.error(f"Pushdown slice {label} failed: {e}; {done}/{len(slices)} slices")
+
+        if failed:
+            message = (f"Pushdown failed for {invoice_month} into {target_table}: "
+                       f"{len(failed)}/{len(slices)} slices ({', '.join(sorted(failed))})")
+            self.send_feishu_alarm(message)
+            raise RuntimeError(message)
+        logger.info(f"Pushdown calculation done for {invoice_month} usage days {usage_day_start} to {usage_day_end}"
+                    f" into {target_table}: {len(slices)} slices, {written} rows in {time.time() - start_time:.0f}s")
+
+    def _pushdown_slices(self, params):
+        """(label, params) of every pushdown slice of params' usage day range."""
+        if self.pushdown_slice_by == 'day':
+            slices = []
+            day = params['usage_day_start']
+            while day < params['usage_day_end']:
+                slices.append((str(day), dict(params, usage_day_start=day, usage_day_end=day + timedelta(days=1))))
+                day += timedelta(days=1)
+            return slices
+        if self.pushdown_slice_by == 'account':
+            buckets = self.pushdown_account_buckets
+            return [(f"bucket {b}/{buckets}", dict(params, buckets=buckets, bucket=b)) for b in range(buckets)]
+        return [(f"{params['usage_day_start']}..{params['usage_day_end']}", dict(params))]
+
+    def _run_pushdown_slice(self, sql, cleanup_sql, check_sql, label, params):
+        """
+        Run one slice with retries; returns (written rows or None, seconds of the successful attempt).
+
+        A failed attempt deletes the slice's rows and counts them to confirm
+        the delete. A cleanup that fails or leaves rows behind is logged next
+        to the attempt's error and repeated before the next attempt, so a
+        retry never writes on top of partial rows. The attempt's own error is
+        the one raised, flagged when the slice may still hold partial rows.
+        """
+        attempt = 0
+        dirty = False
+        while True:
+            started = time.time()
+            try:
+                if dirty:
+                    # 上次清理没有确认成功: 先清理, 切片为空后才重新写入
+                    self._clean_pushdown_slice(cleanup_sql, check_sql, label, params)
+                    dirty = False
+                with self.pool.lease() as client:
+                    client.execute(sql, params=params, tag='pipeline_pushdown')
+                    last_query = getattr(getattr(client, '_db_client', client), 'last_query', None)
+                progress = getattr(last_query, 'progress', None)
+                return getattr(progress, 'written_rows', None), time.time() - started
+            except Exception as e:
+                # 失败的 INSERT ... SELECT 可能已写入部分 block, 按切片条件删除, 失败的切片不留数据
+                logger.warning(f"Pushdown slice {label} attempt {attempt + 1} failed after "
+                               f"{time.time() - started:.0f}s: {e}; removing its rows")
+                try:
+                    self._clean_pushdown_slice(cleanup_sql, check_sql, label, params)
+                    dirty = False
+                except Exception as cleanup_error:
+                    dirty = True
+                    logger.error(f"Pushdown slice {label} cleanup after attempt {attempt + 1} failed: "
+                                 f"{cleanup_error}; attempt error: {e}")
+                if attempt >= self.pushdown_retries:
+                    if dirty:
+                        raise RuntimeError(f"{e} (cleanup failed too, slice {label} may hold partial rows)") from e
+                    raise e
+                wait = self.pushdown_retry_backoff * (2 ** attempt)
+                attempt += 1
+                logger.info(f"Retrying pushdown slice {label} in {wait:.0f}s")
+                time.sleep(wait)
+
+    def _clean_pushdown_slice(self, cleanup_sql, check_sql, label, params):
+        """Delete the rows of one slice and check that none are left."""
+        with self.pool.lease() as client:
+            client.execute(cleanup_sql, params=params, tag='pushdown_cleanup')
+            remaining = client.execute(check_sql, params=params, tag='pushdown_cleanup_check')[0][0]
+        if remaining:
+            raise RuntimeError(f"{remaining} rows left in slice {label} after cleanup")
+
+    def ensure_rule_dictionaries(self, dim_month):
+        """
+        (rule name -> ClickHouse dictionary of dim_contract for dim_month, key
+        column -> dictionary key type). The dictionaries are rebuilt when the
+        month's dim_contract version changed (see RuleDictionaries).
+        """
+        with self.pool.lease() as client:
+            version = self._table_version(client, 'dim_contract', "month = %(month)s", {'month': dim_month})
+            column_types = dict(self.table_schemas.plan(client, 'dim_contract').schema)
+            names = self.rule_dictionaries.ensure(client, dim_month, version, column_types)
+        return names, key_types(column_types)
+
     def send_feishu_alarm(self,content):
 
         """发送飞书消息的核心函数"""
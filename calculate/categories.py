@@ -0,0 +1,66 @@
+import threading
+
+import numpy as np
+import pandas as pd
+from pandas import DataFrame, Series
+
+from utils.enum import PROJECT_ID, SERVICE_DESCRIPTION, SKU_ID, BILLING_ACCOUNT_ID
+
+# 低基数字符串列: 每月只有几千个不同取值
+CATEGORICAL_COLUMNS = [BILLING_ACCOUNT_ID, "service_id", SERVICE_DESCRIPTION, SKU_ID, PROJECT_ID,
+                       "cost_type", "currency"]
+
+
+def codes_in(index: pd.Index, values: Series) -> np.ndarray:
+    """
+    Position of every value in index (-1 when absent or null). Categorical
+    values are resolved through their categories only, then mapped by code.
+    """
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        mapping = index.get_indexer(values.cat.categories)
+        codes = values.cat.codes.to_numpy()
+        return np.where(codes >= 0, mapping[codes], -1)
+    return index.get_indexer(values.to_numpy(dtype=object))
+
+
+class CategoryDictionary:
+    """
+    Append-only category dictionaries of the low-cardinality string columns,
+    shared by every batch of one invoice month.
+
+    encode() turns those columns into pandas Categoricals over the month's
+    dictionary, so a value keeps the same code in every batch and joins can
+    compare integer codes. Unseen values are appended, which never changes
+    the codes already handed out.
+    """
+
+    def __init__(self, columns=CATEGORICAL_COLUMNS):
+        self.columns = list(columns)
+        self._dtypes = {col: pd.CategoricalDtype(pd.Index([], dtype=object)) for col in self.columns}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return sum(len(dtype.categories) for dtype in self._dtypes.values())
+
+    def categories(self, col):
+        return self._dtypes[col].categories
+
+    def encode(self, df: DataFrame) -> DataFrame:
+        """Replace the dictionary columns of df by Categoricals (in place) and return df."""
+        for col in self.columns:
+            if col not in df.columns:
+                continue
+            values = df[col]
+            dtype = self._dtypes[col]
+            codes = codes_in(dtype.categories, values)
+            unseen = (codes < 0) & values.notna().to_numpy()
+            if unseen.any():
+                with self._lock:
+                    dtype = self._dtypes[col]
+                    additions = pd.Index(pd.unique(values[unseen].astype(object))).difference(dtype.categories,
+                                                                                            sort=False)
+                    dtype = pd.CategoricalDtype(dtype.categories.append(additions))
+                    self._dtypes[col] = dtype
+                codes = codes_in(dtype.categories, values)
+            df[col] = pd.Categorical.from_codes(codes, dtype=dtype)
+        return df
@@ -0,0 +1,63 @@
+"""
+Scaled int64 arithmetic for the fixed-point money mode of CalculateService.
+
+Money and usage amounts are held in micro-units (MONEY_SCALE) and discount /
+price rates in millionths (RATE_SCALE). Every step that can leave the grid
+rounds explicitly, half away from zero:
+
+- to_fixed: float -> int64 at the given scale
+- mul_rate: amount * rate, rounded to the amount's scale
+- div_rate: amount / rate, rounded to the amount's scale
+
+Products and quotients are split with divmod so no intermediate value
+exceeds int64 for amounts below ~9e12 units and rates below ~9e6.
+"""
+import numpy as np
+
+MONEY_SCALE = 1_000_000
+RATE_SCALE = 1_000_000
+
+
+def _round_half_away(value):
+    return np.where(value >= 0, np.floor(value + 0.5), np.ceil(value - 0.5))
+
+
+def to_fixed(values, scale=MONEY_SCALE):
+    """(int64 array, valid mask): values * scale rounded half away from zero; NaN -> 0, valid False."""
+    values = np.asarray(values, dtype=float)
+    valid = ~np.isnan(values)
+    scaled = _round_half_away(np.where(valid, values, 0.0) * scale)
+    return scaled.astype(np.int64), valid
+
+
+def from_fixed(values, valid=None, scale=MONEY_SCALE):
+    """Float array of fixed values, NaN where not valid."""
+    result = values / scale
+    if valid is not None:
+        result = np.where(valid, result, np.nan)
+    return result
+
+
+def _div_round(numerator, denominator):
+    """numerator / denominator for non-negative int64 arrays, rounded half up."""
+    return (numerator * 2 + denominator) // (denominator * 2)
+
+
+def _signed(amount, rate):
+    """(sign, |amount|, |rate|): the magnitudes are rounded, then the sign applied, so ties go away from zero."""
+    sign = np.where((amount < 0) != (rate < 0), -1, 1)
+    return sign, np.abs(amount), np.abs(rate)
+
+
+def mul_rate(amount, rate, scale=RATE_SCALE):
+    """amount * (rate / scale) for int64 arrays, rounded to the amount's unit."""
+    sign, amount, rate = _signed(amount, rate)
+    q, r = np.divmod(amount, scale)
+    return sign * (q * rate + _div_round(r * rate, scale))
+
+
+def div_rate(amount, rate, scale=RATE_SCALE):
+    """amount / (rate / scale) for int64 arrays with rate != 0, rounded to the amount's unit."""
+    sign, amount, rate = _signed(amount, rate)
+    q, r = np.divmod(amount, rate)
+    return sign * (q * scale + _div_round(r * scale, rate))
@@ -0,0 +1,102 @@
+import hashlib
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+import yaml
+
+from calculate.categories import codes_in
+
+DEFAULT_OVERRIDES_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                      'pricing_overrides.yaml')
+
+
+def _rate(value):
+    """0.95 / "28.5/27.2" -> float."""
+    if isinstance(value, str) and '/' in value:
+        numerator, denominator = value.split('/', 1)
+        return float(numerator) / float(denominator)
+    return float(value)
+
+
+class PricingOverrides:
+    """
+    Pricing overrides compiled once from pricing_overrides.yaml.
+
+    The extra-discount table becomes an account Index plus an aligned rate
+    array, so a batch is resolved with one get_indexer (or one lookup per
+    category for Categorical columns) and a take. sql_rate() renders the
+    same table for the SQL engine, so both engines read one source.
+    """
+
+    def __init__(self, spec, version=None):
+        spec = spec or {}
+        self.version = version if version is not None else spec.get('version')
+
+        account_rates = {}
+        for entry in spec.get('extra_discount') or []:
+            rate = _rate(entry['rate'])
+            for account in entry.get('accounts') or []:
+                # 同一账户出现多次时后面的费率生效
+                account_rates[account] = rate
+        self.accounts = pd.Index(list(account_rates), dtype=object)
+        self.rates = np.fromiter(account_rates.values(), dtype=float, count=len(account_rates))
+
+    @classmethod
+    def from_file(cls, path=DEFAULT_OVERRIDES_PATH):
+        with open(path, 'rb') as f:
+            content = f.read()
+        spec = yaml.safe_load(content) or {}
+        version = f"{spec.get('version')}:{hashlib.sha1(content).hexdigest()[:12]}"
+        return cls(spec, version=version)
+
+    def extra_discount_rates(self, accounts: pd.Series) -> np.ndarray:
+        """Extra internal_cost rate of every account value, NaN where none is set."""
+        codes = codes_in(self.accounts, accounts)
+        rates = np.full(len(codes), np.nan)
+        found = codes >= 0
+        rates[found] = self.rates[codes[found]]
+        return rates
+
+    def sql_rate(self, column, default=1.0):
+        """ClickHouse expression of the extra-discount rate of column (default when unlisted)."""
+        if not len(self.accounts):
+            return repr(float(default))
+        accounts = ', '.join("'" + a.replace('\\', '\\\\').replace("'", "\\'") + "'" for a in self.accounts)
+        rates = ', '.join(repr(float(r)) for r in self.rates)
+        return (f"transform({column}, [{accounts}], "
+                f"CAST([{rates}] AS Array(Float64)), toFloat64({float(default)!r}))")
+
+
+class OverridesStore:
+    """
+    The current PricingOverrides of a file, recompiled when the file changes.
+
+    current() only stats the file; callers take it once per run or day and
+    pass the compiled tables down, so an edited file is picked up by the
+    next run without a redeploy and never in the middle of a day.
+    """
+
+    def __init__(self, path=DEFAULT_OVERRIDES_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._stamp = None
+        self._overrides = None
+
+    def current(self) -> PricingOverrides:
+        stat = os.stat(self.path)
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            if self._overrides is None or stamp != self._stamp:
+                self._overrides = PricingOverrides.from_file(self.path)
+                self._stamp = stamp
+            return self._overrides
+
+
+_default_store = OverridesStore()
+
+
+def default_overrides() -> PricingOverrides:
+    """Overrides of the bundled pricing_overrides.yaml."""
+    return _default_store.current()
@@ -0,0 +1,114 @@
+import re
+import threading
+
+from calculate.rule_matcher import RULE_COLUMNS, RULES
+
+# 规则键列(project_id / service_description / sku_id)是否非空 -> dim_contract 过滤条件
+_RULE_KEY_COLUMNS = ('project_id', 'service_description', 'sku_id')
+
+
+def _quote(value):
+    return "'" + str(value).replace('\\', '\\\\').replace("'", "\\'") + "'"
+
+
+def _base_type(ch_type):
+    """'Nullable(LowCardinality(String))' -> 'String'."""
+    while True:
+        match = re.match(r'^(Nullable|LowCardinality)\((.*)\)$', ch_type)
+        if not match:
+            return ch_type
+        ch_type = match.group(2)
+
+
+def _attribute_type(ch_type):
+    """Dictionary attribute type of a dim_contract column: LowCardinality dropped, always Nullable."""
+    return f"Nullable({_base_type(ch_type)})"
+
+
+def key_types(column_types):
+    """
+    Dictionary key type of every rule key column, from dim_contract's DESCRIBE
+    types: dictionary keys cannot be Nullable, LowCardinality is dropped.
+    """
+    keys = dict.fromkeys(k for _, _, rule_keys in RULES for k in rule_keys)
+    return {k: _base_type(column_types.get(k, 'String')) for k in keys}
+
+
+def dictionary_name(rule, dim_month, database='billing'):
+    """billing.dim_contract_rule5_202601"""
+    return f"{database}.dim_contract_{rule}_{dim_month.replace('-', '')}"
+
+
+def rule_condition(pattern, dim_month):
+    """dim_contract rows of one rule pattern in dim_month."""
+    conditions = [f"month = {_quote(dim_month)}", "billing_account_id IS NOT NULL"]
+    conditions += [f"{col} IS {'NOT NULL' if has else 'NULL'}" for col, has in zip(_RULE_KEY_COLUMNS, pattern)]
+    return ' AND '.join(conditions)
+
+
+def create_dictionary_sql(name, keys, key_types, attribute_types, where, source=None, database='billing'):
+    """
+    CREATE OR REPLACE DICTIONARY over billing.dim_contract rows matching where,
+    keyed by keys. source: named collection holding the connection and
+    credentials of the dictionary source, so none are written into the DDL.
+    """
+    columns = [f"    {k} {key_types[k]}" for k in keys]
+    columns += [f"    {col} {attribute_types[col]}" for col in RULE_COLUMNS]
+    options = [f"NAME {source}"] if source else []
+    options += [f"DB {_quote(database)}", "TABLE 'dim_contract'", f"WHERE {_quote(where)}"]
+    return (f"CREATE OR REPLACE DICTIONARY {name}\n(\n" + ',\n'.join(columns) + "\n)\n"
+            f"PRIMARY KEY {', '.join(keys)}\n"
+            f"SOURCE(CLICKHOUSE({' '.join(options)}))\n"
+            "LAYOUT(COMPLEX_KEY_HASHED())\n"
+            "LIFETIME(0)")
+
+
+class RuleDictionaries:
+    """
+    One ClickHouse dictionary per contract rule pattern and dim_contract
+    month, for the SQL engine's dictGetOrNull rule resolution.
+
+    ensure() (re)creates a month's dictionaries when the dim_contract
+    version of the month differs from the one they were built from (always
+    on first use in a process), and returns rule name -> dictionary name.
+    LIFETIME(0) keeps ClickHouse from reloading them on its own; a
+    duplicated key keeps one row, so lookups never multiply rows.
+    source: server-side named collection the dictionaries read dim_contract
+    through (a read-only user); without it ClickHouse connects as its
+    default user. The ETL's own credentials are never put in the DDL.
+    """
+
+    def __init__(self, database='billing', source=None):
+        self.database = database
+        self.source = source
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def names(self, dim_month):
+        return {rule: dictionary_name(rule, dim_month, self.database) for rule, _, _ in RULES}
+
+    def ensure(self, client, dim_month, version, column_types):
+        """
+        column_types: dim_contract column -> ClickHouse type (from DESCRIBE).
+        version: dim_contract version of the month; unchanged -> no DDL.
+        """
+        names = self.names(dim_month)
+        with self._lock:
+            if self._versions.get(dim_month) == version:
+                return names
+            attribute_types = {col: _attribute_type(column_types.get(col, 'String')) for col in RULE_COLUMNS}
+            types = key_types(column_types)
+            for rule, pattern, keys in RULES:
+                client.execute(create_dictionary_sql(names[rule], keys, types, attribute_types,
+                                                     rule_condition(pattern, dim_month), source=self.source,
+                                                     database=self.database),
+                               tag='rule_dictionary')
+                client.execute(f"SYSTEM RELOAD DICTIONARY {names[rule]}", tag='rule_dictionary')
+            self._versions[dim_month] = version
+        return names
+
+    def drop(self, client, dim_month):
+        with self._lock:
+            for name in self.names(dim_month).values():
+                client.execute(f"DROP DICTIONARY IF EXISTS {name}", tag='rule_dictionary')
+            self._versions.pop(dim_month, None)
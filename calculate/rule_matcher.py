@@ -0,0 +1,164 @@
+from datetime import datetime
+import os
+import pickle
+
+import numpy as np
+import pandas as pd
+from pandas import DataFrame
+
+from calculate.categories import codes_in
+from utils.enum import PROJECT_ID, SERVICE_DESCRIPTION, SKU_ID, BILLING_ACCOUNT_ID
+
+# 合同给账单行打的标签列
+RULE_COLUMNS = ["mode", "discount", "price", "credit_fields", "customer_id", "contract_id"]
+
+# (project_id, service_description, sku_id) 是否非空 -> 匹配键
+# 顺序即优先级: 后面的规则覆盖前面的, 越具体越靠后
+RULES = [
+    ("rule1", (False, False, False), [BILLING_ACCOUNT_ID]),
+    ("rule5", (False, False, True), [BILLING_ACCOUNT_ID, SKU_ID]),
+    ("rule3", (False, True, False), [BILLING_ACCOUNT_ID, SERVICE_DESCRIPTION]),
+    ("rule7", (False, True, True), [BILLING_ACCOUNT_ID, SERVICE_DESCRIPTION, SKU_ID]),
+    ("rule2", (True, False, False), [BILLING_ACCOUNT_ID, PROJECT_ID]),
+    ("rule6", (True, False, True), [BILLING_ACCOUNT_ID, PROJECT_ID, SKU_ID]),
+    ("rule4", (True, True, False), [BILLING_ACCOUNT_ID, PROJECT_ID, SERVICE_DESCRIPTION]),
+    ("rule8", (True, True, True), [BILLING_ACCOUNT_ID, PROJECT_ID, SERVICE_DESCRIPTION, SKU_ID]),
+]
+
+_FLOAT_COLUMNS = ("discount", "price")
+
+# 序列化格式版本, 结构变化时递增, 旧文件自动失效
+INDEX_FORMAT = 1
+
+
+class ContractRuleMatcher:
+    """
+    Hash index of dim_contract rows by matching rule.
+
+    Each dim row belongs to the rule given by which of project_id /
+    service_description / sku_id it sets, and is indexed under that rule's
+    key columns. match() looks every batch row up in the eight indexes and
+    resolves RULE_COLUMNS in rule order: a later rule overrides an earlier one
+    column by column where its value is not null, as the former merge +
+    DataFrame.update chain did. Within one rule a duplicated key keeps the
+    last dim row.
+
+    Build it once per dim_contract month and reuse it for every batch;
+    save() / load() keep it in a file stamped with the dim_contract version
+    so other runs and processes can skip the query and the build.
+    """
+
+    def __init__(self, dim_df: DataFrame):
+        dim_df = dim_df.reset_index(drop=True)
+        for col in (BILLING_ACCOUNT_ID, PROJECT_ID, SERVICE_DESCRIPTION, SKU_ID):
+            if col not in dim_df.columns:
+                # 空的 dim_contract 查询结果没有列
+                dim_df[col] = pd.Series([None] * len(dim_df), dtype=object)
+        self.size = len(dim_df)
+        self._values = {}
+        self._notnull = {}
+        for col in RULE_COLUMNS:
+            series = dim_df[col] if col in dim_df.columns else pd.Series([None] * self.size, dtype=object)
+            if col in _FLOAT_COLUMNS:
+                self._values[col] = pd.to_numeric(series, errors="coerce").to_numpy(dtype=float)
+            else:
+                self._values[col] = series.to_numpy(dtype=object)
+            self._notnull[col] = series.notna().to_numpy()
+
+        # 每个键列的取值编码成整数, 规则键 = 各列编码的混合进制组合(int64), 查找走整数哈希
+        self._categories = {}
+        dim_codes = {}
+        for col in (BILLING_ACCOUNT_ID, PROJECT_ID, SERVICE_DESCRIPTION, SKU_ID):
+            codes, uniques = pd.factorize(dim_df[col].to_numpy(dtype=object), use_na_sentinel=True)
+            self._categories[col] = pd.Index(uniques)
+            dim_codes[col] = codes
+
+        has_value = np.column_stack([dim_codes[c] >= 0 for c in (PROJECT_ID, SERVICE_DESCRIPTION, SKU_ID)])
+        self._rules = []
+        for name, pattern, keys in RULES:
+            rule_rows = (has_value == np.array(pattern)).all(axis=1) & (dim_codes[BILLING_ACCOUNT_ID] >= 0)
+            positions = np.flatnonzero(rule_rows)
+            if not len(positions):
+                continue
+            key_index = pd.Index(self._combine(keys, {k: dim_codes[k][positions] for k in keys}))
+            # 同一规则下键重复时保留最后一行
+            unique = ~key_index.duplicated(keep="last")
+            self._rules.append((name, keys, key_index[unique], positions[unique]))
+
+    def _combine(self, keys, codes):
+        """Mixed-radix int64 key of the per-column codes; -1 where any column has no code."""
+        combined = np.zeros(len(codes[keys[0]]), dtype=np.int64)
+        missing = np.zeros(len(combined), dtype=bool)
+        for k in keys:
+            combined = combined * (len(self._categories[k]) + 1) + codes[k]
+            missing |= codes[k] < 0
+        combined[missing] = -1
+        return combined
+
+    @property
+    def rules(self):
+        return [name for name, _, _, _ in self._rules]
+
+    def match(self, df: DataFrame) -> dict:
+        """RULE_COLUMNS values for every row of df, as arrays aligned with df's rows."""
+        n = len(df)
+        chosen = {col: np.full(n, -1, dtype=np.int64) for col in RULE_COLUMNS}
+        codes = {col: codes_in(cats, df[col]) for col, cats in self._categories.items()}
+        for _, keys, key_index, positions in self._rules:
+            batch_keys = self._combine(keys, codes)
+            hit = np.where(batch_keys >= 0, key_index.get_indexer(batch_keys), -1)
+            matched = hit >= 0
+            if not matched.any():
+                continue
+            dim_pos = np.where(matched, positions[np.maximum(hit, 0)], -1)
+            for col in RULE_COLUMNS:
+                take = matched & self._notnull[col][np.maximum(dim_pos, 0)]
+                chosen[col][take] = dim_pos[take]
+
+        result = {}
+        for col in RULE_COLUMNS:
+            pos = chosen[col]
+            found = pos >= 0
+            if col in _FLOAT_COLUMNS:
+                values = np.full(n, np.nan)
+            else:
+                values = np.full(n, None, dtype=object)
+            values[found] = self._values[col][pos[found]]
+            result[col] = values
+        return result
+
+    def tag(self, df: DataFrame):
+        """Set RULE_COLUMNS on df in place."""
+        for col, values in self.match(df).items():
+            df[col] = values
+
+    def save(self, path, version):
+        """Write the index to path with its dim_contract version stamp (atomic replace)."""
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        payload = {
+            'format': INDEX_FORMAT,
+            'version': version,
+            'created': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'index': self,
+        }
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(payload, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+        return path
+
+    @classmethod
+    def load(cls, path, version):
+        """The index saved at path, or None when missing, unreadable or stamped with another version."""
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, 'rb') as f:
+                payload = pickle.load(f)
+        except Exception:
+            return None
+        if payload.get('format') != INDEX_FORMAT or payload.get('version') != version:
+            return None
+        return payload['index']
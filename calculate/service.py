@@ -1,46 +1,75 @@
+from itertools import chain
+
 import pandas as pd
 from pandas import Series, DataFrame
 import numpy as np
 
-from utils.enum import PROJECT_ID, SERVICE_DESCRIPTION, SKU_ID, BILLING_ACCOUNT_ID
+from calculate import fixed_point
+from calculate.overrides import default_overrides
+from calculate.rule_matcher import ContractRuleMatcher
+from utils.enum import BILLING_ACCOUNT_ID
 
 
 class CalculateService:
 
-    @staticmethod
-    def _calculate_credits_all_type(row: Series) -> Series:
-        dicts_fields = {
-            "COMMITTED_USAGE_DISCOUNT": "c_cud",
-            "COMMITTED_USAGE_DISCOUNT_DOLLAR_BASE": "c_cud_db",
-            "DISCOUNT": "c_discount",
-            "FREE_TIER": "c_free_tier",
-            "PROMOTION": "c_promotion",
-            "RESELLER_MARGIN": "c_rm",
-            "SUBSCRIPTION_BENEFIT": "c_sub_benefit",
-            "SUSTAINED_USAGE_DISCOUNT": "c_sud",
-        }
-        z = zip(row["credits_type"], row["credits_amount"])
-        result = {
-            "c_cud": 0.0,
-            "c_cud_db": 0.0,
-            "c_discount": 0.0,
-            "c_free_tier": 0.0,
-            "c_promotion": 0.0,
-            "c_rm": 0.0,
-            "c_sub_benefit": 0.0,
-            "c_sud": 0.0,
-            "internal_credits_cost": 0.0,
-            "internal_credits_consumption": 0.0
-        }
-        for i in z:
-            if i[0] in dicts_fields:
-                result[dicts_fields[i[0]]] = i[1] + result[dicts_fields[i[0]]]
-        
-        total_credits = sum(row["credits_amount"]) if row["credits_amount"] else 0.0
-        result["internal_credits_cost"] = total_credits
-        result["internal_credits_consumption"] = result["internal_credits_cost"] - result[
-            dicts_fields["RESELLER_MARGIN"]]
-        return pd.Series(result)
+    # credits.type -> 汇总列
+    CREDIT_TYPE_FIELDS = {
+        "COMMITTED_USAGE_DISCOUNT": "c_cud",
+        "COMMITTED_USAGE_DISCOUNT_DOLLAR_BASE": "c_cud_db",
+        "DISCOUNT": "c_discount",
+        "FREE_TIER": "c_free_tier",
+        "PROMOTION": "c_promotion",
+        "RESELLER_MARGIN": "c_rm",
+        "SUBSCRIPTION_BENEFIT": "c_sub_benefit",
+        "SUSTAINED_USAGE_DISCOUNT": "c_sud",
+    }
+
+    @classmethod
+    def _calculate_credits_all_type(cls, df: DataFrame) -> DataFrame:
+        """
+        Pivot the credits_type / credits_amount arrays of every row into the c_*
+        columns plus internal_credits_cost (sum of all amounts) and
+        internal_credits_consumption (minus c_rm).
+
+        All arrays are flattened once, the types are mapped to column codes
+        through a categorical and the amounts summed per (row, column) with
+        bincount, which adds in array order like the per-row loop did.
+        Unknown types only count towards internal_credits_cost.
+        """
+        n = len(df)
+        fields = list(cls.CREDIT_TYPE_FIELDS.values())
+        types = df["credits_type"].to_numpy(dtype=object)
+        amounts = df["credits_amount"].to_numpy(dtype=object)
+
+        type_lens = np.fromiter((len(v) if v is not None else 0 for v in types), dtype=np.int64, count=n)
+        amount_lens = np.fromiter((len(v) if v is not None else 0 for v in amounts), dtype=np.int64, count=n)
+        flat_amounts = np.fromiter(chain.from_iterable(v for v in amounts if v is not None), dtype=float,
+                                   count=int(amount_lens.sum()))
+        rows = np.arange(n)
+        total = np.bincount(np.repeat(rows, amount_lens), weights=flat_amounts, minlength=n)
+
+        if np.array_equal(type_lens, amount_lens):
+            pair_lens = amount_lens
+            flat_types = list(chain.from_iterable(v for v in types if v is not None))
+            pair_amounts = flat_amounts
+        else:
+            # type / amount 数组长度不一致时按 zip 截断
+            pair_lens = np.minimum(type_lens, amount_lens)
+            flat_types = [t for v, k in zip(types, pair_lens) if k for t in v[:k]]
+            pair_amounts = np.fromiter(
+                (a for v, k in zip(amounts, pair_lens) if k for a in v[:k]), dtype=float, count=int(pair_lens.sum())
+            )
+
+        codes = pd.Categorical(flat_types, categories=list(cls.CREDIT_TYPE_FIELDS)).codes
+        known = codes >= 0
+        pair_rows = np.repeat(rows, pair_lens)
+        pivot = np.bincount(pair_rows[known] * len(fields) + codes[known], weights=pair_amounts[known],
+                            minlength=n * len(fields)).reshape(n, len(fields))
+
+        result = pd.DataFrame(pivot, columns=fields, index=df.index)
+        result["internal_credits_cost"] = total
+        result["internal_credits_consumption"] = total - result["c_rm"].to_numpy()
+        return result
 
     @classmethod
     def _calculate_mode1(cls, data: DataFrame):
@@ -73,78 +102,75 @@ class CalculateService:
     @classmethod
     def _calculate_mode4(cls, data: DataFrame):
         # 模式4:（[cost_at_list]+(被选择的[credits]/原厂折扣)）* 客户折扣
+        # 只回写 external_consumption, discount_amount 保持初始值(与原逐行实现一致)
         condition = (data["mode"] == 4)
         if condition.any():
-            # 为避免 apply 过程中的类型冲突，先确保 external_consumption 为 float
-            data.loc[condition, "external_consumption"] = data.loc[condition].apply(
-                CalculateService._calculate_mode4_row, axis=1
-            )["external_consumption"]
+            data.loc[condition, "external_consumption"] = cls._mode4_external_consumption(data.loc[condition])
+
+    @staticmethod
+    def _price_or_one(values: Series) -> np.ndarray:
+        # None 按 1.0 处理, NaN 保持 NaN(与逐行 float(row[...]) 一致)
+        if values.dtype == object:
+            raw = values.to_numpy(dtype=object)
+            raw = np.where(raw == None, 1.0, raw)  # noqa: E711 逐元素比较
+            return raw.astype(float)
+        return values.to_numpy(dtype=float)
 
     @classmethod
-    def _calculate_mode4_row(cls, row: Series) -> Series:
-        try:
-            credit_part = 0.0
-            price_val = float(row["price"]) if row["price"] is not None else 1.0
-            discount_val = float(row["discount"]) if row["discount"] is not None else 1.0
-            
-            if row["credit_fields"]:
-                for f in str(row["credit_fields"]).split('/'):
-                    # 避免除以 0
-                    if price_val != 0:
-                        credit_part += float(row[f]) / price_val
-            
-            row["external_consumption"] = (float(row["cost_at_list"]) * discount_val) + (credit_part * discount_val)
-            row["discount_amount"] = credit_part
-            return row
-        except Exception as e:
-            raise Exception(f"calculate mode4 error: {e}") from e
+    def _mode4_external_consumption(cls, rows: DataFrame) -> np.ndarray:
+        """
+        Mode 4 for a block of rows, by distinct credit_fields value: the selected
+        c_* columns are divided by price (skipped when price is 0) and summed in
+        credit_fields order, then cost_at_list and the credit part are scaled by
+        the discount. None price/discount count as 1.0.
+        """
+        price = cls._price_or_one(rows["price"])
+        discount = cls._price_or_one(rows["discount"])
+        credit_part = np.zeros(len(rows))
+        price_nonzero = price != 0
+
+        credit_fields = rows["credit_fields"].to_numpy(dtype=object)
+        for fields in pd.unique(credit_fields):
+            if not fields:
+                continue
+            group = (credit_fields == fields) & price_nonzero
+            if not group.any():
+                continue
+            part = credit_part[group]
+            for f in str(fields).split('/'):
+                if f not in rows.columns:
+                    raise Exception(f"calculate mode4 error: {f!r}")
+                part = part + rows[f].to_numpy(dtype=float)[group] / price[group]
+            credit_part[group] = part
+
+        return (rows["cost_at_list"].to_numpy(dtype=float) * discount) + (credit_part * discount)
 
     @classmethod
-    def add_rule_tag(cls, df: DataFrame, dim_df: DataFrame):
+    def add_rule_tag(cls, df: DataFrame, dim_df):
         """
         根据维度匹配规则打标签
+        dim_df: dim_contract DataFrame, or a ContractRuleMatcher built from it.
         """
-        # 初始化列，显式指定 dtype 避免 FutureWarning
-        df["mode"] = None
-        df["discount"] = pd.Series([np.nan] * len(df), dtype='float64')
-        df["price"] = pd.Series([np.nan] * len(df), dtype='float64')
-        df["credit_fields"] = None
-        df["customer_id"] = None
-        df["contract_id"] = None
-        
-        columns = ["mode", "discount", "price", "credit_fields", "customer_id", "contract_id"]
-        
-        rule1 = (dim_df[PROJECT_ID].isna() & dim_df[SERVICE_DESCRIPTION].isna() & dim_df[SKU_ID].isna(), [BILLING_ACCOUNT_ID])
-        rule2 = (~dim_df[PROJECT_ID].isna() & dim_df[SERVICE_DESCRIPTION].isna() & dim_df[SKU_ID].isna(), [BILLING_ACCOUNT_ID, PROJECT_ID])
-        rule3 = (dim_df[PROJECT_ID].isna() & ~dim_df[SERVICE_DESCRIPTION].isna() & dim_df[SKU_ID].isna(), [BILLING_ACCOUNT_ID, SERVICE_DESCRIPTION])
-        rule4 = (~dim_df[PROJECT_ID].isna() & ~dim_df[SERVICE_DESCRIPTION].isna() & dim_df[SKU_ID].isna(), [BILLING_ACCOUNT_ID, PROJECT_ID, SERVICE_DESCRIPTION])
-        rule5 = (dim_df[PROJECT_ID].isna() & dim_df[SERVICE_DESCRIPTION].isna() & ~dim_df[SKU_ID].isna(), [BILLING_ACCOUNT_ID, SKU_ID])
-        rule6 = (~dim_df[PROJECT_ID].isna() & dim_df[SERVICE_DESCRIPTION].isna() & ~dim_df[SKU_ID].isna(), [BILLING_ACCOUNT_ID, PROJECT_ID, SKU_ID])
-        rule7 = (dim_df[PROJECT_ID].isna() & ~dim_df[SERVICE_DESCRIPTION].isna() & ~dim_df[SKU_ID].isna(), [BILLING_ACCOUNT_ID, SERVICE_DESCRIPTION, SKU_ID])
-        rule8 = (~dim_df[PROJECT_ID].isna() & ~dim_df[SERVICE_DESCRIPTION].isna() & ~dim_df[SKU_ID].isna(), [BILLING_ACCOUNT_ID, PROJECT_ID, SERVICE_DESCRIPTION, SKU_ID])
-        
-        conditions = [rule1, rule5, rule3, rule7, rule2, rule6, rule4, rule8]
-        
-        for condition in conditions:
-            bool_condition = condition[0]
-            keys = condition[1]
-            sub_dim_rule = dim_df[bool_condition]
-            if sub_dim_rule.empty:
-                continue
-            
-            # 仅保留需要的列进行 merge
-            rule_df = pd.merge(df[keys], sub_dim_rule[keys + columns], on=keys, how='left')
-            # 使用 update 覆盖已有值
-            df.update(rule_df[columns])
+        cls.contract_matcher(dim_df).tag(df)
+
+    @staticmethod
+    def contract_matcher(dim_df, billing_account_ids=None) -> ContractRuleMatcher:
+        """
+        ContractRuleMatcher for dim_df. A DataFrame is first narrowed to
+        billing_account_ids when given; an existing matcher is returned as is.
+        """
+        if isinstance(dim_df, ContractRuleMatcher):
+            return dim_df
+        if billing_account_ids is not None:
+            dim_df = dim_df[dim_df[BILLING_ACCOUNT_ID].isin(billing_account_ids)]
+        return ContractRuleMatcher(dim_df)
 
     @classmethod
     def calculate(cls, df, dim_contract_df):
         billing_account_ids = df[BILLING_ACCOUNT_ID].drop_duplicates().to_list()
-        dim_data_condition = (dim_contract_df[BILLING_ACCOUNT_ID].isin(billing_account_ids))
-        
-        cls.add_rule_tag(df, dim_contract_df[dim_data_condition])
+        cls.add_rule_tag(df, cls.contract_matcher(dim_contract_df, billing_account_ids))
         
-        credits_df = df.apply(cls._calculate_credits_all_type, axis=1)
+        credits_df = cls._calculate_credits_all_type(df)
         data = pd.concat([df, credits_df], axis=1)
         
         # 初始化结果列为 float
@@ -162,14 +188,35 @@ class CalculateService:
         return data
 
     @classmethod
-    def calculate_with_credits(cls, df, dim_contract_df):
+    def calculate_with_credits(cls, df, dim_contract_df, money_mode='float', copy=True, overrides=None,
+                               engine='pandas'):
+        """
+        money_mode: 'float' computes in float64; 'fixed' does the cost, credit
+        and consumption arithmetic in scaled int64 (see _calculate_fixed) and
+        converts only the result columns back to float.
+        engine: 'pandas' runs one masked pandas step per mode; 'numpy' runs the
+        float calculation as one array kernel (see _calculate_numpy) with
+        identical results. Fixed money mode is array based either way.
+        copy: False fills the result columns into df itself and returns it,
+        for callers that own the batch (the pipelines); df is tagged in place
+        either way.
+        overrides: compiled PricingOverrides, defaults to pricing_overrides.yaml.
+        """
         billing_account_ids = df[BILLING_ACCOUNT_ID].drop_duplicates().to_list()
-        # 修正此处的过滤逻辑
-        dim_subset = dim_contract_df[dim_contract_df[BILLING_ACCOUNT_ID].isin(billing_account_ids)]
+        # dim_contract_df 可以直接传入预先构建好的 ContractRuleMatcher, 批次之间复用
+        cls.add_rule_tag(df, cls.contract_matcher(dim_contract_df, billing_account_ids))
         
-        cls.add_rule_tag(df, dim_subset)
-        
-        data = df.copy()
+        data = df.copy() if copy else df
+        if money_mode == 'fixed':
+            cls._calculate_fixed(data, overrides)
+            return data
+        if money_mode != 'float':
+            raise ValueError(f"unknown money_mode: {money_mode!r}")
+        if engine == 'numpy':
+            cls._calculate_numpy(data, overrides)
+            return data
+        if engine != 'pandas':
+            raise ValueError(f"unknown engine: {engine!r}")
         # 初始化结果列为 float
         data["external_consumption"] = 0.0
         data["discount_amount"] = 0.0
@@ -177,7 +224,7 @@ class CalculateService:
         data["internal_cost"] = data["cost"] + data["internal_credits_cost"]
         data["internal_consumption"] = data["cost"] + data["internal_credits_consumption"]
         
-        cls.extra_discount(data)
+        cls.extra_discount(data, overrides)
         cls._calculate_mode1(data)
         cls._calculate_mode2(data)
         cls._calculate_mode3(data)
@@ -185,25 +232,167 @@ class CalculateService:
         return data
 
     @classmethod
-    def extra_discount(cls, data):
-        discount_dict = {
-            0.975: ["01F0DC-F91DC5-0F0CAB", "0143DC-442DB6-FDE892", "01FEE2-46994F-B32CB9", 
-                    "01D111-877AA6-FC9006", "01368B-077E67-C11E2D", "01EB13-0127DF-324A48", 
-                    "013EEC-7ED413-0F0733", "018D1D-AEDA58-9E382C"],
-            0.965: ["01ACBD-4B4CE4-2D688D"],
-            0.95: ["01281B-3D24E6-B4D363", "01587C-263C61-84FBDB", "015C37-EF4FBF-AE3E2C", "015336-4C0FAA-732523"],
-            0.88: ['01BE65-4D6A90-81C9C9', '01AEFA-0E57C7-5D22AF', '012980-39DCA3-6B08CF', 
-                    '01D80B-3126BB-D0C7C1', '01D977-BDDE3C-14BE03', '01EFBF-FE25D9-1F8A1C', 
-                    '01B528-640F36-FF1F84', '013A21-83F145-1DE13D', '0134F7-148D6A-A3E367', '016577-4C47C6-43BEE5'],
-            28.5/27.2: ["010EDC-72FE2A-79D4CC"]
-        }
-
-        account_discount_map = {}
-        for rate, accounts in discount_dict.items():
-            for account in accounts:
-                account_discount_map[account] = rate
-
-        discount_series = data[BILLING_ACCOUNT_ID].map(account_discount_map)
+    def _calculate_numpy(cls, data: DataFrame, overrides=None):
+        """
+        The float calculation in one pass over contiguous arrays, in place.
+
+        Every input column is read once into a float64 array, each mode's
+        external_consumption is evaluated over the whole batch and np.select
+        picks one per row by mode; the four result columns are assigned once.
+        The operations and their order are those of the pandas steps, so the
+        results are bit-identical.
+        """
+        n = len(data)
+        mode = pd.to_numeric(data["mode"], errors="coerce").to_numpy(dtype=float)
+        cost = data["cost"].to_numpy(dtype=float)
+        credits_consumption = data["internal_credits_consumption"].to_numpy(dtype=float)
+
+        internal_cost = cost + data["internal_credits_cost"].to_numpy(dtype=float)
+        internal_consumption = cost + credits_consumption
+        rates = cls.extra_discount_rates(data, overrides)
+        has_rate = ~np.isnan(rates)
+        if has_rate.any():
+            internal_cost[has_rate] *= rates[has_rate]
+
+        is_mode = [mode == m for m in (1, 2, 3, 4)]
+        discount = pd.to_numeric(data["discount"], errors="coerce").to_numpy(dtype=float)
+        price = pd.to_numeric(data["price"], errors="coerce").to_numpy(dtype=float)
+        usage_price = data["usage_amount_in_pricing_units"].to_numpy(dtype=float) * price
+
+        mode4 = np.zeros(n)
+        if is_mode[3].any():
+            # 模式4 的 None 单价/折扣按 1.0
+            price4 = cls._price_or_one(data["price"])
+            discount4 = cls._price_or_one(data["discount"])
+            credit_part = np.zeros(n)
+            credit_fields = data["credit_fields"].to_numpy(dtype=object)
+            divisible = is_mode[3] & (price4 != 0)
+            for fields in pd.unique(credit_fields[divisible]):
+                if not fields:
+                    continue
+                group = divisible & (credit_fields == fields)
+                part = credit_part[group]
+                for f in str(fields).split('/'):
+                    if f not in data.columns:
+                        raise Exception(f"calculate mode4 error: {f!r}")
+                    part = part + data[f].to_numpy(dtype=float)[group] / price4[group]
+                credit_part[group] = part
+            mode4 = (data["cost_at_list"].to_numpy(dtype=float) * discount4) + (credit_part * discount4)
+
+        data["external_consumption"] = np.select(
+            is_mode,
+            [internal_consumption * discount, usage_price, usage_price * discount, mode4],
+            default=0.0,
+        )
+        data["discount_amount"] = np.where(is_mode[0], credits_consumption, 0.0)
+        data["internal_cost"] = internal_cost
+        data["internal_consumption"] = internal_consumption
+
+    @classmethod
+    def _calculate_fixed(cls, data: DataFrame, overrides=None):
+        """
+        calculate_with_credits arithmetic on scaled int64 values, in place.
+
+        Amounts (cost, credits, cost_at_list, usage) are converted once to
+        micro-units and discount / price / extra-discount rates to millionths,
+        each rounded half away from zero. Sums are then exact; every rate
+        multiplication or division rounds its result half away from zero to a
+        micro-unit. A NaN input makes the result NaN, as in float mode, and a
+        None discount / price counts as 1.0 in mode 4 only.
+        """
+        fx = fixed_point
+        mode = pd.to_numeric(data["mode"], errors="coerce").to_numpy(dtype=float)
+
+        cost, cost_ok = fx.to_fixed(data["cost"])
+        credits_cost, credits_cost_ok = fx.to_fixed(data["internal_credits_cost"])
+        credits_consumption, credits_consumption_ok = fx.to_fixed(data["internal_credits_consumption"])
+
+        internal_cost = cost + credits_cost
+        internal_cost_ok = cost_ok & credits_cost_ok
+        internal_consumption = cost + credits_consumption
+        internal_consumption_ok = cost_ok & credits_consumption_ok
+
+        rates = cls.extra_discount_rates(data, overrides)
+        has_rate = ~np.isnan(rates)
+        if has_rate.any():
+            rate, _ = fx.to_fixed(rates, fx.RATE_SCALE)
+            internal_cost = np.where(has_rate, fx.mul_rate(internal_cost, rate), internal_cost)
+
+        external = np.zeros(len(data), dtype=np.int64)
+        external_ok = np.ones(len(data), dtype=bool)
+        discount_amount = np.zeros(len(data), dtype=np.int64)
+        discount_amount_ok = np.ones(len(data), dtype=bool)
+
+        discount, discount_ok = fx.to_fixed(pd.to_numeric(data["discount"], errors="coerce"), fx.RATE_SCALE)
+        price, price_ok = fx.to_fixed(pd.to_numeric(data["price"], errors="coerce"), fx.RATE_SCALE)
+
+        # 模式1: （[cost]+[credits(exclude c_rm)]）* 客户折扣
+        m = mode == 1
+        if m.any():
+            external[m] = fx.mul_rate(internal_consumption[m], discount[m])
+            external_ok[m] = internal_consumption_ok[m] & discount_ok[m]
+            discount_amount[m] = credits_consumption[m]
+            discount_amount_ok[m] = credits_consumption_ok[m]
+
+        # 模式2 / 模式3: [usage.amount] * 单价 (* 折扣)
+        m = (mode == 2) | (mode == 3)
+        if m.any():
+            usage, usage_ok = fx.to_fixed(data["usage_amount_in_pricing_units"])
+            external[m] = fx.mul_rate(usage[m], price[m])
+            external_ok[m] = usage_ok[m] & price_ok[m]
+            m3 = mode == 3
+            external[m3] = fx.mul_rate(external[m3], discount[m3])
+            external_ok[m3] &= discount_ok[m3]
+
+        # 模式4:（[cost_at_list]+(被选择的[credits]/原厂折扣)）* 客户折扣
+        m = mode == 4
+        if m.any():
+            rows = data.loc[m]
+            price4, price4_ok = fx.to_fixed(cls._price_or_one(rows["price"]), fx.RATE_SCALE)
+            discount4, discount4_ok = fx.to_fixed(cls._price_or_one(rows["discount"]), fx.RATE_SCALE)
+            cost_at_list, cost_at_list_ok = fx.to_fixed(rows["cost_at_list"])
+            credit_part = np.zeros(len(rows), dtype=np.int64)
+            credit_part_ok = np.ones(len(rows), dtype=bool)
+
+            # NaN 单价的行不能参与除法, 结果记为 NaN
+            divisible = price4 != 0
+            credit_fields = rows["credit_fields"].to_numpy(dtype=object)
+            for fields in pd.unique(credit_fields):
+                if not fields:
+                    continue
+                group = (credit_fields == fields) & (divisible | ~price4_ok)
+                if not group.any():
+                    continue
+                usable = group & price4_ok & divisible
+                credit_part_ok[group & ~price4_ok] = False
+                for f in str(fields).split('/'):
+                    if f not in rows.columns:
+                        raise Exception(f"calculate mode4 error: {f!r}")
+                    amount, amount_ok = fx.to_fixed(rows[f].to_numpy(dtype=float)[usable])
+                    credit_part[usable] += fx.div_rate(amount, price4[usable])
+                    credit_part_ok[usable] &= amount_ok
+
+            external[m] = fx.mul_rate(cost_at_list, discount4) + fx.mul_rate(credit_part, discount4)
+            external_ok[m] = cost_at_list_ok & credit_part_ok & discount4_ok
+
+        data["external_consumption"] = fx.from_fixed(external, external_ok)
+        data["discount_amount"] = fx.from_fixed(discount_amount, discount_amount_ok)
+        data["internal_cost"] = fx.from_fixed(internal_cost, internal_cost_ok)
+        data["internal_consumption"] = fx.from_fixed(internal_consumption, internal_consumption_ok)
+
+    @classmethod
+    def extra_discount_rates(cls, data, overrides=None) -> np.ndarray:
+        """
+        Extra internal_cost rate of every row of data, NaN for accounts without one.
+        overrides: compiled PricingOverrides, defaults to pricing_overrides.yaml.
+        """
+        if overrides is None:
+            overrides = default_overrides()
+        return overrides.extra_discount_rates(data[BILLING_ACCOUNT_ID])
+
+    @classmethod
+    def extra_discount(cls, data, overrides=None):
+        discount_series = pd.Series(cls.extra_discount_rates(data, overrides), index=data.index)
         mask = discount_series.notna()
         if mask.any():
-            data.loc[mask, "internal_cost"] *= discount_series[mask]
\ No newline at end of file
+            data.loc[mask, "internal_cost"] *= discount_series[mask]
@@ -1,146 +1,177 @@
-def get_calculation_sql(invoice_month, dim_month):
-    # SQL template for monthly billing calculation
+from calculate.overrides import default_overrides
+from calculate.rule_matcher import RULE_COLUMNS, RULES
+
+# 目标表列顺序(billing.dwm_standard_daily_billing_calculated)
+CALCULATED_COLUMNS = [
+    'usage_day', 'invoice_month', 'billing_account_id', 'customer_id', 'contract_id',
+    'service_id', 'service_description', 'sku_id', 'sku_description', 'project_id', 'project_name',
+    'usage_pricing_unit', 'usage_amount_in_pricing_units', 'currency', 'currency_conversion_rate', 'cost_type',
+    'cost', 'cost_at_list',
+    'c_cud', 'c_cud_db', 'c_discount', 'c_free_tier', 'c_promotion', 'c_rm', 'c_sub_benefit', 'c_sud',
+    'internal_credits_cost', 'internal_credits_consumption', 'internal_cost', 'internal_consumption',
+    'external_consumption', 'discount_amount', 'mode', 'price', 'discount', 'credit_fields', 'etl_time',
+]
+
+CREDIT_COLUMNS = ['c_cud', 'c_cud_db', 'c_discount', 'c_free_tier', 'c_promotion', 'c_rm', 'c_sub_benefit', 'c_sud']
+
+# Python 引擎的 ods 查询不读取这些描述列, 写入时取类型默认值; 下推写同样的值, 切换引擎不改变目标表内容
+_DESCRIPTIVE_DEFAULTS = {
+    'sku_description': "''",
+    'project_name': "''",
+    'usage_pricing_unit': "''",
+    'currency': "''",
+    'currency_conversion_rate': "toFloat64(0)",
+}
+
+# 匹配键列 -> dim_contract 中是否非空的条件
+_RULE_KEY_COLUMNS = ('project_id', 'service_description', 'sku_id')
+
+
+# 按 billing_account_id 哈希分桶切分月度任务, 参数 buckets / bucket
+ACCOUNT_BUCKET_CONDITION = "modulo(cityHash64(billing_account_id), %(buckets)s) = %(bucket)s"
+
+
+def slice_condition(account_filter=False, account_bucket=False):
+    """WHERE condition of the rows one pushdown (slice) writes, with the same parameters."""
+    conditions = ["invoice_month = %(invoice_month)s", "usage_day >= %(usage_day_start)s",
+                  "usage_day < %(usage_day_end)s"]
+    if account_filter:
+        conditions.append("billing_account_id IN %(billing_account_ids)s")
+    if account_bucket:
+        conditions.append(ACCOUNT_BUCKET_CONDITION)
+    return ' AND '.join(conditions)
+
+
+def _settings_clause(settings):
+    if not settings:
+        return ""
+    return "\nSETTINGS " + ', '.join(f"{k} = {v!r}" for k, v in settings.items())
+
+
+def _rule_ctes(rules, account_filter):
+    ctes = []
+    for name, pattern, _ in rules:
+        conditions = ["month = %(dim_month)s"]
+        conditions += [f"{col} IS {'NOT NULL' if has else 'NULL'}" for col, has in zip(_RULE_KEY_COLUMNS, pattern)]
+        if account_filter:
+            conditions.append("billing_account_id IN %(billing_account_ids)s")
+        ctes.append(f"    {name} AS (SELECT * FROM billing.dim_contract WHERE {' AND '.join(conditions)})")
+    return ',\n'.join(ctes)
+
+
+def _rule_joins(rules):
+    joins = []
+    for name, _, keys in rules:
+        on = ' AND '.join(f"s.{k} = {name}.{k}" for k in keys)
+        joins.append(f"        ANY LEFT JOIN {name} ON {on}")
+    return '\n'.join(joins)
+
+
+def _coalesce(col, rules):
+    # 越具体的规则优先, 与 ContractRuleMatcher 的覆盖顺序一致
+    return f"COALESCE({', '.join(f'{name}.{col}' for name, _, _ in reversed(rules))})"
+
+
+def _dict_coalesce(col, rules, dictionaries, key_types):
+    # 字典键不能为 Nullable: 查询值转换成键的类型, 任一键为空时不匹配(与 join 一致)
+    lookups = []
+    for name, _, keys in reversed(rules):
+        key = ', '.join(f"CAST(assumeNotNull(s.{k}) AS {key_types.get(k, 'String')})" for k in keys)
+        missing = ' OR '.join(f"s.{k} IS NULL" for k in keys)
+        lookups.append(f"if({missing}, NULL, dictGetOrNull('{dictionaries[name]}', '{col}', tuple({key})))")
+    return f"COALESCE({', '.join(lookups)})"
+
+
+def get_calculation_sql(target_table='dwm_standard_daily_billing_calculated', account_filter=False, overrides=None,
+                        dictionaries=None, account_bucket=False, settings=None, dictionary_key_types=None):
+    """
+    INSERT ... SELECT that runs the whole calculation inside ClickHouse for
+    one invoice month and usage day range, writing into billing.<target_table>.
+
+    Parameters (%(name)s, substituted by the client):
+    invoice_month, dim_month, usage_day_start, usage_day_end (exclusive) and,
+    with account_filter, billing_account_ids (a tuple).
+
+    Rows are grouped like get_standard_daily_billing_iterator and priced like
+    CalculateService.calculate_with_credits: rules resolved column by column
+    from the most specific match, extra discount on internal_cost from the
+    pricing overrides, mode 4 credits divided by price field by field. The
+    descriptive columns the Python engines do not read (sku_description,
+    project_name, usage_pricing_unit, currency, currency_conversion_rate)
+    get the same ''/0 defaults they insert, and an external_consumption left
+    NaN by a null rule discount or price is written as 0, as they write it.
+    overrides: compiled PricingOverrides, defaults to pricing_overrides.yaml.
+    dictionaries: rule name -> ClickHouse dictionary (RuleDictionaries.ensure);
+    rules are then resolved with dictGetOrNull lookups in precedence order
+    instead of the eight dim_contract CTEs and joins.
+    dictionary_key_types: key column -> dictionary key type
+    (rule_dictionaries.key_types), String when not given.
+    account_bucket: only calculate the accounts of one hash bucket, with the
+    extra parameters buckets and bucket (see slice_condition).
+    settings: query settings appended to the statement.
+    """
+    if overrides is None:
+        overrides = default_overrides()
+    settings = dict(settings or {})
+    if dictionaries is not None:
+        rule_ctes = ""
+        rule_values = [_dict_coalesce(col, RULES, dictionaries, dictionary_key_types or {}) for col in RULE_COLUMNS]
+        rule_joins = ""
+    else:
+        rule_ctes = f"""
+    -- 2. dim_contract 按规则拆分(project_id / service_description / sku_id 是否为空)
+{_rule_ctes(RULES, account_filter)},
+"""
+        rule_values = [_coalesce(col, RULES) for col in RULE_COLUMNS]
+        rule_joins = "\n" + _rule_joins(RULES)
+        settings['join_use_nulls'] = 1
+    account_condition = "\n          AND billing_account_id IN %(billing_account_ids)s" if account_filter else ""
+    if account_bucket:
+        account_condition += f"\n          AND {ACCOUNT_BUCKET_CONDITION}"
+    credit_value = "multiIf(" + ', '.join(f"f = '{c}', {c}" for c in CREDIT_COLUMNS) + ", 0)"
     return f"""
-INSERT INTO billing.dwm_standard_daily_billing_calculated
-WITH 
-    -- 1. Source Data Aggregation (matches get_standard_daily_billing logic)
+INSERT INTO billing.{target_table} ({', '.join(CALCULATED_COLUMNS)})
+WITH
+    -- 1. 源数据按天汇总(与 get_standard_daily_billing_iterator 的分组一致)
     source AS (
         SELECT
-            usage_day,
-            invoice_month,
-            billing_account_id,
-            service_id,
-            service_description,
-            sku_id,
-            sku_description,
-            project_id,
-            project_name,
-            usage_pricing_unit,
-            sum(usage_amount_in_pricing_units) as usage_amount_in_pricing_units,
-            currency,
-            currency_conversion_rate,
-            cost_type,
-            sum(cost) as cost,
-            sum(cost_at_list) as cost_at_list,
-            sum(c_cud) as c_cud,
-            sum(c_cud_db) as c_cud_db,
-            sum(c_discount) as c_discount,
-            sum(c_free_tier) as c_free_tier,
-            sum(c_promotion) as c_promotion,
-            sum(c_rm) as c_rm,
-            sum(c_sub_benefit) as c_sub_benefit,
-            sum(c_sud) as c_sud,
-            sum(internal_credits_cost) as internal_credits_cost,
-            sum(internal_credits_consumption) as internal_credits_consumption
+            usage_day, invoice_month, billing_account_id, project_id, service_id, service_description, sku_id, cost_type,
+            sum(usage_amount_in_pricing_units) AS usage_amount_in_pricing_units,
+            sum(cost) AS cost,
+            sum(cost_at_list) AS cost_at_list,
+{chr(10).join(f'            sum({c}) AS {c},' for c in CREDIT_COLUMNS)}
+            sum(internal_credits_cost) AS internal_credits_cost,
+            sum(internal_credits_consumption) AS internal_credits_consumption
         FROM billing.ods_standard_daily_billing
-        WHERE invoice_month = '{invoice_month}'
-        and project_id='ai-period-tracker'
-
-        GROUP BY
-            usage_day, invoice_month, billing_account_id, project_id, project_name,
-            service_id, service_description, sku_id, sku_description,
-            usage_pricing_unit, currency, currency_conversion_rate, cost_type
+        WHERE invoice_month = %(invoice_month)s
+          AND usage_day >= %(usage_day_start)s
+          AND usage_day < %(usage_day_end)s{account_condition}
+        GROUP BY usage_day, invoice_month, billing_account_id, project_id, service_id, service_description,
+                 sku_id, cost_type
     ),
-    
-    -- 2. Dimension Rules (Split by NULL conditions as per Python logic)
-    -- Rule 1: All NULL
-    r1 AS (SELECT * FROM billing.dim_contract WHERE month='{dim_month}' AND project_id IS NULL AND service_description IS NULL AND sku_id IS NULL),
-    -- Rule 2: Project NOT NULL
-    r2 AS (SELECT * FROM billing.dim_contract WHERE month='{dim_month}' AND project_id IS NOT NULL AND service_description IS NULL AND sku_id IS NULL),
-    -- Rule 3: Service NOT NULL
-    r3 AS (SELECT * FROM billing.dim_contract WHERE month='{dim_month}' AND project_id IS NULL AND service_description IS NOT NULL AND sku_id IS NULL),
-    -- Rule 4: Project, Service NOT NULL
-    r4 AS (SELECT * FROM billing.dim_contract WHERE month='{dim_month}' AND project_id IS NOT NULL AND service_description IS NOT NULL AND sku_id IS NULL),
-    -- Rule 5: SKU NOT NULL
-    r5 AS (SELECT * FROM billing.dim_contract WHERE month='{dim_month}' AND project_id IS NULL AND service_description IS NULL AND sku_id IS NOT NULL),
-    -- Rule 6: Project, SKU NOT NULL
-    r6 AS (SELECT * FROM billing.dim_contract WHERE month='{dim_month}' AND project_id IS NOT NULL AND service_description IS NULL AND sku_id IS NOT NULL),
-    -- Rule 7: Service, SKU NOT NULL
-    r7 AS (SELECT * FROM billing.dim_contract WHERE month='{dim_month}' AND project_id IS NULL AND service_description IS NOT NULL AND sku_id IS NOT NULL),
-    -- Rule 8: All NOT NULL
-    r8 AS (SELECT * FROM billing.dim_contract WHERE month='{dim_month}' AND project_id IS NOT NULL AND service_description IS NOT NULL AND sku_id IS NOT NULL),
-    
-    -- 3. Join and Match Rules
+{rule_ctes}
+    -- 3. 匹配规则, 每列取最具体规则的非空值
     matched AS (
         SELECT
-            s.usage_day,
-            s.invoice_month,
-            s.billing_account_id,
-            s.service_id,
-            s.service_description,
-            s.sku_id,
-            s.sku_description,
-            s.project_id,
-            s.project_name,
-            s.usage_pricing_unit,
-            s.usage_amount_in_pricing_units,
-            s.currency,
-            s.currency_conversion_rate,
-            s.cost_type,
-            s.cost,
-            s.cost_at_list,
-            s.c_cud,
-            s.c_cud_db,
-            s.c_discount,
-            s.c_free_tier,
-            s.c_promotion,
-            s.c_rm,
-            s.c_sub_benefit,
-            s.c_sud,
-            s.internal_credits_cost,
-            s.internal_credits_consumption,
-            -- Coalesce based on priority: 8 > 4 > 6 > 2 > 7 > 3 > 5 > 1
-            COALESCE(d8.mode, d4.mode, d6.mode, d2.mode, d7.mode, d3.mode, d5.mode, d1.mode) as mode,
-            COALESCE(d8.discount, d4.discount, d6.discount, d2.discount, d7.discount, d3.discount, d5.discount, d1.discount) as rule_discount,
-            COALESCE(d8.price, d4.price, d6.price, d2.price, d7.price, d3.price, d5.price, d1.price) as rule_price,
-            COALESCE(d8.credit_fields, d4.credit_fields, d6.credit_fields, d2.credit_fields, d7.credit_fields, d3.credit_fields, d5.credit_fields, d1.credit_fields) as credit_fields,
-            COALESCE(d8.customer_id, d4.customer_id, d6.customer_id, d2.customer_id, d7.customer_id, d3.customer_id, d5.customer_id, d1.customer_id) as customer_id,
-            COALESCE(d8.contract_id, d4.contract_id, d6.contract_id, d2.contract_id, d7.contract_id, d3.contract_id, d5.contract_id, d1.contract_id) as contract_id,
-            
-            -- Internal Cost Calculation
-            (s.cost + s.internal_credits_cost) as internal_cost,
-            (s.cost + s.internal_credits_consumption) as internal_consumption_base,
-            
-            -- Extra Discount (Hardcoded in Python, moved here)
-            CASE 
-                WHEN s.billing_account_id IN ('01F0DC-F91DC5-0F0CAB', '0143DC-442DB6-FDE892', '01FEE2-46994F-B32CB9', '01D111-877AA6-FC9006', '01368B-077E67-C11E2D', '01EB13-0127DF-324A48', '013EEC-7ED413-0F0733', '018D1D-AEDA58-9E382C') THEN 0.975
-                WHEN s.billing_account_id IN ('01ACBD-4B4CE4-2D688D') THEN 0.965
-                WHEN s.billing_account_id IN ('01281B-3D24E6-B4D363', '01587C-263C61-84FBDB', '015C37-EF4FBF-AE3E2C', '015336-4C0FAA-732523') THEN 0.95
-                WHEN s.billing_account_id IN ('01BE65-4D6A90-81C9C9', '01AEFA-0E57C7-5D22AF', '012980-39DCA3-6B08CF', '01D80B-3126BB-D0C7C1', '01D977-BDDE3C-14BE03', '01EFBF-FE25D9-1F8A1C', '01B528-640F36-FF1F84', '013A21-83F145-1DE13D', '0134F7-148D6A-A3E367', '016577-4C47C6-43BEE5') THEN 0.88
-                WHEN s.billing_account_id IN ('010EDC-72FE2A-79D4CC') THEN (28.5/27.2)
-                ELSE 1.0
-            END as extra_discount_factor
-            
-        FROM source s
-        LEFT JOIN r1 d1 ON s.billing_account_id = d1.billing_account_id
-        LEFT JOIN r2 d2 ON s.billing_account_id = d2.billing_account_id AND s.project_id = d2.project_id
-        LEFT JOIN r3 d3 ON s.billing_account_id = d3.billing_account_id AND s.service_description = d3.service_description
-        LEFT JOIN r4 d4 ON s.billing_account_id = d4.billing_account_id AND s.project_id = d4.project_id AND s.service_description = d4.service_description
-        LEFT JOIN r5 d5 ON s.billing_account_id = d5.billing_account_id AND s.sku_id = d5.sku_id
-        LEFT JOIN r6 d6 ON s.billing_account_id = d6.billing_account_id AND s.project_id = d6.project_id AND s.sku_id = d6.sku_id
-        LEFT JOIN r7 d7 ON s.billing_account_id = d7.billing_account_id AND s.service_description = d7.service_description AND s.sku_id = d7.sku_id
-        LEFT JOIN r8 d8 ON s.billing_account_id = d8.billing_account_id AND s.project_id = d8.project_id AND s.service_description = d8.service_description AND s.sku_id = d8.sku_id
+            s.*,
+{chr(10).join(f'            {value} AS rule_{col},' for col, value in zip(RULE_COLUMNS, rule_values))}
+            s.cost + s.internal_credits_cost AS internal_cost_base,
+            s.cost + s.internal_credits_consumption AS internal_consumption
+        FROM source s{rule_joins}
     ),
-    
-    -- 4. Apply Calculations
+
+    -- 4. 计算
     calculated AS (
         SELECT
             *,
-            -- Apply extra discount to internal_consumption
-            (internal_consumption_base * extra_discount_factor) as internal_consumption_final,
-            
-            -- Helper for Mode 4 Credit Sum
-            (
-                if(has(splitByChar('/', coalesce(credit_fields, '')), 'c_cud'), c_cud, 0) +
-                if(has(splitByChar('/', coalesce(credit_fields, '')), 'c_cud_db'), c_cud_db, 0) +
-                if(has(splitByChar('/', coalesce(credit_fields, '')), 'c_discount'), c_discount, 0) +
-                if(has(splitByChar('/', coalesce(credit_fields, '')), 'c_free_tier'), c_free_tier, 0) +
-                if(has(splitByChar('/', coalesce(credit_fields, '')), 'c_promotion'), c_promotion, 0) +
-                if(has(splitByChar('/', coalesce(credit_fields, '')), 'c_rm'), c_rm, 0) +
-                if(has(splitByChar('/', coalesce(credit_fields, '')), 'c_sub_benefit'), c_sub_benefit, 0) +
-                if(has(splitByChar('/', coalesce(credit_fields, '')), 'c_sud'), c_sud, 0)
-            ) as mode4_credit_part
-            
+            ifNull(toFloat64(rule_discount), nan) AS discount_f,
+            ifNull(toFloat64(rule_price), nan) AS price_f,
+            -- 额外折扣(pricing_overrides.yaml, 与 Python 引擎共用)
+            internal_cost_base * {overrides.sql_rate('billing_account_id')} AS internal_cost,
+            -- 模式4: 选中的 credits 逐个除以单价后累加, 单价为 0 时跳过
+            if(coalesce(rule_credit_fields, '') = '' OR price_f = 0, 0.,
+               arraySum(f -> toFloat64({credit_value}) / price_f,
+                        splitByChar('/', coalesce(rule_credit_fields, '')))) AS mode4_credit_part
         FROM matched
     )
 
@@ -148,62 +179,43 @@ SELECT
     usage_day,
     invoice_month,
     billing_account_id,
-    cast(customer_id as Nullable(String)),
-    cast(contract_id as Nullable(String)),
+    CAST(rule_customer_id AS Nullable(String)) AS customer_id,
+    CAST(rule_contract_id AS Nullable(String)) AS contract_id,
     service_id,
     service_description,
     sku_id,
-    sku_description,
+    {_DESCRIPTIVE_DEFAULTS['sku_description']} AS sku_description,
     project_id,
-    project_name,
-    usage_pricing_unit,
+    {_DESCRIPTIVE_DEFAULTS['project_name']} AS project_name,
+    {_DESCRIPTIVE_DEFAULTS['usage_pricing_unit']} AS usage_pricing_unit,
     usage_amount_in_pricing_units,
-    currency,
-    currency_conversion_rate,
+    {_DESCRIPTIVE_DEFAULTS['currency']} AS currency,
+    {_DESCRIPTIVE_DEFAULTS['currency_conversion_rate']} AS currency_conversion_rate,
     cost_type,
     cost,
     cost_at_list,
-    c_cud, c_cud_db, c_discount, c_free_tier, c_promotion, c_rm, c_sub_benefit, c_sud,
+    {', '.join(CREDIT_COLUMNS)},
     internal_credits_cost,
     internal_credits_consumption,
     internal_cost,
-    internal_consumption_base as internal_consumption, -- Original internal consumption
-    
-    -- external_consumption Calculation
-    CASE
-        -- Mode 1: ([cost] + [credits(exclude c_rm)]) * discount
-        WHEN mode = 1 THEN internal_consumption_final * toFloat64(rule_discount)
-        
-        -- Mode 2: [usage.amount] * price
-        WHEN mode = 2 THEN usage_amount_in_pricing_units * toFloat64(rule_price)
-        
-        -- Mode 3: [usage.amount] * price * discount
-        WHEN mode = 3 THEN usage_amount_in_pricing_units * toFloat64(rule_price) * toFloat64(rule_discount)
-        
-        -- Mode 4: ([cost_at_list] + (selected_credits / price)) * discount
-        WHEN mode = 4 THEN 
-            (
-                toFloat64(cost_at_list) * toFloat64(rule_discount) + 
-                (
-                    if(toFloat64(rule_price) != 0, mode4_credit_part / toFloat64(rule_price), 0)
-                ) * toFloat64(rule_discount)
-            )
-            
-        ELSE 0.0
-    END as external_consumption,
-    
-    -- discount_amount Calculation
-    CASE
-        WHEN mode = 1 THEN internal_credits_consumption
-        WHEN mode = 4 THEN if(toFloat64(rule_price) != 0, mode4_credit_part / toFloat64(rule_price), 0)
-        ELSE 0.0
-    END as discount_amount,
-    
-    coalesce(mode, 0) as mode,
-    coalesce(rule_price, 0.0) as price,
-    coalesce(rule_discount, 0.0) as discount,
-    coalesce(credit_fields, '') as credit_fields,
-    now() as etl_time
-
-FROM calculated
+    internal_consumption,
+    -- 规则的折扣/单价为空时结果为 nan, 与 Python 引擎写入时一样按 0 写入
+    ifNotFinite(multiIf(
+        -- 模式1: （[cost]+[credits(exclude c_rm)]）* 客户折扣
+        rule_mode = 1, internal_consumption * discount_f,
+        -- 模式2: [usage.amount] * 单价
+        rule_mode = 2, usage_amount_in_pricing_units * price_f,
+        -- 模式3: [usage.amount] * 单价 * 折扣
+        rule_mode = 3, usage_amount_in_pricing_units * price_f * discount_f,
+        -- 模式4:（[cost_at_list]+(被选择的[credits]/原厂折扣)）* 客户折扣
+        rule_mode = 4, cost_at_list * discount_f + mode4_credit_part * discount_f,
+        0.
+    ), 0.) AS external_consumption,
+    if(rule_mode = 1, internal_credits_consumption, 0.) AS discount_amount,
+    coalesce(rule_mode, 0) AS mode,
+    coalesce(toFloat64(rule_price), 0.) AS price,
+    coalesce(toFloat64(rule_discount), 0.) AS discount,
+    coalesce(rule_credit_fields, '') AS credit_fields,
+    now() AS etl_time
+FROM calculated{_settings_clause(settings)}
 """
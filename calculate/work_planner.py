@@ -0,0 +1,64 @@
+from datetime import timedelta
+from typing import NamedTuple, Tuple
+
+import pandas as pd
+
+from utils.enum import BILLING_ACCOUNT_ID
+
+
+class WorkUnit(NamedTuple):
+    """Accounts and usage day range [usage_day_start, usage_day_end) processed by one query."""
+    billing_account_ids: Tuple[str, ...]
+    usage_day_start: object
+    usage_day_end: object
+    rows: int
+
+    @property
+    def label(self):
+        first = self.billing_account_ids[0]
+        if len(self.billing_account_ids) > 1:
+            first += f"+{len(self.billing_account_ids) - 1}"
+        return f"{first} {self.usage_day_start}..{self.usage_day_end}"
+
+
+def plan_work_units(counts: pd.DataFrame, usage_day_start, usage_day_end, row_budget):
+    """
+    Pack (account, usage day range) work units of about row_budget rows each.
+
+    counts: billing_account_id, usage_day, row_count (one row per account
+    and day with data). usage_day_start / usage_day_end: inclusive range of
+    the run. An account whose month fits the budget is combined with other
+    such accounts over the whole range; a larger account is split into
+    consecutive day ranges. A single day above the budget is still one unit.
+    Units are returned largest first, so the longest ones start first.
+    """
+    range_end = usage_day_end + timedelta(days=1)
+    totals = counts.groupby(BILLING_ACCOUNT_ID, sort=True)['row_count'].sum()
+
+    units = []
+    # 小账户: 整个区间一个查询, 多个账户合并到行数预算内(先大后小, 依次装入)
+    small = totals[totals <= row_budget].sort_values(ascending=False, kind='stable')
+    bins = []
+    for account, rows in small.items():
+        for b in bins:
+            if b[1] + rows <= row_budget:
+                b[0].append(account)
+                b[1] += rows
+                break
+        else:
+            bins.append([[account], rows])
+    units += [WorkUnit(tuple(accounts), usage_day_start, range_end, int(rows)) for accounts, rows in bins]
+
+    # 大账户: 按天累加到预算, 切成连续的天区间
+    heavy = counts[counts[BILLING_ACCOUNT_ID].isin(totals.index[totals > row_budget])]
+    for account, days in heavy.sort_values([BILLING_ACCOUNT_ID, 'usage_day']).groupby(BILLING_ACCOUNT_ID, sort=False):
+        start, rows = usage_day_start, 0
+        for day, day_rows in zip(days['usage_day'], days['row_count']):
+            if rows and rows + day_rows > row_budget:
+                units.append(WorkUnit((account,), start, day, int(rows)))
+                start, rows = day, 0
+            rows += day_rows
+        units.append(WorkUnit((account,), start, range_end, int(rows)))
+
+    units.sort(key=lambda u: u.rows, reverse=True)
+    return units
@@ -1,10 +1,69 @@
-from clickhouse_driver import Client
+from contextlib import contextmanager
+import socket
+import ssl
+import threading
+import time
+
+from clickhouse_driver import Client, errors
+from clickhouse_driver.connection import Connection
 import pandas as pd
 
+from client.query_stats import QueryTracker
+
+# 可重试的服务端错误码: TIMEOUT_EXCEEDED, TOO_MANY_SIMULTANEOUS_QUERIES, SOCKET_TIMEOUT,
+# NETWORK_ERROR, TOO_MANY_PARTS, UNKNOWN_STATUS_OF_INSERT, KEEPER_EXCEPTION
+RETRYABLE_SERVER_CODES = {159, 202, 209, 210, 252, 319, 999}
+
+
+class BufferedConnection(Connection):
+    """
+    clickhouse-driver Connection that sets SO_RCVBUF / SO_SNDBUF on its
+    socket before connect(), so the TCP window scale negotiated in the
+    handshake can use them (set afterwards they barely change the window).
+    Otherwise the same as Connection._create_socket, TLS included.
+    """
+    socket_rcvbuf = None
+    socket_sndbuf = None
+
+    def _create_socket(self, host, port):
+        ssl_options = {}
+        if self.secure_socket:
+            ssl_options = self.ssl_options.copy()
+            ssl_options['cert_reqs'] = ssl.CERT_REQUIRED if self.verify_cert else ssl.CERT_NONE
+
+        err = None
+        for af, socktype, proto, _, sa in socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM):
+            sock = None
+            try:
+                sock = socket.socket(af, socktype, proto)
+                sock.settimeout(self.connect_timeout)
+                if self.socket_rcvbuf:
+                    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.socket_rcvbuf)
+                if self.socket_sndbuf:
+                    sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, self.socket_sndbuf)
+
+                if self.secure_socket:
+                    ssl_context = self._create_ssl_context(ssl_options)
+                    sock = ssl_context.wrap_socket(sock, server_hostname=self.server_hostname or host)
+
+                sock.connect(sa)
+                return sock
+            except socket.error as e:
+                err = e
+                if sock is not None:
+                    sock.close()
+
+        if err is not None:
+            raise err
+        raise socket.error("getaddrinfo returns an empty list")
+
+
 class ClickhouseClient:
 
-    def __init__(self, client: Client = None, **kwargs):
+    def __init__(self, client: Client = None, stats=None, **kwargs):
         self._db_client = client if client is not None else self.__create_db_client(**kwargs)
+        # QueryStatsRecorder, 记录每条查询的 query_id / 读写行数字节 / 服务端和客户端耗时
+        self.stats = stats
 
     @staticmethod
     def __create_db_client(**kwargs):
@@ -15,9 +74,20 @@ class ClickhouseClient:
         database = kwargs.get('database', 'default')
         secure = kwargs.get('secure', False)
         verify = kwargs.get('verify', False)
+
+        # 传输调优: native 协议压缩(lz4/lz4hc/zstd 需要安装 clickhouse-driver 对应 extras)、block 大小、socket 缓冲区
+        compression = kwargs.get('compression', False)
+        compress_block_size = kwargs.get('compress_block_size', 1048576)
+        max_block_size = kwargs.get('max_block_size', 100000)
+        insert_block_size = kwargs.get('insert_block_size', 1048576)
+
+        tls_options = {}
+        for key in ('ciphers', 'ca_certs', 'server_hostname'):
+            if kwargs.get(key):
+                tls_options[key] = kwargs[key]
         
         # print(f"ClickHouse host: {host}, port: {port}")
-        return Client(
+        client = Client(
             host=host,
             port=port,
             user=user,
@@ -25,6 +95,10 @@ class ClickhouseClient:
             database=database,
             secure=secure,
             verify=verify,
+            compression=compression,
+            compress_block_size=compress_block_size,
+            tcp_keepalive=kwargs.get('tcp_keepalive', False),
+            **tls_options,
 
             connect_timeout=60,
             send_receive_timeout=300,   
@@ -32,104 +106,333 @@ class ClickhouseClient:
 
             settings={
                 "use_numpy": False,
-                "max_block_size": 100000,
+                "max_block_size": max_block_size,
+                "insert_block_size": insert_block_size,
                 "max_execution_time": 7200
             }
         )
+        ClickhouseClient._set_socket_buffers(client, kwargs.get('socket_rcvbuf'), kwargs.get('socket_sndbuf'))
+        return client
+
+    @staticmethod
+    def _set_socket_buffers(client, rcvbuf=None, sndbuf=None):
+        """
+        Apply SO_RCVBUF / SO_SNDBUF to every socket the driver opens.
+        The driver has no option for it, so its connections are switched to
+        BufferedConnection, which sets them before connect().
+        """
+        if not rcvbuf and not sndbuf:
+            return
+
+        for connection in [client.connection, *client.connections]:
+            connection.__class__ = BufferedConnection
+            connection.socket_rcvbuf = int(rcvbuf) if rcvbuf else None
+            connection.socket_sndbuf = int(sndbuf) if sndbuf else None
 
     def get_client(self):
         return self._db_client
     
-    def execute(self, query, params=None):
+    def _track(self, tag, query):
+        return QueryTracker(self.stats, tag, query, db_client=self._db_client)
+
+    def execute(self, query, params=None, tag='execute'):
         """Execute a query and return the result."""
-        return self._db_client.execute(query, params=params)
+        with self._track(tag, query) as tracker:
+            result = self._db_client.execute(query, params=params, query_id=tracker.query_id)
+            if isinstance(result, list):
+                tracker.add_rows(len(result))
+            return result
 
-    def query_dataframe(self, query, params=None):
+    def query_dataframe(self, query, params=None, tag='query_dataframe'):
         """Execute a query and return the result as a DataFrame."""
         try:
-            return self._db_client.query_dataframe(query, params=params)
+            with self._track(tag, query) as tracker:
+                df = self._db_client.query_dataframe(query, params=params, query_id=tracker.query_id)
+                tracker.add_rows(len(df))
+                return df
         except Exception as e:
             print(f"Error executing query: {e}")
             raise
 
-    def iterate(self, query, params=None, batch_size=10000):
+    def iterate(self, query, params=None, batch_size=10000, tag='iterate'):
         """Execute a query and yield batches of results as DataFrames."""
         try:
-            # Execute with column types to get metadata
-            # execute_iter yields rows. If with_column_types=True, the first item is column metadata.
-            iter_res = self._db_client.execute_iter(query, params=params, with_column_types=True)
-            
-            try:
-                # First item is column metadata
-                columns_info = next(iter_res)
-                columns = [c[0] for c in columns_info]
-            except StopIteration:
-                # Empty result
-                return
+            with self._track(tag, query) as tracker:
+                # Execute with column types to get metadata
+                # execute_iter yields rows. If with_column_types=True, the first item is column metadata.
+                iter_res = self._db_client.execute_iter(query, params=params, with_column_types=True,
+                                                        query_id=tracker.query_id)
+
+                try:
+                    # First item is column metadata
+                    columns_info = next(iter_res)
+                    columns = [c[0] for c in columns_info]
+                except StopIteration:
+                    # Empty result
+                    return
+
+                batch = []
+                for row in iter_res:
+                    batch.append(row)
+                    if len(batch) >= batch_size:
+                        tracker.add_rows(len(batch))
+                        with tracker.paused():
+                            yield pd.DataFrame(batch, columns=columns)
+                        batch = []
 
-            batch = []
-            for row in iter_res:
-                batch.append(row)
-                if len(batch) >= batch_size:
-                    yield pd.DataFrame(batch, columns=columns)
-                    batch = []
-            
-            if batch:
-                yield pd.DataFrame(batch, columns=columns)
+                if batch:
+                    tracker.add_rows(len(batch))
+                    with tracker.paused():
+                        yield pd.DataFrame(batch, columns=columns)
                 
         except Exception as e:
             print(f"Error executing query iterator: {e}")
             raise
 
-    def insert_dataframe(self, query, df, settings=None):
-        """Insert a DataFrame into the database."""
+    def iterate_blocks(self, query, params=None, batch_size=10000, settings=None, tag='iterate_blocks'):
+        """
+        Execute a query and yield batches of results as DataFrames built
+        straight from the server's native blocks.
+
+        Blocks are read with use_numpy, so every column arrives as a typed
+        array (numeric columns as numpy dtypes, strings as object arrays)
+        and no per-row tuples are created. Blocks are re-cut into batches of
+        batch_size rows; batch_size=None yields one DataFrame per block.
+        """
+        pending = []
+        pending_rows = 0
         try:
-            # clickhouse-driver insert_dataframe does not support numpy arrays directly in recent versions
-            # or if the data structure is complex. We can convert to list of dicts or values.
-            # However, insert_dataframe is optimized for pandas.
-            # The error 'Unsupported column type: <class 'numpy.ndarray'>' suggests that
-            # the underlying driver expects list/tuple for columns but got numpy array (which pandas uses).
-            
-            # A common workaround is to use client.execute with a generator or list of tuples
-            # OR ensure that we are using the driver correctly.
-            # The 'clickhouse-driver' library's 'insert_dataframe' method SHOULD handle this.
-            # If it fails, it might be due to a version mismatch or specific data types.
-            
-            # Let's try to pass settings={'use_numpy': True} if not already set,
-            # BUT the error says "list or tuple is expected", which implies it fails to iterate over columns properly
-            # or it's treating the whole dataframe as a numpy array?
-            
-            # Actually, the traceback shows:
-            # File ".../clickhouse_driver/util/helpers.py", line 33, in column_chunks
-            # raise TypeError("Unsupported column type: ...")
-            
-            # This happens when the driver iterates over columns and finds a numpy array instead of a list/tuple.
-            # We can convert the dataframe to a list of dicts (records) and use execute, 
-            # OR we can try to convert columns to lists.
-            
-            # Let's try converting the dataframe to a list of dicts and use execute, 
-            # which is safer but might be slower. However, given the error, insert_dataframe is failing.
-            
-            # Alternatively, we can convert the dataframe columns to lists before passing to insert_dataframe?
-            # No, insert_dataframe expects a DataFrame.
-            
-            # Let's switch to using execute with 'records' (list of dicts) 
-            # because we don't know the exact column order vs schema without querying it,
-            # but we constructed the dataframe to match the target table columns in the service.
-            
-            # Wait, if we use 'VALUES', we need to match the order.
-            # The service layer already ordered the columns.
-            
-            # Convert to list of tuples for insertion
-            data = df.to_dict('split')['data']
-            return self._db_client.execute(query, data)
-            
+            with self._track(tag, query) as tracker:
+                for block_df in self._iter_block_frames(query, params=params, settings=settings,
+                                                        query_id=tracker.query_id):
+                    tracker.add_rows(len(block_df))
+                    if batch_size is None:
+                        with tracker.paused():
+                            yield block_df
+                        continue
+
+                    pending.append(block_df)
+                    pending_rows += len(block_df)
+                    if pending_rows < batch_size:
+                        continue
+
+                    merged = pending[0] if len(pending) == 1 else pd.concat(pending, ignore_index=True)
+                    offset = 0
+                    while pending_rows - offset >= batch_size:
+                        with tracker.paused():
+                            yield merged.iloc[offset:offset + batch_size].reset_index(drop=True)
+                        offset += batch_size
+                    rest = merged.iloc[offset:]
+                    pending = [rest] if len(rest) else []
+                    pending_rows = len(rest)
+
+                if pending_rows:
+                    merged = pending[0] if len(pending) == 1 else pd.concat(pending, ignore_index=True)
+                    with tracker.paused():
+                        yield merged.reset_index(drop=True)
+
         except Exception as e:
-            print(f"Error inserting dataframe: {e}")
+            print(f"Error executing query block iterator: {e}")
             raise
 
+    def _iter_block_frames(self, query, params=None, settings=None, query_id=None):
+        """Yield one DataFrame per non-empty data block of a SELECT query."""
+        client = self._db_client
+        settings = dict(settings or {})
+        settings.setdefault('use_numpy', True)
+
+        with client.disconnect_on_error(query, settings):
+            if params is not None:
+                query = client.substitute_params(query, params, client.connection.context)
+            client.connection.send_query(query, query_id=query_id)
+            client.connection.send_external_tables(None)
+
+        columns = None
+        for packet in client.packet_generator():
+            block = getattr(packet, 'block', None)
+            if block is None:
+                continue
+            if columns is None:
+                columns = [c[0] for c in block.columns_with_types]
+            if not block.num_rows:
+                continue
+            # 直接引用驱动解出的列数组, 不做合并复制; 批次在切分时才分配一次
+            yield pd.DataFrame(dict(zip(columns, block.get_columns())), columns=columns, copy=False)
+
+    def insert_dataframe(self, query, df, settings=None, columnar=True, dedup_token=None, retries=0, backoff=1.0,
+                         tag='insert'):
+        """
+        Insert a DataFrame into the database.
+
+        columnar=True sends every column to the driver as a NumPy array
+        (use_numpy columnar insert), so no per-row Python tuples are built.
+        columnar=False keeps the old list-of-tuples path.
+        The DataFrame columns must already be in target table order.
+
+        dedup_token is sent as insert_deduplication_token, so a batch that is
+        retried after it already reached the server is dropped by ClickHouse
+        instead of being inserted twice (Replicated*MergeTree, or MergeTree
+        with non_replicated_deduplication_window). Network errors and the
+        transient server errors in RETRYABLE_SERVER_CODES are retried up to
+        `retries` times, waiting backoff * 2**attempt seconds.
+        """
+        settings = dict(settings or {})
+        if dedup_token is not None:
+            settings['insert_deduplicate'] = 1
+            settings['insert_deduplication_token'] = dedup_token
+
+        attempt = 0
+        while True:
+            try:
+                with self._track(tag, query) as tracker:
+                    tracker.add_rows(len(df))
+                    if columnar:
+                        settings.setdefault('use_numpy', True)
+                        data = self._to_columns(df)
+                        return self._db_client.execute(query, data, columnar=True, settings=settings,
+                                                       query_id=tracker.query_id)
+
+                    # Convert to list of tuples for insertion
+                    data = df.to_dict('split')['data']
+                    return self._db_client.execute(query, data, settings=settings, query_id=tracker.query_id)
+
+            except Exception as e:
+                if attempt >= retries or not self.is_retryable(e):
+                    print(f"Error inserting dataframe: {e}")
+                    raise
+                delay = backoff * 2 ** attempt
+                attempt += 1
+                print(f"Insert failed ({e}), retry {attempt}/{retries} in {delay:.1f}s")
+                time.sleep(delay)
+
+    @staticmethod
+    def is_retryable(e):
+        """Whether an error is transient (network or retryable server code)."""
+        if isinstance(e, (errors.NetworkError, errors.SocketTimeoutError, EOFError, ConnectionError, TimeoutError)):
+            return True
+        if isinstance(e, errors.ServerException):
+            return e.code in RETRYABLE_SERVER_CODES
+        return False
+
+    @staticmethod
+    def _to_columns(df):
+        """
+        Column arrays for a columnar insert.
+        Date/DateTime/Float64/Int8 columns go as their numpy arrays and
+        String/Nullable(String) as object arrays (Categorical columns are
+        expanded to object arrays of their shared category strings); the
+        driver builds the nulls map for Nullable columns from None/NaN.
+        """
+        return [df[col].to_numpy() for col in df.columns]
+
+    def ping(self):
+        """
+        Health check. A client that is not connected yet counts as healthy,
+        the driver connects on the next query.
+        """
+        connection = self._db_client.connection
+        if not connection.connected:
+            return True
+        try:
+            return bool(connection.ping())
+        except Exception:
+            return False
+
     def disconnect(self):
         self._db_client.disconnect()
         
     def close(self):
         self._db_client.disconnect()
+
+
+class ClickhousePool:
+    """
+    Bounded pool of ClickhouseClient connections.
+
+    Each lease gets a client that no other task is using, so a streaming
+    read and the inserts running alongside it never share a connection
+    ("Simultaneous queries" error). Idle clients are health-checked before
+    they are handed out again and closed with the pool.
+    factory builds a new client from the pool kwargs (ClickhouseClient by
+    default; any object with the ClickhouseClient interface works).
+    """
+
+    def __init__(self, max_size=4, acquire_timeout=600, factory=None, **kwargs):
+        self._kwargs = kwargs
+        self._factory = factory or ClickhouseClient
+        self._max_size = max_size
+        self._acquire_timeout = acquire_timeout
+        self._idle = []
+        self._created = 0
+        self._closed = False
+        self._cond = threading.Condition()
+
+    def acquire(self, timeout=None):
+        timeout = self._acquire_timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise RuntimeError("ClickhousePool is closed")
+                if self._idle:
+                    client = self._idle.pop()
+                    break
+                if self._created < self._max_size:
+                    self._created += 1
+                    client = None
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError(f"No ClickHouse connection available after {timeout}s (pool size {self._max_size})")
+                self._cond.wait(remaining)
+
+        if client is None:
+            try:
+                return self._factory(**self._kwargs)
+            except Exception:
+                with self._cond:
+                    self._created -= 1
+                    self._cond.notify()
+                raise
+
+        if not client.ping():
+            # 断开后由 driver 在下一次查询时重连
+            client.disconnect()
+        return client
+
+    def release(self, client, broken=False):
+        """
+        Return a client to the pool. broken=True drops its socket first,
+        e.g. when a streaming read was not consumed to the end.
+        """
+        if broken:
+            client.disconnect()
+        with self._cond:
+            if self._closed:
+                client.close()
+                self._created -= 1
+                return
+            self._idle.append(client)
+            self._cond.notify()
+
+    @contextmanager
+    def lease(self, timeout=None):
+        client = self.acquire(timeout=timeout)
+        broken = False
+        try:
+            yield client
+        except BaseException:
+            broken = True
+            raise
+        finally:
+            self.release(client, broken=broken)
+
+    def close(self):
+        """Close idle connections; leased ones are closed when released."""
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._created -= len(idle)
+            self._cond.notify_all()
+        for client in idle:
+            client.close()
@@ -0,0 +1,342 @@
+from datetime import date, datetime
+import gzip
+import json
+import re
+import time
+from types import SimpleNamespace
+
+from clickhouse_driver import errors
+from clickhouse_driver.util.escape import escape_chars_map
+import pandas as pd
+import requests
+
+from client.clickhouse_client import ClickhouseClient
+from client.query_stats import QueryTracker
+from client.table_schema import _unwrap
+
+_PARAM_RE = re.compile(r'%\((\w+)\)s')
+_ERROR_CODE_RE = re.compile(r'Code:\s*(\d+)')
+_INSERT_RE = re.compile(r'^\s*(INSERT\s+INTO\s+\S+(?:\s*\([^)]*\))?)\s*(?:VALUES)?\s*$', re.IGNORECASE)
+_DATETIME_TZ_RE = re.compile(r"^DateTime\('([^']+)'\)$")
+
+
+def _escape(value):
+    """Literal for %(name)s substitution, same quoting as clickhouse-driver."""
+    if value is None:
+        return 'NULL'
+    if isinstance(value, datetime):
+        return "'%s'" % value.strftime('%Y-%m-%d %H:%M:%S')
+    if isinstance(value, date):
+        return "'%s'" % value.strftime('%Y-%m-%d')
+    if isinstance(value, str):
+        return "'%s'" % ''.join(escape_chars_map.get(c, c) for c in value)
+    if isinstance(value, (list, tuple, set)):
+        brackets = '[%s]' if isinstance(value, list) else '(%s)'
+        return brackets % ', '.join(_escape(v) for v in value)
+    if hasattr(value, 'item'):
+        return _escape(value.item())
+    return str(value)
+
+
+def substitute_params(query, params):
+    if not params:
+        return query
+    return _PARAM_RE.sub(lambda m: _escape(params[m.group(1)]), query)
+
+
+class HttpClickhouseClient:
+    """
+    ClickhouseClient over ClickHouse's HTTP interface with Arrow payloads.
+
+    Results are read as ArrowStream and turned into DataFrames straight from
+    the Arrow record batches; inserts are sent as one ArrowStream body built
+    from the DataFrame columns, so neither direction goes through per-row
+    Python tuples. Needs pyarrow.
+
+    ArrowStream sends Date as UInt16 day numbers and DateTime as UInt32 epoch
+    seconds. When a result has such columns, its ClickHouse types are looked
+    up once per query text (DESCRIBE) and they are cast back to dates and to
+    naive datetimes in the column's (or the server's) time zone, as the
+    native driver returns them.
+
+    Query statistics come from the X-ClickHouse-Summary response header. For
+    streamed reads the header is sent before the result, so its counters are
+    only what the server had done when the first bytes went out.
+    """
+
+    def __init__(self, stats=None, **kwargs):
+        secure = kwargs.get('secure', False)
+        scheme = 'https' if secure else 'http'
+        port = kwargs.get('http_port') or (8443 if secure else 8123)
+        self.url = f"{scheme}://{kwargs.get('host', '127.0.0.1')}:{port}/"
+        self.database = kwargs.get('database', 'default')
+        self.compression = bool(kwargs.get('compression', False))
+        self.settings = {
+            'max_block_size': kwargs.get('max_block_size', 100000),
+            'max_execution_time': 7200,
+            'output_format_arrow_string_as_string': 1,
+            'output_format_arrow_low_cardinality_as_dictionary': 0,
+        }
+        self.timeout = (60, 300)
+        self.stats = stats
+        self.last_query = None
+        self._result_types = {}
+        self._server_timezone = None
+
+        self._session = requests.Session()
+        self._session.auth = (kwargs.get('user', 'default'), kwargs.get('password', ''))
+        self._session.verify = kwargs.get('ca_certs') or kwargs.get('verify', False)
+
+    def get_client(self):
+        return self._session
+
+    def _track(self, tag, query):
+        return QueryTracker(self.stats, tag, query, db_client=self)
+
+    def _post(self, query, params=None, settings=None, data=None, query_id=None, stream=False):
+        url_params = {'database': self.database, 'default_format': 'ArrowStream', **self.settings,
+                      **(settings or {})}
+        if query_id:
+            url_params['query_id'] = query_id
+        headers = {}
+        query = substitute_params(query, params)
+        if data is None:
+            body = query.encode('utf-8')
+        else:
+            # 插入时 SQL 放在 URL 参数里, body 为数据
+            url_params['query'] = query
+            body = data
+            if self.compression:
+                body = gzip.compress(data, compresslevel=1)
+                headers['Content-Encoding'] = 'gzip'
+        if self.compression:
+            url_params['enable_http_compression'] = 1
+            headers['Accept-Encoding'] = 'gzip'
+
+        try:
+            response = self._session.post(self.url, params=url_params, data=body, headers=headers,
+                                          stream=stream, timeout=self.timeout)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            raise errors.NetworkError(str(e)) from e
+
+        self._set_last_query(response)
+        if response.status_code != 200:
+            message = response.text.strip()
+            code = response.headers.get('X-ClickHouse-Exception-Code')
+            if code is None:
+                match = _ERROR_CODE_RE.search(message)
+                code = match.group(1) if match else 0
+            response.close()
+            raise errors.ServerException(message, code=int(code))
+        return response
+
+    def _set_last_query(self, response):
+        try:
+            summary = json.loads(response.headers.get('X-ClickHouse-Summary', '{}'))
+        except ValueError:
+            summary = {}
+        self.last_query = SimpleNamespace(progress=SimpleNamespace(
+            rows=int(summary.get('read_rows', 0)),
+            bytes=int(summary.get('read_bytes', 0)),
+            written_rows=int(summary.get('written_rows', 0)),
+            written_bytes=int(summary.get('written_bytes', 0)),
+            elapsed_ns=int(summary.get('elapsed_ns', 0)),
+        ))
+
+    @staticmethod
+    def _read_table(response):
+        import pyarrow as pa
+
+        content = response.content
+        if not content:
+            return None
+        return pa.ipc.open_stream(content).read_all()
+
+    def _describe_result(self, query, params):
+        """ClickHouse type of every result column of query, cached per query text."""
+        types = self._result_types.get(query)
+        if types is None:
+            statement = f"DESCRIBE TABLE ({query.strip().rstrip(';')})"
+            with self._track('describe_result', statement) as tracker:
+                table = self._read_table(self._post(statement, params=params, query_id=tracker.query_id))
+            types = dict(zip(table.column('name').to_pylist(), table.column('type').to_pylist()))
+            self._result_types[query] = types
+        return types
+
+    def _timezone(self):
+        if self._server_timezone is None:
+            with self._track('timezone', 'SELECT timezone()') as tracker:
+                table = self._read_table(self._post('SELECT timezone()', query_id=tracker.query_id))
+            self._server_timezone = table.column(0)[0].as_py()
+        return self._server_timezone
+
+    def _temporal_casts(self, schema, query, params):
+        """(column index, cast) for the Date / DateTime columns Arrow sent as UInt16 / UInt32."""
+        import pyarrow as pa
+        import pyarrow.compute as pc
+
+        candidates = [i for i, field in enumerate(schema) if field.type in (pa.uint16(), pa.uint32())]
+        if not candidates:
+            return []
+        # 类型查询不能覆盖调用方查询的 last_query(查询统计)
+        last_query = self.last_query
+        try:
+            types = self._describe_result(query, params)
+            casts = []
+            for i in candidates:
+                base, _ = _unwrap(types.get(schema[i].name, ''))
+                if base == 'Date' and schema[i].type == pa.uint16():
+                    casts.append((i, lambda column: column.cast(pa.int32()).cast(pa.date32())))
+                elif (base == 'DateTime' or base.startswith('DateTime(')) and schema[i].type == pa.uint32():
+                    match = _DATETIME_TZ_RE.match(base)
+                    timestamp = pa.timestamp('s', tz=match.group(1) if match else self._timezone())
+                    casts.append((i, lambda column, t=timestamp: pc.local_timestamp(column.cast(pa.int64()).cast(t))))
+            return casts
+        finally:
+            self.last_query = last_query
+
+    @staticmethod
+    def _apply_casts(data, casts):
+        """Table or RecordBatch with the casts applied."""
+        if not casts:
+            return data
+        columns = list(data.columns)
+        for i, cast in casts:
+            columns[i] = cast(columns[i])
+        return type(data).from_arrays(columns, names=data.schema.names)
+
+    def execute(self, query, params=None, tag='execute'):
+        """Execute a query and return the result rows as tuples ([] for statements without a result)."""
+        with self._track(tag, query) as tracker:
+            table = self._read_table(self._post(query, params=params, query_id=tracker.query_id))
+            if table is None:
+                return []
+            with tracker.paused():
+                table = self._apply_casts(table, self._temporal_casts(table.schema, query, params))
+            columns = [column.to_pylist() for column in table.columns]
+            rows = list(zip(*columns))
+            tracker.add_rows(len(rows))
+            return rows
+
+    def query_dataframe(self, query, params=None, tag='query_dataframe'):
+        """Execute a query and return the result as a DataFrame."""
+        with self._track(tag, query) as tracker:
+            table = self._read_table(self._post(query, params=params, query_id=tracker.query_id))
+            if table is None:
+                return pd.DataFrame()
+            with tracker.paused():
+                table = self._apply_casts(table, self._temporal_casts(table.schema, query, params))
+            tracker.add_rows(table.num_rows)
+            return table.to_pandas()
+
+    def iterate(self, query, params=None, batch_size=10000, tag='iterate'):
+        """Execute a query and yield batches of results as DataFrames."""
+        return self.iterate_blocks(query, params=params, batch_size=batch_size, tag=tag)
+
+    def iterate_blocks(self, query, params=None, batch_size=10000, settings=None, tag='iterate_blocks'):
+        """
+        Stream a SELECT as ArrowStream and yield DataFrames of batch_size rows
+        (batch_size=None yields one DataFrame per record batch).
+        """
+        import pyarrow as pa
+
+        with self._track(tag, query) as tracker:
+            response = self._post(query, params=params, settings=settings, query_id=tracker.query_id,
+                                  stream=True)
+            with response:
+                response.raw.decode_content = True
+                try:
+                    reader = pa.ipc.open_stream(response.raw)
+                except pa.ArrowInvalid:
+                    # 空结果没有 body
+                    return
+                with tracker.paused():
+                    casts = self._temporal_casts(reader.schema, query, params)
+
+                pending = []
+                pending_rows = 0
+                for record_batch in reader:
+                    if not record_batch.num_rows:
+                        continue
+                    record_batch = self._apply_casts(record_batch, casts)
+                    tracker.add_rows(record_batch.num_rows)
+                    if batch_size is None:
+                        with tracker.paused():
+                            yield record_batch.to_pandas()
+                        continue
+
+                    pending.append(record_batch)
+                    pending_rows += record_batch.num_rows
+                    if pending_rows < batch_size:
+                        continue
+
+                    table = pa.Table.from_batches(pending)
+                    offset = 0
+                    while pending_rows - offset >= batch_size:
+                        with tracker.paused():
+                            yield table.slice(offset, batch_size).to_pandas()
+                        offset += batch_size
+                    rest = table.slice(offset)
+                    pending = rest.to_batches()
+                    pending_rows = rest.num_rows
+
+                if pending_rows:
+                    with tracker.paused():
+                        yield pa.Table.from_batches(pending).to_pandas()
+
+    def insert_dataframe(self, query, df, settings=None, columnar=True, dedup_token=None, retries=0, backoff=1.0,
+                         tag='insert'):
+        """
+        Insert a DataFrame as one ArrowStream body.
+
+        query is the native-driver form ('INSERT INTO t VALUES'); columns are
+        matched by name, the server casts Arrow types to the column types.
+        columnar is accepted for interface compatibility. dedup_token and
+        retries behave as in ClickhouseClient.insert_dataframe.
+        """
+        import pyarrow as pa
+
+        match = _INSERT_RE.match(query)
+        if not match:
+            raise ValueError(f"Unsupported insert query: {query}")
+        insert_query = f"{match.group(1)} FORMAT ArrowStream"
+
+        settings = dict(settings or {})
+        if dedup_token is not None:
+            settings['insert_deduplicate'] = 1
+            settings['insert_deduplication_token'] = dedup_token
+
+        table = pa.Table.from_pandas(df, preserve_index=False).replace_schema_metadata(None)
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        data = sink.getvalue().to_pybytes()
+
+        attempt = 0
+        while True:
+            try:
+                with self._track(tag, query) as tracker:
+                    tracker.add_rows(len(df))
+                    self._post(insert_query, settings=settings, data=data, query_id=tracker.query_id).close()
+                    return len(df)
+            except Exception as e:
+                if attempt >= retries or not ClickhouseClient.is_retryable(e):
+                    print(f"Error inserting dataframe: {e}")
+                    raise
+                delay = backoff * 2 ** attempt
+                attempt += 1
+                print(f"Insert failed ({e}), retry {attempt}/{retries} in {delay:.1f}s")
+                time.sleep(delay)
+
+    def ping(self):
+        try:
+            response = self._session.get(self.url + 'ping', timeout=10)
+            return response.status_code == 200
+        except requests.RequestException:
+            return False
+
+    def disconnect(self):
+        self._session.close()
+
+    def close(self):
+        self._session.close()
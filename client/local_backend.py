@@ -0,0 +1,381 @@
+from datetime import date, datetime
+import os
+import re
+import sqlite3
+import threading
+
+import pandas as pd
+
+from client.query_stats import QueryTracker
+
+# billing.dwm_standard_daily_billing_calculated(_tmp) 的 ClickHouse 表结构
+CALCULATED_TABLE_SCHEMA = [
+    ('usage_day', 'Date'),
+    ('invoice_month', 'String'),
+    ('billing_account_id', 'String'),
+    ('customer_id', 'Nullable(String)'),
+    ('contract_id', 'Nullable(String)'),
+    ('service_id', 'String'),
+    ('service_description', 'String'),
+    ('sku_id', 'String'),
+    ('sku_description', 'String'),
+    ('project_id', 'String'),
+    ('project_name', 'String'),
+    ('usage_pricing_unit', 'String'),
+    ('usage_amount_in_pricing_units', 'Float64'),
+    ('currency', 'String'),
+    ('currency_conversion_rate', 'Float64'),
+    ('cost_type', 'String'),
+    ('cost', 'Float64'),
+    ('cost_at_list', 'Float64'),
+    ('c_cud', 'Float64'),
+    ('c_cud_db', 'Float64'),
+    ('c_discount', 'Float64'),
+    ('c_free_tier', 'Float64'),
+    ('c_promotion', 'Float64'),
+    ('c_rm', 'Float64'),
+    ('c_sub_benefit', 'Float64'),
+    ('c_sud', 'Float64'),
+    ('internal_credits_cost', 'Float64'),
+    ('internal_credits_consumption', 'Float64'),
+    ('internal_cost', 'Float64'),
+    ('internal_consumption', 'Float64'),
+    ('external_consumption', 'Float64'),
+    ('discount_amount', 'Float64'),
+    ('mode', 'Int8'),
+    ('price', 'Float64'),
+    ('discount', 'Float64'),
+    ('credit_fields', 'String'),
+    ('etl_time', 'DateTime'),
+]
+
+CALCULATED_TABLES = ['dwm_standard_daily_billing_calculated', 'dwm_standard_daily_billing_calculated_tmp']
+
+_DATE_RE = re.compile(r'^\d{4}-\d{2}-\d{2}$')
+_DATETIME_RE = re.compile(r'^\d{4}-\d{2}-\d{2}[ T]\d{2}:\d{2}:\d{2}(\.\d+)?$')
+_PARAM_RE = re.compile(r'%\((\w+)\)s')
+
+
+def _sqlite_type(ch_type):
+    inner = ch_type
+    for wrapper in ('Nullable(', 'LowCardinality('):
+        if inner.startswith(wrapper):
+            inner = inner[len(wrapper):-1]
+    if inner.startswith(('Int', 'UInt', 'Bool')):
+        return 'INTEGER'
+    if inner.startswith(('Float', 'Decimal')):
+        return 'REAL'
+    return 'TEXT'
+
+
+def _ch_type(dtype):
+    if pd.api.types.is_bool_dtype(dtype):
+        return 'Bool'
+    if pd.api.types.is_integer_dtype(dtype):
+        return 'Int64'
+    if pd.api.types.is_float_dtype(dtype):
+        return 'Float64'
+    if pd.api.types.is_datetime64_any_dtype(dtype):
+        return 'DateTime'
+    return 'Nullable(String)'
+
+
+def _to_sqlite_value(value):
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        return value.strftime('%Y-%m-%d %H:%M:%S')
+    if isinstance(value, date):
+        return value.isoformat()
+    if isinstance(value, pd.Timestamp):
+        return value.strftime('%Y-%m-%d %H:%M:%S')
+    if hasattr(value, 'item'):
+        # numpy scalars
+        return value.item()
+    try:
+        if pd.isna(value):
+            return None
+    except (TypeError, ValueError):
+        pass
+    return value
+
+
+class LocalBackend:
+    """
+    In-process stand-in for the billing ClickHouse database, for profiling
+    and load tests without the production cluster.
+
+    Tables live in an embedded SQLite database attached as `billing`, so the
+    ETL's queries run with light dialect rewrites (%(name)s parameters,
+    count(), ALTER TABLE ... DELETE, DESCRIBE, CREATE TABLE ... AS).
+    ods_standard_daily_billing and dim_contract are loaded from Parquet/CSV
+    files; inserts land in SQLite tables with the calculated-table schema and
+    are also kept in `captured` for inspection.
+    """
+
+    def __init__(self, ods=None, dim_contract=None, database=':memory:', capture_inserts=True):
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(':memory:', check_same_thread=False)
+        self._conn.execute("ATTACH DATABASE ? AS billing", (database,))
+        self._conn.execute("ATTACH DATABASE ':memory:' AS system")
+        self._conn.execute(
+            "CREATE TABLE system.parts "
+            "(database TEXT, \"table\" TEXT, partition_id TEXT, active INTEGER, modification_time TEXT)"
+        )
+        self.schemas = {}
+        self.capture_inserts = capture_inserts
+        self.captured = {}
+
+        for table in CALCULATED_TABLES:
+            self.create_table(table, CALCULATED_TABLE_SCHEMA)
+        if ods:
+            self.load_table('ods_standard_daily_billing', ods)
+        if dim_contract:
+            self.load_table('dim_contract', dim_contract)
+
+    @classmethod
+    def from_config(cls, local_config):
+        return cls(
+            ods=local_config.get('ods'),
+            dim_contract=local_config.get('dim_contract'),
+            database=local_config.get('database', ':memory:'),
+            capture_inserts=local_config.get('capture_inserts', True),
+        )
+
+    def client(self, stats=None, **kwargs):
+        """A ClickhouseClient-compatible client on this backend (pool factory)."""
+        return LocalClickhouseClient(self, stats=stats)
+
+    @staticmethod
+    def _read_file(path):
+        if path.endswith('.parquet'):
+            return pd.read_parquet(path)
+        if path.endswith('.csv') or path.endswith('.csv.gz'):
+            return pd.read_csv(path)
+        raise ValueError(f"Unsupported local data file: {path}")
+
+    def create_table(self, table, schema):
+        """Create billing.<table> from [(name, ClickHouse type)] if it does not exist."""
+        columns = ', '.join(f'"{name}" {_sqlite_type(ch_type)}' for name, ch_type in schema)
+        with self._lock:
+            self._conn.execute(f'CREATE TABLE IF NOT EXISTS billing."{table}" ({columns})')
+            self._touch(table)
+        self.schemas.setdefault(table, list(schema))
+
+    def load_table(self, table, source):
+        """Replace billing.<table> with a DataFrame or the content of a Parquet/CSV file."""
+        df = self._read_file(source) if isinstance(source, str) else source
+        schema = [(col, _ch_type(df[col].dtype)) for col in df.columns]
+        with self._lock:
+            self._conn.execute(f'DROP TABLE IF EXISTS billing."{table}"')
+        self.schemas.pop(table, None)
+        self.create_table(table, schema)
+        self._insert_rows(table, list(df.columns), df)
+        if isinstance(source, str):
+            # 版本探测(system.parts.modification_time)取数据文件的修改时间, 文件不变则版本不变
+            with self._lock:
+                self._touch(table, datetime.fromtimestamp(os.path.getmtime(source)))
+
+    def _touch(self, table, modified=None):
+        modified = modified or datetime.now()
+        self._conn.execute('DELETE FROM system.parts WHERE "table" = ?', (table,))
+        self._conn.execute(
+            "INSERT INTO system.parts VALUES ('billing', ?, 'all', 1, ?)",
+            (table, modified.strftime('%Y-%m-%d %H:%M:%S.%f'))
+        )
+
+    def _insert_rows(self, table, columns, df):
+        placeholders = ', '.join('?' for _ in columns)
+        quoted = ', '.join(f'"{c}"' for c in columns)
+        rows = (tuple(_to_sqlite_value(v) for v in row) for row in df.itertuples(index=False, name=None))
+        with self._lock:
+            self._conn.executemany(f'INSERT INTO billing."{table}" ({quoted}) VALUES ({placeholders})', rows)
+            self._touch(table)
+
+    def insert(self, table, df):
+        if table not in self.schemas:
+            raise ValueError(f"Table billing.{table} doesn't exist")
+        columns = [name for name, _ in self.schemas[table]]
+        if len(df.columns) != len(columns):
+            raise ValueError(f"Insert into {table}: expected {len(columns)} columns, got {len(df.columns)}")
+        self._insert_rows(table, columns, df)
+        if self.capture_inserts:
+            self.captured.setdefault(table, []).append(df.copy())
+        return len(df)
+
+    def captured_frame(self, table):
+        """All DataFrames inserted into table so far, concatenated."""
+        frames = self.captured.get(table, [])
+        return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+    @staticmethod
+    def _table_name(name):
+        return name.strip('`"').split('.')[-1]
+
+    def translate(self, query, params=None):
+        """Rewrite a ClickHouse query into SQLite SQL + positional parameters."""
+        values = []
+
+        def substitute(match):
+            value = (params or {})[match.group(1)]
+            if isinstance(value, (list, tuple, set)):
+                items = [_to_sqlite_value(v) for v in value]
+                values.extend(items)
+                return '(' + ', '.join('?' for _ in items) + ')'
+            values.append(_to_sqlite_value(value))
+            return '?'
+
+        sql = _PARAM_RE.sub(substitute, query)
+        sql = re.sub(r'\bcount\(\s*\)', 'count(*)', sql, flags=re.IGNORECASE)
+        sql = re.sub(r'^\s*ALTER\s+TABLE\s+(\S+)\s+DELETE\s+WHERE', r'DELETE FROM \1 WHERE', sql,
+                     flags=re.IGNORECASE)
+        sql = re.sub(r'\bSETTINGS\b[^;]*$', '', sql, flags=re.IGNORECASE)
+        # 本地表不分区: 只有 ClickHouse 无分区表的 'all' 分区
+        sql = re.sub(r'\b_partition_id\b', "'all'", sql)
+        # system.parts.table 在 SQLite 中是保留字
+        sql = re.sub(r'\bAND\s+table\s*=', 'AND "table" =', sql, flags=re.IGNORECASE)
+        return sql, values
+
+    def run(self, query, params=None):
+        """Execute a query; returns (rows, [(column, type)])."""
+        statement = query.strip().rstrip(';')
+        upper = statement.upper()
+
+        if upper.startswith('SYSTEM '):
+            return [], []
+
+        match = re.match(r'DESC(?:RIBE)?\s+(?:TABLE\s+)?(\S+)$', statement, flags=re.IGNORECASE)
+        if match:
+            table = self._table_name(match.group(1))
+            if table not in self.schemas:
+                raise ValueError(f"Table billing.{table} doesn't exist")
+            rows = [(name, ch_type, '', '', '', '', '') for name, ch_type in self.schemas[table]]
+            columns = [('name', 'String'), ('type', 'String'), ('default_type', 'String'),
+                       ('default_expression', 'String'), ('comment', 'String'),
+                       ('codec_expression', 'String'), ('ttl_expression', 'String')]
+            return rows, columns
+
+        match = re.match(r'CREATE\s+TABLE\s+(?:IF\s+NOT\s+EXISTS\s+)?(\S+)\s+AS\s+(\S+)$', statement,
+                         flags=re.IGNORECASE)
+        if match:
+            self.create_table(self._table_name(match.group(1)), self.schemas[self._table_name(match.group(2))])
+            return [], []
+
+        match = re.match(r'DROP\s+TABLE\s+(?:IF\s+EXISTS\s+)?(\S+)$', statement, flags=re.IGNORECASE)
+        if match:
+            table = self._table_name(match.group(1))
+            with self._lock:
+                self._conn.execute(f'DROP TABLE IF EXISTS billing."{table}"')
+            self.schemas.pop(table, None)
+            self.captured.pop(table, None)
+            return [], []
+
+        sql, values = self.translate(statement, params)
+        with self._lock:
+            cursor = self._conn.execute(sql, values)
+            rows = cursor.fetchall()
+            columns = [(d[0], None) for d in cursor.description] if cursor.description else []
+            if not upper.startswith('SELECT') and not upper.startswith('WITH'):
+                target = re.search(r'(?:INTO|FROM|TABLE)\s+(\S+)', statement, flags=re.IGNORECASE)
+                if target:
+                    self._touch(self._table_name(target.group(1)))
+        return _convert_rows(rows, len(columns)), columns
+
+    def iter_rows(self, query, params=None, chunk_size=10000):
+        """
+        Stream a SELECT in chunks. The backend lock is only held while a chunk
+        is fetched, so inserts can run between chunks.
+        """
+        sql, values = self.translate(query.strip().rstrip(';'), params)
+        with self._lock:
+            cursor = self._conn.cursor()
+            cursor.execute(sql, values)
+            columns = [d[0] for d in cursor.description] if cursor.description else []
+        yield columns
+        while True:
+            with self._lock:
+                rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield _convert_rows(rows, len(columns))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def _convert_rows(rows, n_columns):
+    """SQLite returns dates as ISO text; turn date/datetime-looking columns back into date/datetime."""
+    if not rows:
+        return rows
+    converters = []
+    for i in range(n_columns):
+        values = [row[i] for row in rows if row[i] is not None]
+        if values and all(isinstance(v, str) and _DATE_RE.match(v) for v in values):
+            converters.append(date.fromisoformat)
+        elif values and all(isinstance(v, str) and _DATETIME_RE.match(v) for v in values):
+            converters.append(datetime.fromisoformat)
+        else:
+            converters.append(None)
+    if not any(converters):
+        return rows
+    return [
+        tuple(conv(v) if conv is not None and v is not None else v for conv, v in zip(converters, row))
+        for row in rows
+    ]
+
+
+class LocalClickhouseClient:
+    """ClickhouseClient interface (execute / query_dataframe / iterate / insert_dataframe) on a LocalBackend."""
+
+    def __init__(self, backend, stats=None):
+        self.backend = backend
+        self.stats = stats
+
+    def _track(self, tag, query):
+        return QueryTracker(self.stats, tag, query)
+
+    def get_client(self):
+        return self.backend
+
+    def execute(self, query, params=None, tag='execute'):
+        with self._track(tag, query) as tracker:
+            rows, _ = self.backend.run(query, params)
+            tracker.add_rows(len(rows))
+            return rows
+
+    def query_dataframe(self, query, params=None, tag='query_dataframe'):
+        with self._track(tag, query) as tracker:
+            rows, columns = self.backend.run(query, params)
+            tracker.add_rows(len(rows))
+            return pd.DataFrame(rows, columns=[name for name, _ in columns])
+
+    def iterate(self, query, params=None, batch_size=10000, tag='iterate'):
+        with self._track(tag, query) as tracker:
+            chunks = self.backend.iter_rows(query, params, chunk_size=batch_size or 10000)
+            columns = next(chunks)
+            for rows in chunks:
+                tracker.add_rows(len(rows))
+                with tracker.paused():
+                    yield pd.DataFrame(rows, columns=columns)
+
+    def iterate_blocks(self, query, params=None, batch_size=10000, settings=None, tag='iterate_blocks'):
+        return self.iterate(query, params=params, batch_size=batch_size, tag=tag)
+
+    def insert_dataframe(self, query, df, settings=None, columnar=True, dedup_token=None, retries=0, backoff=1.0,
+                         tag='insert'):
+        match = re.match(r'\s*INSERT\s+INTO\s+(\S+)', query, flags=re.IGNORECASE)
+        if not match:
+            raise ValueError(f"Unsupported insert query: {query}")
+        with self._track(tag, query) as tracker:
+            tracker.add_rows(len(df))
+            return self.backend.insert(self.backend._table_name(match.group(1)), df)
+
+    def ping(self):
+        return True
+
+    def disconnect(self):
+        pass
+
+    def close(self):
+        pass
@@ -0,0 +1,152 @@
+from contextlib import closing
+from datetime import datetime
+import os
+import sqlite3
+import uuid
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id TEXT PRIMARY KEY,
+    invoice_month TEXT NOT NULL,
+    target_table TEXT NOT NULL,
+    usage_day_start TEXT NOT NULL,
+    usage_day_end TEXT NOT NULL,
+    started_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS day_progress (
+    invoice_month TEXT NOT NULL,
+    target_table TEXT NOT NULL,
+    usage_day TEXT NOT NULL,
+    status TEXT NOT NULL,
+    rows INTEGER,
+    run_id TEXT,
+    updated_at TEXT NOT NULL,
+    PRIMARY KEY (invoice_month, target_table, usage_day)
+);
+CREATE TABLE IF NOT EXISTS batch_progress (
+    invoice_month TEXT NOT NULL,
+    target_table TEXT NOT NULL,
+    usage_day TEXT NOT NULL,
+    batch_index INTEGER NOT NULL,
+    rows INTEGER NOT NULL,
+    run_id TEXT,
+    updated_at TEXT NOT NULL,
+    PRIMARY KEY (invoice_month, target_table, usage_day, batch_index)
+);
+"""
+
+RUNNING = 'running'
+DONE = 'done'
+
+
+class ProgressLedger:
+    """
+    Durable progress of month runs in a local SQLite file, keyed by
+    invoice_month, target table, usage_day and batch.
+
+    begin_run() starts a run over a usage day range and forgets earlier
+    progress of that range; progress rows carry the run's id, and only the
+    run that wrote them counts them as done. resumable_run() finds the run
+    to continue: the latest one of the month and table, if it covers the same
+    range (a daily window that moved on is a new run, not a resume).
+
+    A day is marked running before its first batch, each inserted batch is
+    recorded, and the day is marked done after its last batch. A day still
+    running when the next attempt starts was interrupted: its rows in the
+    target table are partial and must be deleted before it is recalculated
+    (the ods batches of a day are not in a stable order, so a day is resumed
+    from its start, not from its last batch). Worker processes share the
+    file; every call is one short transaction.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with closing(self._connect()) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=60)
+
+    def _write(self, sql, params):
+        with closing(self._connect()) as conn, conn:
+            conn.execute(sql, params)
+
+    def begin_run(self, invoice_month, target_table, usage_day_start, usage_day_end):
+        """Start a run over usage days [start, end]; returns its run id."""
+        run_id = uuid.uuid4().hex[:12]
+        self.reset(invoice_month, target_table, usage_day_start, usage_day_end)
+        self._write("INSERT INTO runs VALUES (?, ?, ?, ?, ?, ?)",
+                    (run_id, invoice_month, target_table, str(usage_day_start), str(usage_day_end),
+                     datetime.now().isoformat(timespec='seconds')))
+        return run_id
+
+    def resumable_run(self, invoice_month, target_table, usage_day_start, usage_day_end):
+        """Id of the latest run of invoice_month into target_table if it covers [start, end], else None."""
+        with closing(self._connect()) as conn:
+            row = conn.execute(
+                "SELECT run_id, usage_day_start, usage_day_end FROM runs "
+                "WHERE invoice_month = ? AND target_table = ? ORDER BY rowid DESC LIMIT 1",
+                (invoice_month, target_table)).fetchone()
+        if row is None or (row[1], row[2]) != (str(usage_day_start), str(usage_day_end)):
+            return None
+        return row[0]
+
+    def _days(self, invoice_month, target_table, run_id, status):
+        with closing(self._connect()) as conn:
+            rows = conn.execute(
+                "SELECT usage_day FROM day_progress "
+                "WHERE invoice_month = ? AND target_table = ? AND run_id = ? AND status = ?",
+                (invoice_month, target_table, run_id, status)).fetchall()
+        return {row[0] for row in rows}
+
+    def done_days(self, invoice_month, target_table, run_id):
+        """Usage days (ISO strings) run_id finished into target_table."""
+        return self._days(invoice_month, target_table, run_id, DONE)
+
+    def partial_days(self, invoice_month, target_table, run_id):
+        """Usage days (ISO strings) run_id started but never finished."""
+        return self._days(invoice_month, target_table, run_id, RUNNING)
+
+    def start_day(self, invoice_month, target_table, usage_day, run_id):
+        """Mark usage_day running and forget its batches; returns True if it was left partial."""
+        usage_day = str(usage_day)
+        now = datetime.now().isoformat(timespec='seconds')
+        with closing(self._connect()) as conn, conn:
+            row = conn.execute(
+                "SELECT status FROM day_progress WHERE invoice_month = ? AND target_table = ? AND usage_day = ?",
+                (invoice_month, target_table, usage_day)).fetchone()
+            conn.execute(
+                "DELETE FROM batch_progress WHERE invoice_month = ? AND target_table = ? AND usage_day = ?",
+                (invoice_month, target_table, usage_day))
+            conn.execute(
+                "INSERT OR REPLACE INTO day_progress VALUES (?, ?, ?, ?, NULL, ?, ?)",
+                (invoice_month, target_table, usage_day, RUNNING, run_id, now))
+        return row is not None and row[0] == RUNNING
+
+    def record_batch(self, invoice_month, target_table, usage_day, batch_index, rows, run_id):
+        self._write("INSERT OR REPLACE INTO batch_progress VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (invoice_month, target_table, str(usage_day), batch_index, rows, run_id,
+                     datetime.now().isoformat(timespec='seconds')))
+
+    def finish_day(self, invoice_month, target_table, usage_day, rows, run_id):
+        self._write("INSERT OR REPLACE INTO day_progress VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (invoice_month, target_table, str(usage_day), DONE, rows, run_id,
+                     datetime.now().isoformat(timespec='seconds')))
+
+    def reset(self, invoice_month, target_table, usage_day_start=None, usage_day_end=None):
+        """Forget the progress of target_table's month, or of usage days [start, end] only."""
+        condition = "invoice_month = ? AND target_table = ?"
+        params = [invoice_month, target_table]
+        if usage_day_start is not None:
+            condition += " AND usage_day >= ?"
+            params.append(str(usage_day_start))
+        if usage_day_end is not None:
+            condition += " AND usage_day <= ?"
+            params.append(str(usage_day_end))
+        with closing(self._connect()) as conn, conn:
+            conn.execute(f"DELETE FROM day_progress WHERE {condition}", params)
+            conn.execute(f"DELETE FROM batch_progress WHERE {condition}", params)
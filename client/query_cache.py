@@ -0,0 +1,184 @@
+from contextlib import contextmanager
+import hashlib
+import json
+import os
+import time
+
+import pandas as pd
+
+from utils.logger import setup_logger
+
+logger = setup_logger()
+
+
+class QueryCache:
+    """
+    Local Parquet cache of query results.
+
+    Entries are keyed by query text + parameters and stamped with a version
+    string from a cheap server-side probe (row count + last part modification
+    time). An entry is only served while the probe returns the same version.
+    The cache directory is kept under max_bytes by evicting the least
+    recently used entries.
+    """
+
+    def __init__(self, cache_dir='.cache/query', max_bytes=2 * 1024 ** 3):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(query, params=None):
+        normalized = ' '.join(query.split())
+        payload = json.dumps([normalized, params or {}], sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _paths(self, key):
+        base = os.path.join(self.cache_dir, key)
+        return base + '.parquet', base + '.json'
+
+    def _lookup(self, key, version):
+        data_path, meta_path = self._paths(key)
+        if not (os.path.exists(data_path) and os.path.exists(meta_path)):
+            return None
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if meta.get('version') != version:
+            return None
+        # 命中时更新 mtime, 供 LRU 淘汰使用
+        os.utime(data_path, None)
+        return data_path
+
+    def get(self, key, version):
+        """Cached DataFrame for key, or None on a miss / stale version."""
+        data_path = self._lookup(key, version)
+        if data_path is None:
+            return None
+        return pd.read_parquet(data_path)
+
+    def iter_batches(self, key, version, batch_size=10000):
+        """Cached result as DataFrame batches, or None on a miss / stale version."""
+        data_path = self._lookup(key, version)
+        if data_path is None:
+            return None
+        return self._read_batches(data_path, batch_size)
+
+    @staticmethod
+    def _read_batches(data_path, batch_size):
+        import pyarrow.parquet as pq
+
+        parquet_file = pq.ParquetFile(data_path)
+        for record_batch in parquet_file.iter_batches(batch_size=batch_size):
+            yield record_batch.to_pandas()
+
+    def put(self, key, version, df, query=None, params=None):
+        with self.writer(key, version, query=query, params=params) as writer:
+            writer.write(df)
+
+    @contextmanager
+    def writer(self, key, version, query=None, params=None):
+        """
+        Write a result batch by batch; the entry only becomes visible when the
+        block exits without error. Cache write failures are logged and never
+        raised to the caller.
+        """
+        writer = _CacheWriter(*self._paths(key))
+        try:
+            yield writer
+        except BaseException:
+            writer.abort()
+            raise
+        if writer.commit(version, query=query, params=params):
+            self.evict()
+
+    def evict(self):
+        """Drop least recently used entries until the cache fits max_bytes."""
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith('.parquet'):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            for p in (path, path[:-len('.parquet')] + '.json'):
+                try:
+                    os.remove(p)
+                except OSError:
+                    pass
+            total -= size
+            logger.info(f"Query cache evicted {os.path.basename(path)} ({size / 1024 ** 2:.1f} MB)")
+
+
+class _CacheWriter:
+
+    def __init__(self, data_path, meta_path):
+        self.data_path = data_path
+        self.meta_path = meta_path
+        self.tmp_path = f"{data_path}.{os.getpid()}.tmp"
+        self.rows = 0
+        self._writer = None
+        self._schema = None
+        self._failed = False
+
+    def write(self, df):
+        if self._failed:
+            return
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+
+            table = pa.Table.from_pandas(df, schema=self._schema, preserve_index=False)
+            if self._writer is None:
+                self._schema = table.schema
+                self._writer = pq.ParquetWriter(self.tmp_path, self._schema)
+            self._writer.write_table(table)
+            self.rows += len(df)
+        except Exception as e:
+            logger.warning(f"Query cache write skipped: {e}")
+            self.abort()
+            self._failed = True
+
+    def abort(self):
+        if self._writer is not None:
+            try:
+                self._writer.close()
+            except Exception:
+                pass
+            self._writer = None
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+    def commit(self, version, query=None, params=None):
+        if self._failed or self._writer is None:
+            return False
+        try:
+            self._writer.close()
+            self._writer = None
+            if os.path.exists(self.meta_path):
+                os.remove(self.meta_path)
+            os.replace(self.tmp_path, self.data_path)
+            meta = {
+                'version': version,
+                'rows': self.rows,
+                'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+                'query': ' '.join(query.split()) if query else None,
+                'params': params,
+            }
+            with open(self.meta_path, 'w', encoding='utf-8') as f:
+                json.dump(meta, f, ensure_ascii=False, default=str)
+            return True
+        except Exception as e:
+            logger.warning(f"Query cache commit failed: {e}")
+            self.abort()
+            return False
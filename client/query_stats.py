@@ -0,0 +1,201 @@
+from contextlib import contextmanager
+from datetime import datetime
+import csv
+import os
+import threading
+import time
+import uuid
+
+import pandas as pd
+
+STATS_FIELDS = [
+    'run_id', 'query_id', 'tag', 'started_at',
+    'client_seconds', 'wall_seconds', 'server_seconds',
+    'rows_read', 'bytes_read', 'written_rows', 'written_bytes', 'result_rows',
+    'error', 'query'
+]
+
+
+class QueryStatsRecorder:
+    """
+    Collects one record per query run through ClickhouseClient: query id,
+    caller tag, rows/bytes read or written and server time reported by the
+    driver's progress packets, plus client-side time.
+
+    client_seconds only counts time spent inside the client call (for
+    iterators: fetching and decoding batches, not the caller's work between
+    batches); wall_seconds is start to finish.
+    """
+
+    def __init__(self, run_id=None):
+        self.run_id = run_id or uuid.uuid4().hex[:12]
+        self._records = []
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._records)
+
+    def track(self, tag, query, db_client=None):
+        return QueryTracker(self, tag, query, db_client=db_client)
+
+    def record(self, **fields):
+        fields['run_id'] = self.run_id
+        with self._lock:
+            self._records.append(fields)
+
+    def to_dataframe(self):
+        with self._lock:
+            records = list(self._records)
+        return pd.DataFrame(records, columns=STATS_FIELDS)
+
+    def save(self, path, clear=False):
+        """Append the collected records to a CSV file; clear=True drops them afterwards."""
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        file_exists = os.path.isfile(path)
+        with self._lock:
+            records = list(self._records)
+            if clear:
+                self._records = []
+        with open(path, mode='a', newline='', encoding='utf-8') as f:
+            writer = csv.DictWriter(f, fieldnames=STATS_FIELDS)
+            if not file_exists:
+                writer.writeheader()
+            writer.writerows(records)
+        return path
+
+
+class QueryTracker:
+    """
+    Times one query. Used as a context manager around the client call; on
+    exit the record is completed from the driver's last_query progress.
+    Without a recorder it only hands out the query id.
+    """
+
+    def __init__(self, recorder, tag, query, db_client=None):
+        self.recorder = recorder
+        self.db_client = db_client
+        self.tag = tag
+        self.query = query
+        self.query_id = str(uuid.uuid4())
+        self.result_rows = None
+        self.error = None
+        self.client_seconds = 0.0
+        self._started_at = None
+        self._wall_start = None
+        self._resumed = None
+
+    def __enter__(self):
+        self._started_at = datetime.now()
+        self._wall_start = time.perf_counter()
+        self._resumed = self._wall_start
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._pause()
+        if exc_type is GeneratorExit:
+            self.error = 'cancelled'
+        elif exc is not None:
+            self.error = f"{exc_type.__name__}: {exc}"
+        self.finish(getattr(self.db_client, 'last_query', None))
+        return False
+
+    def _pause(self):
+        if self._resumed is not None:
+            self.client_seconds += time.perf_counter() - self._resumed
+            self._resumed = None
+
+    @contextmanager
+    def paused(self):
+        """Stop the client clock while the caller works on a yielded batch."""
+        self._pause()
+        try:
+            yield
+        finally:
+            self._resumed = time.perf_counter()
+
+    def add_rows(self, n):
+        self.result_rows = (self.result_rows or 0) + n
+
+    def finish(self, last_query):
+        if self.recorder is None:
+            return
+        progress = getattr(last_query, 'progress', None)
+        elapsed_ns = getattr(progress, 'elapsed_ns', 0) if progress is not None else 0
+        self.recorder.record(
+            query_id=self.query_id,
+            tag=self.tag,
+            started_at=self._started_at.strftime('%Y-%m-%d %H:%M:%S.%f'),
+            client_seconds=round(self.client_seconds, 6),
+            wall_seconds=round(time.perf_counter() - self._wall_start, 6),
+            server_seconds=elapsed_ns / 1e9 if elapsed_ns else None,
+            rows_read=getattr(progress, 'rows', None),
+            bytes_read=getattr(progress, 'bytes', None),
+            written_rows=getattr(progress, 'written_rows', None),
+            written_bytes=getattr(progress, 'written_bytes', None),
+            result_rows=self.result_rows,
+            error=self.error,
+            query=' '.join(self.query.split())[:1000],
+        )
+
+
+def build_query_report(client, stats_df, top=20):
+    """
+    Join recorded ETL queries with system.query_log and rank them.
+
+    Returns (by_tag, top_queries): per-tag totals, and the `top` most
+    expensive statements by server duration. Queries not yet flushed to
+    query_log keep their client-side numbers only.
+    """
+    if stats_df.empty:
+        return pd.DataFrame(), pd.DataFrame()
+
+    query_ids = stats_df['query_id'].dropna().unique().tolist()
+    started = pd.to_datetime(stats_df['started_at'])
+    log_df = client.query_dataframe(
+        """
+            SELECT
+                query_id,
+                query_duration_ms,
+                read_rows AS log_read_rows,
+                read_bytes AS log_read_bytes,
+                written_rows AS log_written_rows,
+                written_bytes AS log_written_bytes,
+                result_rows AS log_result_rows,
+                memory_usage
+            FROM system.query_log
+            WHERE event_date >= %(date_from)s
+              AND event_date <= %(date_to)s
+              AND type = 'QueryFinish'
+              AND query_id IN %(query_ids)s
+        """,
+        params={
+            'date_from': started.min().date(),
+            'date_to': started.max().date() + pd.Timedelta(days=1),
+            'query_ids': query_ids,
+        },
+        tag='query_report'
+    )
+
+    report = stats_df.merge(log_df, on='query_id', how='left')
+    report['server_ms'] = pd.to_numeric(report['query_duration_ms'], errors='coerce').fillna(
+        pd.to_numeric(report['server_seconds'], errors='coerce') * 1000)
+    report['client_ms'] = pd.to_numeric(report['client_seconds'], errors='coerce') * 1000
+
+    by_tag = report.groupby('tag').agg(
+        queries=('query_id', 'count'),
+        server_ms=('server_ms', 'sum'),
+        client_ms=('client_ms', 'sum'),
+        read_rows=('log_read_rows', 'sum'),
+        read_bytes=('log_read_bytes', 'sum'),
+        written_rows=('log_written_rows', 'sum'),
+        max_memory=('memory_usage', 'max'),
+    ).sort_values('server_ms', ascending=False)
+
+    top_queries = report.sort_values('server_ms', ascending=False).head(top)[
+        ['tag', 'query_id', 'started_at', 'server_ms', 'client_ms', 'log_read_rows', 'log_read_bytes',
+         'log_written_rows', 'memory_usage', 'error', 'query']
+    ]
+    return by_tag, top_queries
@@ -0,0 +1,186 @@
+from datetime import datetime
+import re
+import threading
+
+import numpy as np
+import pandas as pd
+
+# DESCRIBE 中这些列不能出现在 INSERT 里
+_NON_INSERTABLE = ('MATERIALIZED', 'ALIAS')
+
+_INT_TYPES = {
+    'Int8': np.int8, 'Int16': np.int16, 'Int32': np.int32, 'Int64': np.int64,
+    'UInt8': np.uint8, 'UInt16': np.uint16, 'UInt32': np.uint32, 'UInt64': np.uint64,
+    'Bool': np.bool_,
+}
+_FLOAT_TYPES = {'Float32': np.float32, 'Float64': np.float64}
+
+
+def _unwrap(ch_type):
+    """('Nullable(LowCardinality(String))') -> ('String', nullable=True)."""
+    nullable = False
+    while True:
+        match = re.match(r'^(Nullable|LowCardinality)\((.*)\)$', ch_type)
+        if not match:
+            return ch_type, nullable
+        nullable = nullable or match.group(1) == 'Nullable'
+        ch_type = match.group(2)
+
+
+class InsertPlan:
+    """
+    Coercion of a DataFrame batch to the column types of one table, compiled
+    once from its DESCRIBE output.
+
+    apply() returns a new DataFrame in table column order with every column
+    converted in one vectorized step per column: String -> str with '' for
+    nulls (Categorical columns stay dictionary encoded), Nullable(String) -> str / None, Int* -> numpy ints with 0 for nulls,
+    Float* -> float with 0 for nulls, Date -> datetime.date, DateTime ->
+    datetime64. Columns missing from the batch get the type's default
+    (etl_time-like DateTime columns get the current time). The input frame is
+    not modified, and columns already in their final type are passed through
+    without a copy, so the result shares their memory with the batch.
+
+    integer_string_columns are String columns that may arrive as numbers
+    (invoice_month read back as 202602.0): their fractional part is dropped.
+    """
+
+    def __init__(self, schema, integer_string_columns=('invoice_month',)):
+        self.schema = [(name, ch_type) for name, ch_type in schema]
+        self.columns = [name for name, _ in self.schema]
+        self.integer_string_columns = set(integer_string_columns)
+        self._steps = [(name, self._converter(name, ch_type)) for name, ch_type in self.schema]
+
+    @classmethod
+    def from_describe(cls, describe_df, **kwargs):
+        if 'default_type' in describe_df.columns:
+            describe_df = describe_df[~describe_df['default_type'].isin(_NON_INSERTABLE)]
+        return cls(list(zip(describe_df['name'], describe_df['type'])), **kwargs)
+
+    def _converter(self, name, ch_type):
+        base, nullable = _unwrap(ch_type)
+        if base == 'String' or base.startswith('FixedString'):
+            if nullable:
+                return self._nullable_string
+            if name in self.integer_string_columns:
+                return self._integer_string
+            return self._string
+        if base in _INT_TYPES:
+            return lambda s, n: self._number(s, n, _INT_TYPES[base])
+        if base in _FLOAT_TYPES or base.startswith('Decimal'):
+            return lambda s, n: self._number(s, n, _FLOAT_TYPES.get(base, np.float64))
+        if base in ('Date', 'Date32'):
+            return self._date
+        if base.startswith('DateTime'):
+            return self._datetime
+        return lambda s, n: s if s is not None else pd.Series([None] * n, dtype=object)
+
+    def apply(self, df):
+        n = len(df)
+        data = {}
+        for name, convert in self._steps:
+            data[name] = convert(df[name] if name in df.columns else None, n)
+        return pd.DataFrame(data, columns=self.columns, index=pd.RangeIndex(n), copy=False)
+
+    @staticmethod
+    def _string(s, n):
+        if s is None:
+            return np.full(n, '', dtype=object)
+        if isinstance(s.dtype, pd.CategoricalDtype):
+            # 字典编码的列原样保留(Arrow 按 dictionary 发送, native 驱动取 to_numpy)
+            values = s.array
+            if s.hasnans:
+                if '' not in values.categories:
+                    values = values.add_categories([''])
+                values = values.fillna('')
+            return values
+        if s.dtype != object:
+            return s.astype(str).to_numpy(dtype=object)
+        if s.hasnans:
+            return s.fillna('').to_numpy(dtype=object)
+        return s.to_numpy()
+
+    @staticmethod
+    def _integer_string(s, n):
+        if s is None:
+            return np.full(n, '', dtype=object)
+        if s.dtype != object or s.hasnans or pd.api.types.infer_dtype(s) != 'string':
+            s = s.fillna('').astype(str)
+        if not s.str.contains('.', regex=False).any():
+            return s.to_numpy(dtype=object)
+        return s.str.split('.', n=1).str[0].to_numpy(dtype=object)
+
+    @staticmethod
+    def _nullable_string(s, n):
+        if s is None:
+            return np.full(n, None, dtype=object)
+        mask = s.isna().to_numpy()
+        if pd.api.types.infer_dtype(s, skipna=True) not in ('string', 'empty'):
+            values = s.astype(str).to_numpy(dtype=object)
+        else:
+            values = s.to_numpy(dtype=object)
+            if not mask.any() or all(v is None for v in values[mask]):
+                # 已经是 str / None, 原样传递
+                return values
+            values = values.copy()
+        values[mask] = None
+        return values
+
+    @staticmethod
+    def _number(s, n, dtype):
+        if s is None:
+            return np.zeros(n, dtype=dtype)
+        if s.dtype == dtype:
+            # 已是目标类型: 没有空值时不复制
+            if s.hasnans:
+                return s.fillna(0).to_numpy()
+            return s.to_numpy()
+        if not pd.api.types.is_numeric_dtype(s.dtype):
+            s = pd.to_numeric(s, errors='coerce')
+        return s.fillna(0).to_numpy(dtype=dtype)
+
+    @staticmethod
+    def _date(s, n):
+        if s is None:
+            return np.full(n, None, dtype=object)
+        if pd.api.types.is_datetime64_any_dtype(s.dtype):
+            return s.dt.date.to_numpy(dtype=object)
+        return s.to_numpy(dtype=object)
+
+    @staticmethod
+    def _datetime(s, n):
+        if s is None:
+            return np.full(n, np.datetime64(datetime.now()), dtype='datetime64[ns]')
+        if pd.api.types.is_datetime64_any_dtype(s.dtype):
+            return s.to_numpy()
+        return pd.to_datetime(s).to_numpy()
+
+
+class TableSchemaCache:
+    """
+    DESCRIBE results per table, fetched on first use and kept for the life of
+    the service, with the compiled InsertPlan of each table.
+    """
+
+    def __init__(self, database='billing'):
+        self.database = database
+        self._plans = {}
+        self._lock = threading.Lock()
+
+    def plan(self, client, table):
+        with self._lock:
+            plan = self._plans.get(table)
+        if plan is not None:
+            return plan
+        describe_df = client.query_dataframe(f"DESCRIBE TABLE {self.database}.{table}", tag='describe')
+        plan = InsertPlan.from_describe(describe_df)
+        with self._lock:
+            self._plans.setdefault(table, plan)
+        return plan
+
+    def invalidate(self, table=None):
+        with self._lock:
+            if table is None:
+                self._plans.clear()
+            else:
+                self._plans.pop(table, None)
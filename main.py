@@ -1,4 +1,7 @@
 import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import multiprocessing
+import multiprocessing.util
 import sys
 import time
 import csv
@@ -7,6 +10,7 @@ import schedule
 from datetime import datetime, timedelta
 from billing_calculation_service import BillingCalculationService
 from calculate.service import CalculateService
+from calculate.work_planner import plan_work_units
 from utils.logger import setup_logger
 
 # Configure logging
@@ -17,6 +21,8 @@ def log_failure_to_csv(billing_account_id, start_date, end_date, error_msg, log_
     Log failure details to a CSV file.
     """
     file_path = "billing_sync_failures.csv"
+    if not isinstance(billing_account_id, str):
+        billing_account_id = ",".join(billing_account_id)
     file_exists = os.path.isfile(file_path)
     
     try:
@@ -35,7 +41,11 @@ def get_dim_month(invoice_month):
     """Convert invoice_month (YYYYMM) to dim_month format (YYYY-MM)."""
     return f"{invoice_month[:4]}-{invoice_month[4:]}"
 
-def month_task_day(invoice_month: str,usage_day_start: datetime.date,usage_day_end: datetime.date,target_table: str, calc_service: BillingCalculationService):
+def month_task_day(invoice_month: str,usage_day_start: datetime.date,usage_day_end: datetime.date,target_table: str, calc_service: BillingCalculationService, engine: str = None, workers: int = None, resume: bool = False):
+    # engine: 默认取 etl.engine; sql 时整个区间下推到 ClickHouse 计算
+    # workers: 并行处理的天数(进程数), 默认取 etl.workers
+    # resume: 续跑账本中同一区间的最近一次运行, 跳过它已完成的天(未完成的天由 pipeline_day 先清理再重算);
+    #         没有这样的运行时删掉区间数据后重算. 否则清空区间内的进度, 记录新的运行
     #invoice_month = '202601'
     start_time = time.time()
     dim_month = get_dim_month(invoice_month)
@@ -48,12 +58,56 @@ def month_task_day(invoice_month: str,usage_day_start: datetime.date,usage_day_e
     if not usage_day_start or not usage_day_end:
         logger.error(f"No usage data found for {invoice_month}")
         return
-    df_contract=calc_service.get_dim_contract(month=dim_month)
-
-    while usage_day_start <= usage_day_end:
-        calc_service.pipeline_day(invoice_month,df_contract, usage_day_start,target_table=target_table)
-        # 天数加 1 (Correctly using interval)
-        usage_day_start += timedelta(days=1)
+    engine = engine or calc_service.engine
+    ledger = calc_service.ledger
+    if engine == 'sql':
+        if resume:
+            # 下推切片不记账本: 续跑时先删掉区间内已写入的数据, 整个区间重算
+            logger.warning(f"engine 'sql' does not resume, recalculating {usage_day_start} to {usage_day_end}")
+            calc_service.delete_days(invoice_month, usage_day_start, usage_day_end, target_table)
+        # 在 ClickHouse 内按切片完成整个区间, 数据不经过本进程
+        calc_service.pipeline_pushdown(invoice_month, usage_day_start, usage_day_end + timedelta(days=1),
+                                       target_table=target_table)
+    else:
+        # 续跑只接着账本中同一区间的最近一次运行; 否则(区间已变/无账本)先删掉区间内的旧数据, 作为新的运行重算
+        run_key = ledger.resumable_run(invoice_month, target_table, usage_day_start, usage_day_end) \
+            if resume and ledger is not None else None
+        done_days = set()
+        if run_key is not None:
+            done_days = ledger.done_days(invoice_month, target_table, run_key)
+            partial_days = ledger.partial_days(invoice_month, target_table, run_key)
+            logger.info(f"Resuming run {run_key} of {invoice_month} into {target_table}: {len(done_days)} days done, "
+                        f"partial days to clean up: {sorted(partial_days) or 'none'}")
+        else:
+            if resume:
+                logger.warning(f"No interrupted run of {invoice_month} into {target_table} for "
+                               f"{usage_day_start} to {usage_day_end}, recalculating the range")
+                calc_service.delete_days(invoice_month, usage_day_start, usage_day_end, target_table)
+            if ledger is not None:
+                run_key = ledger.begin_run(invoice_month, target_table, usage_day_start, usage_day_end)
+
+        days = []
+        while usage_day_start <= usage_day_end:
+            if str(usage_day_start) in done_days:
+                logger.info(f"Usage day {usage_day_start} already done, skipping")
+            else:
+                days.append(usage_day_start)
+            # 天数加 1 (Correctly using interval)
+            usage_day_start += timedelta(days=1)
+
+        # 月度合同规则索引, dim_contract 未变化时直接复用(内存/本地文件)
+        df_contract=calc_service.get_contract_index(month=dim_month) if days else None
+
+        workers = _effective_workers(calc_service, workers)
+        if workers > 1 and days:
+            tasks = [(f"usage day {day}", 'pipeline_day',
+                      dict(invoice_month=invoice_month, usage_day_start=day, target_table=target_table,
+                           ledger_run=run_key, raise_errors=True))
+                     for day in days]
+            run_parallel(invoice_month, tasks, df_contract, calc_service, workers)
+        else:
+            for day in days:
+                calc_service.pipeline_day(invoice_month,df_contract, day,target_table=target_table, ledger_run=run_key)
 
     elapsed = time.time() - start_time
     logger.info(f"month_task_day 总执行时间: {elapsed:.2f} 秒")
@@ -61,8 +115,82 @@ def month_task_day(invoice_month: str,usage_day_start: datetime.date,usage_day_e
 
 
 
-def month_task_billingid(invoice_month: str, calc_service: BillingCalculationService):
-    #invoice_month = '202601'
+# 并行任务的工作进程: 每个进程有自己的 BillingCalculationService(连接池/客户端)和合同规则索引
+_worker_service = None
+_worker_contract = None
+
+
+def _init_worker(config_path, df_contract):
+    global _worker_service, _worker_contract
+    _worker_service = BillingCalculationService(config_path)
+    _worker_contract = df_contract
+    # 进程退出时保存查询统计并关闭连接(工作进程不执行 atexit)
+    multiprocessing.util.Finalize(None, _worker_service.close, exitpriority=10)
+
+
+def _run_worker_task(method, kwargs):
+    start_time = time.time()
+    try:
+        rows = getattr(_worker_service, method)(df_contract=_worker_contract, **kwargs)
+        return {'rows': rows, 'seconds': time.time() - start_time, 'error': None}
+    except Exception as e:
+        return {'rows': None, 'seconds': time.time() - start_time, 'error': repr(e)}
+
+
+def run_parallel(invoice_month, tasks, df_contract, calc_service, workers):
+    """
+    Run tasks, (label, service method, kwargs) calls such as one pipeline_day,
+    on a pool of worker processes. Each worker has its own ClickHouse
+    connections and a copy of df_contract; the method must return the rows
+    inserted and raise on failure. Rows, timings and failures are collected
+    here: failed tasks are logged, written to the failure CSV and sent as one
+    Feishu summary. Returns one result dict per task, in task order.
+    """
+    results = [None] * len(tasks)
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=min(workers, len(tasks)) or 1, mp_context=context,
+                             initializer=_init_worker,
+                             initargs=(calc_service.config_path, df_contract)) as executor:
+        futures = {executor.submit(_run_worker_task, method, kwargs): i for i, (_, method, kwargs) in enumerate(tasks)}
+        for done, future in enumerate(as_completed(futures), 1):
+            i = futures[future]
+            label, _, kwargs = tasks[i]
+            try:
+                result = future.result()
+            except Exception as e:
+                # 工作进程异常退出
+                result = {'rows': None, 'seconds': None, 'error': repr(e)}
+            result['task'] = label
+            results[i] = result
+            if result['error']:
+                logger.error(f"Processing failed: {label} , error: {result['error']}")
+                log_failure_to_csv(kwargs.get('billing_account_id', ''), kwargs['usage_day_start'],
+                                   kwargs.get('usage_day_end', kwargs['usage_day_start']), result['error'])
+            else:
+                logger.info(f"{label} done: {result['rows']} rows in {result['seconds']:.1f}s ({done}/{len(tasks)})")
+
+    failed = [r for r in results if r['error']]
+    inserted = sum(r['rows'] or 0 for r in results)
+    logger.info(f"{invoice_month}: {len(tasks) - len(failed)}/{len(tasks)} tasks done with {workers} workers, "
+                f"{inserted} rows inserted")
+    if failed:
+        calc_service.send_feishu_alarm(
+            f"Processing failed: {invoice_month} {len(failed)}/{len(tasks)} 个任务失败: "
+            + "; ".join(f"{r['task']}: {r['error']}" for r in failed))
+    return results
+
+
+def _effective_workers(calc_service, workers):
+    workers = workers or calc_service.workers
+    if workers > 1 and calc_service.backend == 'local':
+        logger.warning("Local backend keeps its data in this process, running sequentially")
+        workers = 1
+    return workers
+
+
+def month_task_billingid(invoice_month: str, calc_service: BillingCalculationService, workers: int = None,
+                         row_budget: int = None):
+    # workers: 工作进程数, 默认取 etl.workers; row_budget: 每个工作单元的 ods 行数, 默认取 etl.work_unit_rows
     start_time = time.time()
     dim_month = get_dim_month(invoice_month)
     
@@ -74,62 +202,31 @@ def month_task_billingid(invoice_month: str, calc_service: BillingCalculationSer
     if not usage_day_start or not usage_day_end:
         logger.error(f"No usage data found for {invoice_month}")
         return
-    billing_account_id_list = calc_service.get_billing_account_ids(
-        invoice_month=invoice_month,
-        usage_day_start=usage_day_start,
-        usage_day_end=usage_day_end
-    )['billing_account_id'].values.tolist()
-    
-    logger.info(f"Found {len(billing_account_id_list)} billing accounts to process")
-
-    for billing_account_id in billing_account_id_list:
-        interval = 15
-        if billing_account_id in [
-            "01C21A-D27751-089D20",
-            "01194A-900FE2-3CBAF8",
-            "01F82E-571136-4A9147",
-            "01CEEE-1EC3DF-9B4A3D",
-            "017AC6-21D881-77FBCD",
-            "017198-4BB4D2-CDF4EF",
-            "01587C-263C61-84FBDB",
-            "0177A8-AA1A62-456013",
-            "013196-4D30CB-14E3E2",
-            "015116-F46E8A-C292BB",
-            "01B372-0ED33C-BC0E0B",
-            "01F1D7-9F0400-E05D90",
-            "01ACBD-4B4CE4-2D688D",
-            "01A663-5EF6A3-8A9516"
-        ]:
-            interval = 1
-            
-        current_date = usage_day_start
-        end_date = usage_day_end
-        
-        
-        while current_date <= end_date:
-            # 构造当天的起始和结束时间
-            endtime = current_date + timedelta(days=interval)
-            if endtime > end_date:
-                endtime = end_date + timedelta(days=1)
-                
-            try:
-                calc_service.pipeline_billingaccount_day(
-                    invoice_month=invoice_month, 
-                    df_contract=df_contract,
-                    billing_account_id=billing_account_id, 
-                    usage_day_start=current_date, 
-                    usage_day_end=endtime, 
-                    dim_month=dim_month
-                )
-                logger.info(f"Processed {billing_account_id} from {current_date} to {endtime}")
 
+    # 一次查询得到每个账户每天的行数, 按行数预算切分/合并成工作单元
+    counts = calc_service.get_account_day_counts(invoice_month, usage_day_start, usage_day_end + timedelta(days=1))
+    units = plan_work_units(counts, usage_day_start, usage_day_end, row_budget or calc_service.work_unit_rows)
+    logger.info(f"Planned {len(units)} work units for {counts['billing_account_id'].nunique()} billing accounts, "
+                f"{int(counts['row_count'].sum())} ods rows")
+
+    df_contract = calc_service.get_contract_index(month=dim_month)
+    tasks = [(unit.label, 'pipeline_billingaccount_day',
+              dict(invoice_month=invoice_month, billing_account_id=unit.billing_account_ids,
+                   usage_day_start=unit.usage_day_start, usage_day_end=unit.usage_day_end, dim_month=dim_month))
+             for unit in units]
+
+    workers = _effective_workers(calc_service, workers)
+    if workers > 1:
+        run_parallel(invoice_month, tasks, df_contract, calc_service, workers)
+    else:
+        for label, method, kwargs in tasks:
+            try:
+                getattr(calc_service, method)(df_contract=df_contract, **kwargs)
+                logger.info(f"Processed {label}")
             except Exception as e:
                 # 记录失败信息
-                logger.error(f"Processing failed: billing_account_id={billing_account_id}, from {current_date} to {endtime}, error: {e}", exc_info=True)
-                log_failure_to_csv(billing_account_id, current_date, endtime, e)
-            
-            # 天数加 1 (Correctly using interval)
-            current_date += timedelta(days=interval)
+                logger.error(f"Processing failed: {label}, error: {e}", exc_info=True)
+                log_failure_to_csv(kwargs['billing_account_id'], kwargs['usage_day_start'], kwargs['usage_day_end'], e)
     
     elapsed = time.time() - start_time
     logger.info(f"Total execution time: {elapsed:.2f} seconds")
@@ -161,7 +258,8 @@ def detail_billing_id_day(invoice_month: str, calc_service: BillingCalculationSe
 
 
 
-def daily_cron_work():
+def daily_cron_work(engine=None, workers=None, resume=False):
+    # resume: 同一天的任务中断后续跑, 不清理临时表, 跳过本次运行已完成的天(窗口已变时由 month_task_day 清理重算)
     current_date = datetime.now().date()
     usage_day_start = current_date - timedelta(days=4)
     first_day=current_date.replace(day=1)
@@ -175,13 +273,14 @@ def daily_cron_work():
 
     #先清理临时表指定时间段分区
     sql_clkean_tmp=f"""
-    ALTER TABLE {target_table}
+    ALTER TABLE {temp_table}
     DELETE WHERE invoice_month='{invoice_month}'
     and usage_day >='{usage_day_start}'
     and usage_day <='{usage_day_end}'
     """
-    calc_service.execute_sql(sql_clkean_tmp)
-    month_task_day(invoice_month=invoice_month, usage_day_start=usage_day_start, usage_day_end=usage_day_end, target_table=temp_table, calc_service=calc_service)
+    if not resume:
+        calc_service.execute_sql(sql_clkean_tmp)
+    month_task_day(invoice_month=invoice_month, usage_day_start=usage_day_start, usage_day_end=usage_day_end, target_table=temp_table, calc_service=calc_service, engine=engine, workers=workers, resume=resume)
      # 清理目标表
     sql_clean_target=f"""
     ALTER TABLE {target_table}
@@ -201,6 +300,7 @@ def daily_cron_work():
     """
     calc_service.execute_sql(sql_merge)
     calc_service.send_feishu_alarm(f"今日任务执行结束： for invoice_month={invoice_month} from {usage_day_start} to {usage_day_end}")
+    calc_service.close()
 
 
 
@@ -224,6 +324,14 @@ def main():
     
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Billing calculation ETL')
+    parser.add_argument('--invoice-month', default="202601")
+    parser.add_argument('--workers', type=int, default=None,
+                        help='worker processes (default: etl.workers)')
+    parser.add_argument('--resume', action='store_true',
+                        help='skip usage days the progress ledger has as done')
+    args = parser.parse_args()
+
     #正式任务
     #main()
     
@@ -232,8 +340,10 @@ if __name__ == "__main__":
 
     #整月手动同步任务到临时表
     calc_service = BillingCalculationService()
-    invoice_month="202601"
+    invoice_month=args.invoice_month
     target_table="dwm_standard_daily_billing_calculated_tmp"
-    month_task_day(invoice_month,usage_day_start=None,usage_day_end=None,target_table=target_table, calc_service=calc_service )   
-    
-
+    try:
+        month_task_day(invoice_month,usage_day_start=None,usage_day_end=None,target_table=target_table, calc_service=calc_service, workers=args.workers, resume=args.resume)
+    finally:
+        # 保存查询统计并关闭连接
+        calc_service.close()
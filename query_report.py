@@ -0,0 +1,42 @@
+import argparse
+import glob
+
+import pandas as pd
+
+from billing_calculation_service import BillingCalculationService
+from client.query_stats import build_query_report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Rank the most expensive ETL queries of a run using system.query_log')
+    parser.add_argument('stats', nargs='+', help='query stats CSV file(s) or glob, e.g. logs/query_stats/query_stats_20260115_*.csv')
+    parser.add_argument('--config', default='config.yaml')
+    parser.add_argument('--top', type=int, default=20)
+    parser.add_argument('--flush', action='store_true', help='run SYSTEM FLUSH LOGS first so the latest queries are in query_log')
+    args = parser.parse_args()
+
+    paths = sorted({p for pattern in args.stats for p in glob.glob(pattern)})
+    if not paths:
+        print("No query stats files found")
+        return
+    stats_df = pd.concat([pd.read_csv(p) for p in paths], ignore_index=True)
+
+    calc_service = BillingCalculationService(args.config)
+    try:
+        if args.flush:
+            calc_service.execute_sql("SYSTEM FLUSH LOGS")
+        by_tag, top_queries = build_query_report(calc_service.client, stats_df, top=args.top)
+    finally:
+        calc_service.pool.close()
+        calc_service.client.close()
+
+    with pd.option_context('display.max_columns', None, 'display.width', 200, 'display.max_colwidth', 80):
+        print(f"--- {len(stats_df)} queries from {len(paths)} file(s), runs: {', '.join(stats_df['run_id'].astype(str).unique())} ---")
+        print("\n--- by caller ---")
+        print(by_tag)
+        print(f"\n--- top {args.top} statements by server time ---")
+        print(top_queries)
+
+
+if __name__ == "__main__":
+    main()
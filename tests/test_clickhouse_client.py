@@ -0,0 +1,44 @@
+import socket
+
+from clickhouse_driver import Client
+
+from client.clickhouse_client import BufferedConnection, ClickhouseClient
+
+
+def test_socket_buffers_are_set_before_connect(monkeypatch):
+    calls = []
+
+    class RecordingSocket(socket.socket):
+        def setsockopt(self, level, option, value):
+            calls.append(('setsockopt', option, value))
+            return super().setsockopt(level, option, value)
+
+        def connect(self, address):
+            calls.append(('connect',))
+            return super().connect(address)
+
+    server = socket.socket()
+    server.bind(('127.0.0.1', 0))
+    server.listen(1)
+    port = server.getsockname()[1]
+    try:
+        client = Client(host='127.0.0.1', port=port)
+        ClickhouseClient._set_socket_buffers(client, rcvbuf=1 << 20, sndbuf=1 << 19)
+        assert isinstance(client.connection, BufferedConnection)
+
+        monkeypatch.setattr(socket, 'socket', RecordingSocket)
+        sock = client.connection._create_socket('127.0.0.1', port)
+        try:
+            assert calls == [('setsockopt', socket.SO_RCVBUF, 1 << 20),
+                             ('setsockopt', socket.SO_SNDBUF, 1 << 19),
+                             ('connect',)]
+        finally:
+            sock.close()
+    finally:
+        server.close()
+
+
+def test_no_buffers_keeps_driver_connection():
+    client = Client(host='127.0.0.1', port=9000)
+    ClickhouseClient._set_socket_buffers(client)
+    assert not isinstance(client.connection, BufferedConnection)
@@ -0,0 +1,51 @@
+import numpy as np
+import pandas as pd
+
+from calculate.service import CalculateService
+
+TYPES = list(CalculateService.CREDIT_TYPE_FIELDS) + ['FEE_UTILIZATION_OFFSET', 'RESELLER_MARGIN']
+
+
+def _pivot_row(row):
+    """The former per-row pivot, as applied by DataFrame.apply(axis=1)."""
+    fields = CalculateService.CREDIT_TYPE_FIELDS
+    result = dict.fromkeys(fields.values(), 0.0)
+    for credit_type, amount in zip(row["credits_type"], row["credits_amount"]):
+        if credit_type in fields:
+            result[fields[credit_type]] = amount + result[fields[credit_type]]
+    result["internal_credits_cost"] = sum(row["credits_amount"]) if row["credits_amount"] else 0.0
+    result["internal_credits_consumption"] = result["internal_credits_cost"] - result["c_rm"]
+    return pd.Series(result)
+
+
+def _credits(rng, rows, mismatched=False):
+    types, amounts = [], []
+    for _ in range(rows):
+        n = int(rng.integers(0, 6))
+        types.append([TYPES[i] for i in rng.integers(0, len(TYPES), n)])
+        # 金额数组偶尔比类型数组长或短, zip 截断
+        extra = int(rng.integers(-1, 2)) if mismatched and n else 0
+        amounts.append(list(-rng.random(n + extra) * 10))
+    return pd.DataFrame({'credits_type': types, 'credits_amount': amounts}, index=rng.permutation(rows) + 100)
+
+
+def test_pivot_matches_the_row_wise_version_on_random_batches():
+    rng = np.random.default_rng(12)
+    for _ in range(50):
+        df = _credits(rng, 300, mismatched=bool(rng.integers(0, 2)))
+        expected = df.apply(_pivot_row, axis=1)
+        result = CalculateService._calculate_credits_all_type(df)
+        pd.testing.assert_frame_equal(result, expected[result.columns], check_exact=True)
+
+
+def test_numpy_arrays_and_nulls():
+    df = pd.DataFrame({
+        'credits_type': [np.array(['DISCOUNT', 'RESELLER_MARGIN', 'DISCOUNT', 'OTHER']), None, np.array([])],
+        'credits_amount': [np.array([-1.0, -0.5, -2.0, -4.0]), None, np.array([])],
+    })
+    result = CalculateService._calculate_credits_all_type(df)
+    assert result['c_discount'].tolist() == [-3.0, 0.0, 0.0]
+    assert result['c_rm'].tolist() == [-0.5, 0.0, 0.0]
+    # 未知类型只计入 internal_credits_cost
+    assert result['internal_credits_cost'].tolist() == [-7.5, 0.0, 0.0]
+    assert result['internal_credits_consumption'].tolist() == [-7.0, 0.0, 0.0]
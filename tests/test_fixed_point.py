@@ -0,0 +1,62 @@
+from fractions import Fraction
+
+import numpy as np
+import pytest
+
+from benchmarks.make_local_dataset import synthetic_dim_contract, synthetic_ods_day
+from calculate import fixed_point as fx
+from calculate.service import CalculateService
+
+RESULT_COLUMNS = ['internal_cost', 'internal_consumption', 'external_consumption', 'discount_amount']
+
+
+def _half_away(value: Fraction) -> int:
+    magnitude = abs(value)
+    rounded = int(magnitude + Fraction(1, 2))
+    return rounded if value >= 0 else -rounded
+
+
+def test_to_fixed_rounds_ties_away_from_zero():
+    values, valid = fx.to_fixed([2.5, -2.5, 0.5, -0.5, 1.49, float('nan')], scale=1)
+    assert values.tolist() == [3, -3, 1, -1, 1, 0]
+    assert valid.tolist() == [True] * 5 + [False]
+
+
+@pytest.mark.parametrize('amount, rate, product, quotient', [
+    (5, 500_000, 3, 10),            # 2.5 -> 3
+    (-5, 500_000, -3, -10),         # -2.5 -> -3
+    (3, -500_000, -2, -6),          # -1.5 -> -2
+    (3, 2_000_000, 6, 2),           # 3 / 2 = 1.5 -> 2
+    (-3, 2_000_000, -6, -2),        # -1.5 -> -2
+    (1, 3_000_000, 3, 0),           # 0.333 -> 0
+])
+def test_rate_operations_round_ties_away_from_zero(amount, rate, product, quotient):
+    amount, rate = np.array([amount], dtype=np.int64), np.array([rate], dtype=np.int64)
+    assert fx.mul_rate(amount, rate).tolist() == [product]
+    assert fx.div_rate(amount, rate).tolist() == [quotient]
+
+
+def test_rate_operations_match_exact_rationals_in_the_documented_range():
+    rng = np.random.default_rng(16)
+    # 模块说明的范围: 金额 < ~9e12 个单位, 费率 < ~9e6
+    amount = rng.integers(-9 * 10 ** 12, 9 * 10 ** 12, 5000, dtype=np.int64)
+    rate = rng.integers(-9 * 10 ** 6, 9 * 10 ** 6, 5000, dtype=np.int64)
+    rate[:1000] = rng.integers(1, 10, 1000)
+    rate[rate == 0] = fx.RATE_SCALE
+    pairs = list(zip(amount.tolist(), rate.tolist()))
+
+    assert fx.mul_rate(amount, rate).tolist() == [_half_away(Fraction(a * r, fx.RATE_SCALE)) for a, r in pairs]
+    assert fx.div_rate(amount, rate).tolist() == [_half_away(Fraction(a * fx.RATE_SCALE, r)) for a, r in pairs]
+
+
+@pytest.mark.parametrize('seed', range(10))
+def test_fixed_mode_stays_within_a_ten_thousandth_of_float_mode(seed):
+    ods = synthetic_ods_day(3000, '202601', '2026-01-01', seed=seed)
+    matcher = CalculateService.contract_matcher(synthetic_dim_contract(ods, '2026-01', seed=seed))
+    as_float = CalculateService.calculate_with_credits(ods.copy(), matcher)
+    as_fixed = CalculateService.calculate_with_credits(ods.copy(), matcher, money_mode='fixed')
+
+    for col in RESULT_COLUMNS:
+        expected, actual = as_float[col].to_numpy(), as_fixed[col].to_numpy()
+        np.testing.assert_array_equal(np.isnan(actual), np.isnan(expected), err_msg=col)
+        np.testing.assert_allclose(actual, expected, rtol=0, atol=1e-4, err_msg=col)
@@ -0,0 +1,78 @@
+from datetime import date, datetime
+import io
+
+import pyarrow as pa
+
+from client.http_client import HttpClickhouseClient
+
+QUERY = "SELECT min(usage_day), max(usage_day), max(etl_time), max(quantity) FROM t WHERE invoice_month = %(m)s"
+COLUMNS = ['min(usage_day)', 'max(usage_day)', 'max(etl_time)', 'max(quantity)']
+
+
+def _stream(table):
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+class FakeResponse:
+    def __init__(self, content):
+        self.content = content
+        self.raw = io.BytesIO(content)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def close(self):
+        pass
+
+
+def _client():
+    """Answers like ClickHouse: Date as UInt16 days, DateTime as UInt32 epoch seconds."""
+    client = HttpClickhouseClient()
+    result = pa.table({
+        COLUMNS[0]: pa.array([20454], pa.uint16()),
+        COLUMNS[1]: pa.array([None], pa.uint16()),
+        COLUMNS[2]: pa.array([1767225600], pa.uint32()),
+        COLUMNS[3]: pa.array([7], pa.uint32()),
+    })
+    describe = pa.table({'name': COLUMNS, 'type': ['Date', 'Nullable(Date)', 'DateTime', 'UInt32']})
+    replies = {
+        QUERY: result,
+        f"DESCRIBE TABLE ({QUERY})": describe,
+        'SELECT timezone()': pa.table({'timezone()': ['Asia/Shanghai']}),
+    }
+    client.posted = []
+
+    def post(query, params=None, settings=None, data=None, query_id=None, stream=False):
+        client.posted.append(query)
+        return FakeResponse(_stream(replies[query]))
+
+    client._post = post
+    return client
+
+
+def test_execute_returns_dates_and_server_local_datetimes():
+    client = _client()
+    rows = client.execute(QUERY, params={'m': '202601'})
+    assert rows == [(date(2026, 1, 1), None, datetime(2026, 1, 1, 8, 0), 7)]
+
+    # 列类型按查询文本缓存, 时区只查一次
+    client.execute(QUERY, params={'m': '202602'})
+    assert client.posted.count(f"DESCRIBE TABLE ({QUERY})") == 1
+    assert client.posted.count('SELECT timezone()') == 1
+
+
+def test_dataframes_get_dates_back():
+    client = _client()
+    df = client.query_dataframe(QUERY, params={'m': '202601'})
+    assert df[COLUMNS[0]].tolist() == [date(2026, 1, 1)]
+    assert df[COLUMNS[2]].tolist() == [datetime(2026, 1, 1, 8, 0)]
+
+    (batch,) = list(client.iterate_blocks(QUERY, params={'m': '202601'}))
+    assert batch[COLUMNS[0]].tolist() == [date(2026, 1, 1)]
+    assert batch[COLUMNS[3]].tolist() == [7]
@@ -0,0 +1,71 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from benchmarks.common import synthetic_calculated_frame
+from benchmarks.make_local_dataset import CREDIT_FIELDS
+from calculate.service import CalculateService
+
+
+def _mode4_row(row):
+    """The former per-row mode 4, as applied by DataFrame.apply(axis=1)."""
+    credit_part = 0.0
+    price_val = float(row["price"]) if row["price"] is not None else 1.0
+    discount_val = float(row["discount"]) if row["discount"] is not None else 1.0
+    if row["credit_fields"]:
+        for f in str(row["credit_fields"]).split('/'):
+            if price_val != 0:
+                credit_part += float(row[f]) / price_val
+    return (float(row["cost_at_list"]) * discount_val) + (credit_part * discount_val)
+
+
+def _batch(seed, rows=400):
+    """Mode 4 rows with every credit_fields value, zero / None prices and None discounts mixed in."""
+    rng = np.random.default_rng(seed)
+    df = synthetic_calculated_frame(rows, seed=seed)
+    df['mode'] = rng.integers(1, 5, rows)
+    df['credit_fields'] = np.array(CREDIT_FIELDS + ['', None], dtype=object)[rng.integers(0, len(CREDIT_FIELDS) + 2, rows)]
+    price = df['price'].round(4).astype(object)
+    price[rng.random(rows) < 0.1] = 0.0
+    price[rng.random(rows) < 0.1] = None
+    discount = df['discount'].round(4).astype(object)
+    discount[rng.random(rows) < 0.1] = None
+    df['price'] = price
+    df['discount'] = discount
+    df['external_consumption'] = 0.0
+    return df
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_vectorised_mode4_matches_the_row_wise_version(seed):
+    df = _batch(seed)
+    mode4 = df['mode'] == 4
+    expected = df.loc[mode4].apply(_mode4_row, axis=1).to_numpy(dtype=float)
+
+    CalculateService._calculate_mode4(df)
+
+    np.testing.assert_array_equal(df.loc[mode4, 'external_consumption'].to_numpy(dtype=float), expected)
+    assert (df.loc[~mode4, 'external_consumption'] == 0).all()
+
+
+def test_zero_price_skips_the_credit_part():
+    df = pd.DataFrame({
+        'mode': [4, 4, 4],
+        'price': pd.Series([0.0, None, 0.5], dtype=object),
+        'discount': pd.Series([0.9, 0.9, None], dtype=object),
+        'credit_fields': ['c_cud/c_sud'] * 3,
+        'cost_at_list': [10.0, 10.0, 10.0],
+        'c_cud': [-1.0, -1.0, -1.0],
+        'c_sud': [-2.0, -2.0, -2.0],
+        'external_consumption': 0.0,
+    })
+    CalculateService._calculate_mode4(df)
+    # 单价为 0 只算 cost_at_list; None 单价/折扣按 1.0
+    assert df['external_consumption'].tolist() == [10.0 * 0.9, 7.0 * 0.9, 10.0 + (-1.0 / 0.5 + -2.0 / 0.5)]
+
+
+def test_unknown_credit_field_is_an_error():
+    df = pd.DataFrame({'mode': [4], 'price': [1.0], 'discount': [1.0], 'credit_fields': ['c_nope'],
+                       'cost_at_list': [1.0], 'external_consumption': [0.0]})
+    with pytest.raises(Exception, match='calculate mode4 error'):
+        CalculateService._calculate_mode4(df)
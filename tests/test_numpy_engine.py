@@ -0,0 +1,45 @@
+import numpy as np
+import pytest
+
+from benchmarks.make_local_dataset import synthetic_dim_contract, synthetic_ods_day
+from calculate.overrides import PricingOverrides
+from calculate.service import CalculateService
+
+RESULT_COLUMNS = ['internal_cost', 'internal_consumption', 'external_consumption', 'discount_amount']
+
+
+def _day(seed, rows=500):
+    """An ODS day and its contracts with zero / null prices and discounts and unmatched accounts."""
+    rng = np.random.default_rng(seed)
+    ods = synthetic_ods_day(rows, '202601', '2026-01-01', seed=seed)
+    dim = synthetic_dim_contract(ods, '2026-01', seed=seed)
+    dim['discount'] = dim['discount'].astype(object)
+    dim['price'] = dim['price'].astype(object)
+    dim.loc[rng.random(len(dim)) < 0.1, 'price'] = 0.0
+    dim.loc[rng.random(len(dim)) < 0.05, 'price'] = None
+    dim.loc[rng.random(len(dim)) < 0.05, 'discount'] = None
+    dim = dim[rng.random(len(dim)) > 0.1]
+    accounts = ods['billing_account_id'].drop_duplicates().sample(n=20, random_state=seed).tolist()
+    overrides = PricingOverrides({'extra_discount': [{'rate': '28.5/27.2', 'accounts': accounts[:10]},
+                                                     {'rate': 0.88, 'accounts': accounts[10:]}]})
+    return ods, dim, overrides
+
+
+def _results(ods, dim, overrides, engine):
+    data = CalculateService.calculate_with_credits(ods.copy(), dim, overrides=overrides, engine=engine)
+    return data[RESULT_COLUMNS].to_numpy()
+
+
+@pytest.mark.parametrize('first_seed', range(0, 200, 50))
+def test_numpy_engine_is_bit_identical_to_pandas(first_seed):
+    for seed in range(first_seed, first_seed + 50):
+        ods, dim, overrides = _day(seed)
+        expected = _results(ods, dim, overrides, 'pandas')
+        actual = _results(ods, dim, overrides, 'numpy')
+        np.testing.assert_array_equal(actual, expected, err_msg=f'seed {seed}')
+
+
+def test_unknown_engine():
+    ods, dim, _ = _day(0)
+    with pytest.raises(ValueError, match='unknown engine'):
+        CalculateService.calculate_with_credits(ods, dim, engine='polars')
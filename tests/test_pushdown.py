@@ -0,0 +1,79 @@
+from contextlib import contextmanager
+
+import pytest
+
+from billing_calculation_service import BillingCalculationService
+
+SQL, CLEANUP, CHECK = 'INSERT', 'ALTER DELETE', 'SELECT count()'
+
+
+class FakeClient:
+    """Plays a script of results per statement: an exception is raised, anything else returned."""
+
+    def __init__(self, script):
+        self.script = {sql: list(results) for sql, results in script.items()}
+        self.calls = []
+
+    def execute(self, sql, params=None, tag=None):
+        self.calls.append(sql)
+        result = self.script[sql].pop(0)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+
+class FakePool:
+    def __init__(self, client):
+        self.client = client
+
+    @contextmanager
+    def lease(self):
+        yield self.client
+
+
+def _service(script, retries=2):
+    service = object.__new__(BillingCalculationService)
+    service.pool = FakePool(FakeClient(script))
+    service.pushdown_retries = retries
+    service.pushdown_retry_backoff = 0
+    return service
+
+
+def _run(service):
+    return service._run_pushdown_slice(SQL, CLEANUP, CHECK, '2026-01-01', {})
+
+
+def test_failed_cleanup_is_repeated_before_the_retry():
+    service = _service({
+        SQL: [ConnectionError('insert lost'), []],
+        CLEANUP: [ConnectionError('delete lost'), []],
+        CHECK: [[(0,)]],
+    })
+    _run(service)
+    assert service.pool.client.calls == [SQL, CLEANUP, CLEANUP, CHECK, SQL]
+
+
+def test_rows_left_after_cleanup_count_as_a_failed_cleanup():
+    service = _service({
+        SQL: [ConnectionError('insert lost'), []],
+        CLEANUP: [[], []],
+        CHECK: [[(5,)], [(0,)]],
+    })
+    _run(service)
+    assert service.pool.client.calls == [SQL, CLEANUP, CHECK, CLEANUP, CHECK, SQL]
+
+
+def test_last_attempt_keeps_the_insert_error():
+    insert_error = ConnectionError('insert lost')
+    service = _service({SQL: [insert_error], CLEANUP: [[]], CHECK: [[(0,)]]}, retries=0)
+    with pytest.raises(ConnectionError) as raised:
+        _run(service)
+    assert raised.value is insert_error
+
+
+def test_last_attempt_with_failed_cleanup_reports_partial_slice():
+    insert_error = ConnectionError('insert lost')
+    service = _service({SQL: [insert_error], CLEANUP: [ConnectionError('delete lost')]}, retries=0)
+    with pytest.raises(RuntimeError, match='may hold partial rows') as raised:
+        _run(service)
+    assert raised.value.__cause__ is insert_error
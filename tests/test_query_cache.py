@@ -0,0 +1,33 @@
+from datetime import date
+
+from benchmarks.make_local_dataset import synthetic_ods_day
+from billing_calculation_service import BillingCalculationService
+from client.local_backend import LocalBackend
+
+WHERE = "invoice_month = %(invoice_month)s AND usage_day = %(usage_day)s"
+
+
+def _probe(client, usage_day):
+    service = object.__new__(BillingCalculationService)
+    return service._table_version(client, 'ods_standard_daily_billing', WHERE,
+                                  {'invoice_month': '202601', 'usage_day': usage_day})
+
+
+def test_slice_version_is_stable_until_the_slice_partition_is_written():
+    ods = synthetic_ods_day(200, '202601', date(2026, 1, 1))
+    backend = LocalBackend()
+    backend.load_table('ods_standard_daily_billing', ods)
+    client = backend.client()
+
+    version = _probe(client, date(2026, 1, 1))
+    assert version.startswith('200|')
+    assert _probe(client, date(2026, 1, 1)) == version
+
+    backend.insert('ods_standard_daily_billing', ods.head(10))
+    assert _probe(client, date(2026, 1, 1)) != version
+
+
+def test_empty_slice_has_a_version():
+    backend = LocalBackend()
+    backend.load_table('ods_standard_daily_billing', synthetic_ods_day(10, '202601', date(2026, 1, 1)))
+    assert _probe(backend.client(), date(2026, 1, 2)).startswith('0|')
@@ -0,0 +1,90 @@
+from datetime import date
+
+import pandas as pd
+import pytest
+import yaml
+
+import main
+from benchmarks.make_local_dataset import synthetic_dim_contract, synthetic_ods_day
+from billing_calculation_service import BillingCalculationService
+from client.progress_ledger import ProgressLedger
+
+MONTH = '202601'
+TABLE = 'dwm_standard_daily_billing_calculated_tmp'
+DAY1, DAY2 = date(2026, 1, 1), date(2026, 1, 2)
+
+
+def test_ledger_resumes_only_the_latest_run_of_the_same_range(tmp_path):
+    ledger = ProgressLedger(str(tmp_path / 'ledger.sqlite'))
+    first = ledger.begin_run(MONTH, TABLE, DAY1, DAY2)
+    ledger.start_day(MONTH, TABLE, DAY1, first)
+    ledger.finish_day(MONTH, TABLE, DAY1, 10, first)
+    assert ledger.resumable_run(MONTH, TABLE, DAY1, DAY2) == first
+    assert ledger.done_days(MONTH, TABLE, first) == {'2026-01-01'}
+
+    # 窗口移动后是新的运行: 旧运行不可续跑, 它完成的天不算在新运行里
+    assert ledger.resumable_run(MONTH, TABLE, DAY1, date(2026, 1, 3)) is None
+    second = ledger.begin_run(MONTH, TABLE, DAY2, date(2026, 1, 3))
+    assert ledger.resumable_run(MONTH, TABLE, DAY1, DAY2) is None
+    assert ledger.done_days(MONTH, TABLE, second) == set()
+
+
+@pytest.fixture
+def service(tmp_path):
+    ods = pd.concat([synthetic_ods_day(3000, MONTH, day, seed=day.day) for day in (DAY1, DAY2)], ignore_index=True)
+    ods.to_parquet(tmp_path / 'ods.parquet', index=False)
+    synthetic_dim_contract(ods, '2026-01').to_parquet(tmp_path / 'dim.parquet', index=False)
+    config = {
+        'clickhouse': {'backend': 'local',
+                       'local': {'ods': str(tmp_path / 'ods.parquet'), 'dim_contract': str(tmp_path / 'dim.parquet')}},
+        'etl': {'query_stats_dir': str(tmp_path / 'stats'), 'progress_ledger': str(tmp_path / 'ledger.sqlite'),
+                'workers': 1},
+        'cache': {'enabled': False},
+    }
+    (tmp_path / 'config.yaml').write_text(yaml.safe_dump(config))
+    service = BillingCalculationService(str(tmp_path / 'config.yaml'))
+    service.send_feishu_alarm = lambda message: None
+    yield service
+    service.close()
+
+
+def _fail_once_after_insert(service, usage_day):
+    """The first insert of usage_day is written, then the run dies (a partial day in the target)."""
+    insert = service._insert_calculated_data
+    failed = []
+
+    def flaky(df, **kwargs):
+        insert(df, **kwargs)
+        if not failed and str(df['usage_day'].iloc[0]) == str(usage_day):
+            failed.append(True)
+            raise RuntimeError('interrupted')
+
+    service._insert_calculated_data = flaky
+
+
+def _rows_per_day(service):
+    rows = service.client.execute(f"SELECT usage_day, count() FROM billing.{TABLE} GROUP BY usage_day")
+    return {str(day)[:10]: count for day, count in rows}
+
+
+def test_resume_cleans_the_partial_day_and_keeps_done_days(service):
+    _fail_once_after_insert(service, DAY2)
+    main.month_task_day(MONTH, DAY1, DAY2, TABLE, service, engine='pandas', workers=1)
+    # 第二天的行已写入但没有完成: 续跑不清理的话会重复
+    assert _rows_per_day(service) == {'2026-01-01': 3000, '2026-01-02': 3000}
+    run = service.ledger.resumable_run(MONTH, TABLE, DAY1, DAY2)
+    assert service.ledger.partial_days(MONTH, TABLE, run) == {'2026-01-02'}
+
+    main.month_task_day(MONTH, DAY1, DAY2, TABLE, service, engine='pandas', workers=1, resume=True)
+    assert _rows_per_day(service) == {'2026-01-01': 3000, '2026-01-02': 3000}
+    assert service.ledger.resumable_run(MONTH, TABLE, DAY1, DAY2) == run
+    assert service.ledger.done_days(MONTH, TABLE, run) == {'2026-01-01', '2026-01-02'}
+
+
+def test_resume_of_another_range_recalculates_it(service):
+    # 前一次运行只覆盖第一天并已完成; 续跑新窗口时不能跳过它, 区间内的旧数据先删掉
+    main.month_task_day(MONTH, DAY1, DAY1, TABLE, service, engine='pandas', workers=1)
+    main.month_task_day(MONTH, DAY1, DAY2, TABLE, service, engine='pandas', workers=1, resume=True)
+    assert _rows_per_day(service) == {'2026-01-01': 3000, '2026-01-02': 3000}
+    run = service.ledger.resumable_run(MONTH, TABLE, DAY1, DAY2)
+    assert service.ledger.done_days(MONTH, TABLE, run) == {'2026-01-01', '2026-01-02'}
@@ -0,0 +1,49 @@
+from calculate.rule_dictionaries import RuleDictionaries, key_types
+from calculate.rule_matcher import RULES
+from calculate.sql_template import get_calculation_sql
+
+DIM_TYPES = {
+    'billing_account_id': 'LowCardinality(String)',
+    'project_id': 'Nullable(String)',
+    'service_description': 'LowCardinality(Nullable(String))',
+    'sku_id': 'String',
+    'mode': 'Nullable(Int8)',
+    'discount': 'Float64',
+}
+
+
+class RecordingClient:
+    def __init__(self):
+        self.statements = []
+
+    def execute(self, query, params=None, tag=None):
+        self.statements.append(query)
+        return []
+
+
+def test_key_types_drop_nullable_and_low_cardinality():
+    assert key_types(DIM_TYPES) == {'billing_account_id': 'String', 'sku_id': 'String',
+                                    'service_description': 'String', 'project_id': 'String'}
+    assert key_types({'project_id': 'Nullable(FixedString(20))'})['project_id'] == 'FixedString(20)'
+
+
+def test_ddl_reads_through_the_named_collection_without_credentials():
+    client = RecordingClient()
+    RuleDictionaries(source='billing_dim_contract').ensure(client, '2026-01', 'v1', DIM_TYPES)
+    ddl = [s for s in client.statements if s.startswith('CREATE')]
+    assert len(ddl) == len(RULES)
+    for statement in ddl:
+        assert "SOURCE(CLICKHOUSE(NAME billing_dim_contract DB 'billing' TABLE 'dim_contract'" in statement
+        assert 'USER' not in statement and 'PASSWORD' not in statement
+        assert '    project_id Nullable' not in statement and 'LowCardinality' not in statement
+    assert '    billing_account_id String,\n    sku_id String,' in ddl[1]
+    assert '    mode Nullable(Int8),' in ddl[0]
+
+
+def test_lookups_cast_keys_and_skip_null_keys():
+    dictionaries = {name: f"billing.dict_{name}" for name, _, _ in RULES}
+    sql = get_calculation_sql(dictionaries=dictionaries,
+                              dictionary_key_types={**key_types(DIM_TYPES), 'sku_id': 'FixedString(8)'})
+    assert ("if(s.billing_account_id IS NULL OR s.sku_id IS NULL, NULL, "
+            "dictGetOrNull('billing.dict_rule5', 'mode', tuple(CAST(assumeNotNull(s.billing_account_id) AS String), "
+            "CAST(assumeNotNull(s.sku_id) AS FixedString(8)))))") in sql
@@ -0,0 +1,92 @@
+from datetime import date
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from benchmarks.make_local_dataset import synthetic_dim_contract, synthetic_ods_day
+from calculate.rule_matcher import RULE_COLUMNS, RULES, ContractRuleMatcher
+from utils.enum import PROJECT_ID, SERVICE_DESCRIPTION, SKU_ID
+
+
+def _merge_update_tags(df, dim_df):
+    """RULE_COLUMNS as the former merge + DataFrame.update chain set them (df needs a 0..n-1 index)."""
+    df = df.copy()
+    df["mode"] = None
+    df["discount"] = pd.Series([np.nan] * len(df), dtype='float64')
+    df["price"] = pd.Series([np.nan] * len(df), dtype='float64')
+    df["credit_fields"] = None
+    df["customer_id"] = None
+    df["contract_id"] = None
+    has_value = pd.concat([dim_df[c].notna() for c in (PROJECT_ID, SERVICE_DESCRIPTION, SKU_ID)], axis=1).to_numpy()
+    for _, pattern, keys in RULES:
+        sub_dim_rule = dim_df[(has_value == np.array(pattern)).all(axis=1)]
+        if sub_dim_rule.empty:
+            continue
+        rule_df = pd.merge(df[keys], sub_dim_rule[keys + RULE_COLUMNS], on=keys, how='left')
+        df.update(rule_df[RULE_COLUMNS])
+    return df[RULE_COLUMNS]
+
+
+def _assert_same_tags(tags, expected):
+    for col in RULE_COLUMNS:
+        left, right = pd.Series(tags[col]), pd.Series(expected[col])
+        assert left.isna().tolist() == right.isna().tolist(), col
+        # merge 引入空值后 mode 变成 float, 只比较取值
+        assert left.dropna().astype(object).tolist() == right.dropna().astype(object).tolist(), col
+
+
+@pytest.fixture(scope='module')
+def month():
+    ods = pd.concat([synthetic_ods_day(2000, '202601', date(2026, 1, day), seed=day) for day in (1, 2)],
+                    ignore_index=True)
+    dim = synthetic_dim_contract(ods, '2026-01', seed=3)
+    # 部分规则行的列为空: 更具体的规则只覆盖它有值的列
+    rng = np.random.default_rng(3)
+    for col in ('discount', 'price', 'customer_id', 'credit_fields'):
+        dim.loc[rng.random(len(dim)) < 0.2, col] = None
+    return ods, dim
+
+
+def test_matcher_agrees_with_merge_update(month):
+    ods, dim = month
+    assert not dim.duplicated(['billing_account_id', PROJECT_ID, SERVICE_DESCRIPTION, SKU_ID]).any()
+
+    for start in range(0, len(ods), 1000):
+        batch = ods.iloc[start:start + 1000].reset_index(drop=True)
+        _assert_same_tags(ContractRuleMatcher(dim).match(batch), _merge_update_tags(batch, dim))
+
+
+def test_batch_index_does_not_matter(month):
+    ods, dim = month
+    batch = ods.iloc[:1000]
+    shuffled = batch.sample(frac=1, random_state=0)
+    shuffled.index = shuffled.index * 7 + 3
+    expected = _merge_update_tags(shuffled.reset_index(drop=True), dim)
+    _assert_same_tags(ContractRuleMatcher(dim).match(shuffled), expected)
+
+
+def test_duplicate_key_keeps_the_last_dim_row():
+    dim = pd.DataFrame({
+        'billing_account_id': ['A', 'A', 'A', 'A'],
+        PROJECT_ID: [None, None, 'p', 'p'],
+        SERVICE_DESCRIPTION: [None, None, None, None],
+        SKU_ID: [None, None, None, None],
+        'mode': [1, 2, 3, 4],
+        'discount': [0.1, 0.2, 0.3, None],
+        'price': [1.0, 2.0, 3.0, 4.0],
+        'credit_fields': ['c_cud', 'c_sud', None, None],
+        'customer_id': ['c1', 'c2', 'c3', 'c4'],
+        'contract_id': ['k1', 'k2', 'k3', 'k4'],
+    })
+    batch = pd.DataFrame({'billing_account_id': ['A', 'A', 'B'], PROJECT_ID: ['x', 'p', 'p'],
+                          SERVICE_DESCRIPTION: ['s', 's', 's'], SKU_ID: ['k', 'k', 'k']})
+    ContractRuleMatcher(dim).tag(batch)
+
+    # rule1 的两行键相同, 取后一行; rule2 的重复键同理, 且空值列不覆盖 rule1 的值
+    assert batch['mode'].tolist() == [2, 4, None]
+    assert batch['discount'].tolist()[:2] == [0.2, 0.2]
+    assert batch['price'].tolist()[:2] == [2.0, 4.0]
+    assert batch['credit_fields'].tolist() == ['c_sud', 'c_sud', None]
+    assert batch['contract_id'].tolist() == ['k2', 'k4', None]
+    assert np.isnan(batch['discount'].iloc[2])
@@ -0,0 +1,121 @@
+import math
+import re
+
+import pytest
+
+from calculate.rule_matcher import RULE_COLUMNS, RULES
+from calculate.sql_template import CALCULATED_COLUMNS, get_calculation_sql
+
+# 越具体的规则优先(与 ContractRuleMatcher 的覆盖顺序一致)
+PRECEDENCE = ['rule8', 'rule4', 'rule6', 'rule2', 'rule7', 'rule3', 'rule5', 'rule1']
+
+
+def _top_level_split(text):
+    parts, depth, current = [], 0, ''
+    for char in text:
+        depth += char == '('
+        depth -= char == ')'
+        if char == ',' and depth == 0:
+            parts.append(current.strip())
+            current = ''
+        else:
+            current += char
+    parts.append(current.strip())
+    return parts
+
+
+def _output_expressions(sql):
+    """The final SELECT's (name, expression) pairs: the alias, or the bare column."""
+    select = sql[sql.rindex('\nSELECT\n') + len('\nSELECT\n'):sql.rindex('\nFROM calculated')]
+    select = re.sub(r'--[^\n]*', '', select)
+    pairs = []
+    for expression in _top_level_split(select):
+        alias = re.search(r'\s+AS\s+(\w+)$', expression)
+        pairs.append((alias.group(1), expression[:alias.start()]) if alias else (expression, expression))
+    return pairs
+
+
+def _output_names(sql):
+    return [name for name, _ in _output_expressions(sql)]
+
+
+def _multi_if(*args):
+    for condition, value in zip(args[:-1:2], args[1::2]):
+        if condition:
+            return value
+    return args[-1]
+
+
+# 表达式中用到的 ClickHouse 函数
+_FUNCTIONS = {
+    'multiIf': _multi_if,
+    'ifNotFinite': lambda value, default: value if math.isfinite(value) else default,
+    'ifNull': lambda value, default: default if value is None else value,
+    'toFloat64': lambda value: None if value is None else float(value),
+    'nan': math.nan,
+}
+
+
+def _evaluate(expression, **columns):
+    """Evaluate a rendered arithmetic expression (no lambdas / arrays) for one row."""
+    expression = re.sub(r'(?<![<>!=])=(?!=)', '==', expression)
+    return eval(expression, dict(_FUNCTIONS), columns)
+
+
+def test_insert_and_select_columns_match_target_table():
+    for dictionaries in (None, {name: f"billing.dict_{name}" for name, _, _ in RULES}):
+        sql = get_calculation_sql(dictionaries=dictionaries)
+        insert_columns = re.search(r'INSERT INTO billing\.\w+ \(([^)]*)\)', sql).group(1).split(', ')
+        assert insert_columns == CALCULATED_COLUMNS
+        assert _output_names(sql) == CALCULATED_COLUMNS
+
+
+def test_descriptive_columns_get_python_engine_defaults():
+    sql = get_calculation_sql()
+    assert 'any(' not in sql
+    for column in ('sku_description', 'project_name', 'usage_pricing_unit', 'currency'):
+        assert f"'' AS {column}," in sql
+    assert 'toFloat64(0) AS currency_conversion_rate,' in sql
+
+
+@pytest.mark.parametrize('mode', [1, 2, 3, 4])
+@pytest.mark.parametrize('null_column', ['rule_discount', 'rule_price'])
+def test_null_discount_or_price_writes_zero_external_consumption(mode, null_column):
+    sql = get_calculation_sql()
+    rule = {'rule_mode': mode, 'rule_discount': 0.9, 'rule_price': 2.0, null_column: None}
+    row = dict(rule, discount_f=_evaluate(re.search(r'\s(\S.*) AS discount_f,', sql).group(1), **rule),
+               price_f=_evaluate(re.search(r'\s(\S.*) AS price_f,', sql).group(1), **rule),
+               internal_consumption=10.0, usage_amount_in_pricing_units=3.0, cost_at_list=12.0)
+    # 单价为空时选中的 credits / nan
+    row['mode4_credit_part'] = math.nan if null_column == 'rule_price' else 1.5
+    value = _evaluate(dict(_output_expressions(sql))['external_consumption'], **row)
+
+    # 用不到空列的模式照常计算, 其余与 Python 引擎写入的一样为 0
+    uses = {1: {'rule_discount'}, 2: {'rule_price'}, 3: {'rule_discount', 'rule_price'},
+            4: {'rule_discount', 'rule_price'}}[mode]
+    expected = 0.0 if null_column in uses else {1: 10.0 * 0.9, 2: 3.0 * 2.0}[mode]
+    assert value == expected
+
+
+def test_join_rules_coalesce_most_specific_first():
+    sql = get_calculation_sql()
+    for column in RULE_COLUMNS:
+        expected = ', '.join(f"{name}.{column}" for name in PRECEDENCE)
+        assert f"COALESCE({expected}) AS rule_{column}," in sql
+    assert 'join_use_nulls = 1' in sql
+
+
+def test_dictionary_rules_look_up_most_specific_first():
+    dictionaries = {name: f"billing.dict_{name}" for name, _, _ in RULES}
+    sql = get_calculation_sql(dictionaries=dictionaries)
+    value = re.search(r'(COALESCE\(.*\)) AS rule_mode,', sql).group(1)
+    assert re.findall(r"dictGetOrNull\('billing\.dict_(\w+)'", value) == PRECEDENCE
+    assert 'JOIN' not in sql
+    assert 'join_use_nulls' not in sql
+
+
+def test_settings_argument_is_not_modified():
+    settings = {'max_execution_time': 60}
+    sql = get_calculation_sql(settings=settings)
+    assert settings == {'max_execution_time': 60}
+    assert sql.rstrip().endswith('SETTINGS max_execution_time = 60, join_use_nulls = 1')
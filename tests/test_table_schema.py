@@ -0,0 +1,39 @@
+import numpy as np
+import pandas as pd
+
+from benchmarks.make_local_dataset import synthetic_dim_contract, synthetic_ods_day
+from calculate.service import CalculateService
+from client.local_backend import CALCULATED_TABLE_SCHEMA
+from client.table_schema import InsertPlan
+
+FLOAT_COLUMNS = [name for name, ch_type in CALCULATED_TABLE_SCHEMA if ch_type == 'Float64']
+
+
+def _unmatched_batch(rows=10):
+    ods = synthetic_ods_day(rows, '202601', '2026-01-01')
+    dim = synthetic_dim_contract(ods, '2026-01')
+    # 合同都属于其他账户: 批次里没有一行能匹配
+    dim['billing_account_id'] = 'no-such-account'
+    return CalculateService.calculate_with_credits(ods, dim, copy=False)
+
+
+def test_unmatched_batch_floats_are_zero_filled():
+    calculated = _unmatched_batch()
+    assert calculated['price'].isna().all()
+    assert calculated['discount'].isna().all()
+
+    inserted = InsertPlan(CALCULATED_TABLE_SCHEMA).apply(calculated)
+
+    for name in FLOAT_COLUMNS:
+        values = inserted[name].to_numpy()
+        assert values.dtype == np.float64, name
+        assert not np.isnan(values).any(), name
+    assert (inserted['price'] == 0).all()
+    assert (inserted['discount'] == 0).all()
+
+
+def test_float_column_without_nulls_is_not_copied():
+    values = np.arange(5, dtype=np.float64)
+    plan = InsertPlan([('cost', 'Float64')])
+    inserted = plan.apply(pd.DataFrame({'cost': values}, copy=False))
+    assert np.shares_memory(inserted['cost'].to_numpy(), values)